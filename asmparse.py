@@ -1,19 +1,22 @@
-import string
+import re
 
 import code
 from parsebase import *
 
-VARCHARS=string.ascii_letters+string.digits+"_$-"
-OPCHARS=string.ascii_letters
-
-def _numlike(c):
-	return c.isdigit() or c=='.'
+varchars=re.compile(r"[A-Za-z0-9_$-]*")
+opchars=re.compile(r"[A-Za-z]*")
+numchars=re.compile(r"[0-9.]*")
 
 class Parser(ParserBase):
-	def __init__(self,s=""):
+	def __init__(self,s="",inputs=True):
 		ParserBase.__init__(self,s)
+		self.inputs=inputs #whether unassigned registers are inputs
 		self.vars={} #name:graph node
 		self.consts={} #const:number node
+		self.values=code.Values() #shares structurally identical ops
+		self.labels={} #name:block node
+		self.declared=set() #names of labels which have been declared
+		self.args=[] #input nodes in order of first use
 		self.block=None
 		self.entry=None
 	
@@ -22,23 +25,15 @@ class Parser(ParserBase):
 			return None
 		
 		start=self.pos
-		while self.pos<len(self.text) and self.text[self.pos] in VARCHARS:
-			self.pos+=1
-		
-		self.col+=self.pos-start
-		name=self.text[start:self.pos]
-		
-		return name
+		self.pos=varchars.match(self.text,start).end()
+		return self.text[start:self.pos]
 	
 	def parse_labelvar(self):
 		if not self.maybe("#"):
 			return None
 		
 		start=self.pos
-		while self.pos<len(self.text) and self.text[self.pos] in VARCHARS:
-			self.pos+=1
-		
-		self.col+=self.pos-start
+		self.pos=varchars.match(self.text,start).end()
 		name=self.text[start:self.pos]
 		if not name:
 			return None
@@ -47,10 +42,7 @@ class Parser(ParserBase):
 	
 	def parse_const(self):
 		start=self.pos
-		while self.pos<len(self.text) and _numlike(self.text[self.pos]):
-			self.pos+=1
-			self.col+=1
-		
+		self.pos=numchars.match(self.text,start).end()
 		if start!=self.pos:
 			num=self.text[start:self.pos]
 			try:
@@ -59,18 +51,29 @@ class Parser(ParserBase):
 				val=float(num)
 			
 			try:
-				return self.consts[val]
+				return self.consts[code.constkey(val)]
 			except KeyError:
-				n=NumberNode(val)
-				self.consts[val]=n
+				n=code.number(val)
+				self.consts[code.constkey(val)]=n
 				return n
 		
 		return None
 	
 	def parse_val(self):
+		start=self.pos
 		var=self.parse_var()
 		if var is not None:
-			return self.vars[var]
+			try:
+				return self.vars[var]
+			except KeyError:
+				#Registers which are never assigned are inputs
+				if not self.inputs:
+					raise ParseError("Undefined register %{}".format(var),
+						*self.position(start)
+					)
+				node=self.vars[var]=code.arg(var,len(self.args))
+				self.args.append(node)
+				return node
 		
 		const=self.parse_const()
 		if const is not None:
@@ -78,12 +81,21 @@ class Parser(ParserBase):
 		
 		label=self.parse_labelvar()
 		if label:
-			return self.vars[label]
+			return self.label(label)
 		
 		return None
 	
+	def label(self,name):
+		'''
+		Return the block of a label, which may be declared after its use.
+		'''
+		try:
+			return self.labels[name]
+		except KeyError:
+			block=self.labels[name]=code.block()
+			return block
+	
 	def parse_label(self):
-		before=self.text[self.pos:]
 		label=self.parse_labelvar()
 		if label is not None:
 			if not self.maybe(":"):
@@ -91,7 +103,13 @@ class Parser(ParserBase):
 					"Label declarations require a colon.",self.line,self.col
 				)
 			
-			block=self.vars[label]=code.block()
+			if label in self.declared:
+				raise ParseError(
+					"Redeclaration of label {}".format(label),
+					self.line,self.col
+				)
+			self.declared.add(label)
+			block=self.label(label)
 			self.block.add(code.goto(block))
 			self.block=block
 			
@@ -101,9 +119,7 @@ class Parser(ParserBase):
 	
 	def parse_expr(self):
 		start=self.pos
-		while self.pos<len(self.text) and self.text[self.pos] in OPCHARS:
-			self.pos+=1
-		
+		self.pos=opchars.match(self.text,start).end()
 		if start==self.pos:
 			return None
 		
@@ -114,11 +130,9 @@ class Parser(ParserBase):
 			argc=1
 		else:
 			raise ParseError(
-				'Unknown op "{}"'.format(name),self.line,self.col
+				'Unknown op "{}"'.format(name),*self.position(start)
 			)
 		
-		self.col+=self.pos-start
-		
 		args=[]
 		for x in range(argc):
 			self.space()
@@ -128,7 +142,7 @@ class Parser(ParserBase):
 			else:
 				raise ParseError("Expected value",self.line,self.col)
 		
-		return code.do(name,*args)
+		return self.values.do(name,args)
 	
 	def parse_assign(self):
 		var=self.parse_var()
@@ -144,12 +158,15 @@ class Parser(ParserBase):
 			raise ParseError("Expected =",self.line,self.col)
 		self.space()
 		
-		self.vars[var]=self.parse_expr()
+		expr=self.parse_expr()
+		if expr is None:
+			raise ParseError("Expected expression",self.line,self.col)
+		self.vars[var]=expr
 		
 		return True
 	
 	def parse(self,s):
-		self.__init__(s)
+		self.__init__(s,self.inputs)
 		self.block=code.block()
 		self.entry=self.block
 		
@@ -162,11 +179,24 @@ class Parser(ParserBase):
 			
 			self.space()
 			expr=self.parse_expr()
+			if expr is not None:
+				self.block=self.block.add(expr)
 			
 			self.space()
 			label=self.parse_label()
 		
-		return code.Code(self.entry,self.consts)
+		if self.pos<self.length:
+			raise ParseError(
+				"Unexpected '{}'".format(self.text[self.pos]),
+				self.line,self.col
+			)
+		for name in self.labels:
+			if name not in self.declared:
+				raise ParseError("Undefined label {}".format(name),
+					self.line,self.col
+				)
+		
+		return code.Code(self.entry,self.args)
 
-def parse(s):
-	return Parser().parse(s)
\ No newline at end of file
+def parse(s,inputs=True):
+	return Parser(inputs=inputs).parse(s)
\ No newline at end of file
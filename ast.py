@@ -16,11 +16,12 @@ class ValueNode:
 	
 	def build(self,context):
 		#reuse constant nodes to conserve memory
+		key=code.constkey(self.val)
 		try:
-			return context.consts[self.val]
+			return context.consts[key]
 		except KeyError:
 			node=code.number(self.val)
-			context.consts[self.val]=node
+			context.consts[key]=node
 			return node
 
 class IdentNode:
@@ -31,7 +32,15 @@ class IdentNode:
 		return "%{}".format(self.tok.text)
 	
 	def build(self,context):
-		return context.vars[self.tok.text]
+		try:
+			return context.vars[self.tok.text]
+		except KeyError:
+			#Names which are never assigned are inputs of the program
+			if not context.inputs:
+				raise code.CodeError(
+					"Undefined variable {}".format(self.tok.text)
+				)
+			return context.arg(self.tok.text)
 
 class OperatorNode:
 	'''
@@ -49,7 +58,10 @@ class OperatorNode:
 		)
 	
 	def build(self,context):
-		return code.do(self.code,[arg.build(context) for arg in self.args])
+		return value(self,context)
+	
+	def make(self,context,args):
+		return context.values.do(self.code,args)
 
 class ReturnNode:
 	def __init__(self,tok,val):
@@ -60,7 +72,7 @@ class ReturnNode:
 		return "(return {})".format(self.val)
 	
 	def build(self,context):
-		return code.ret(self.val.build(context))
+		return code.ret(value(self.val,context))
 
 class GotoNode:
 	'''
@@ -101,8 +113,9 @@ class LabelNode:
 		next=code.block()
 		block.add(code.goto(next))
 		context.block=next
+		context.labels[self.label.text]=next
 		try:
-			for fix in context.fix[self.label.text]:
+			for fix in context.fix.pop(self.label.text):
 				fix.replace(next)
 		except KeyError:pass
 		return None
@@ -112,13 +125,13 @@ class CallNode:
 	A function call.
 	'''
 	def __init__(self,func,args):
-		def get_args(x):
-			if x.tok==",":
-				return [x.args[0]]+get_args(x.args[1])
-			return [x]
-		
+		#Arguments are a chain of , operators nested on the right
+		self.args=[]
+		while args.tok==",":
+			self.args.append(args.args[0])
+			args=args.args[1]
+		self.args.append(args)
 		self.tok=func
-		self.args=get_args(args)
 	
 	def __repr__(self):
 		return "(call {} {{{}}})".format(
@@ -126,7 +139,10 @@ class CallNode:
 		)
 	
 	def build(self,context):
-		return code.do("call",[arg.build(context) for arg in self.args])
+		return value(self,context)
+	
+	def make(self,context,args):
+		return code.do("call",args)
 
 class IfNode:
 	'''
@@ -138,15 +154,12 @@ class IfNode:
 		self.then=then
 	
 	def __repr__(self):
-		if self.body:
-			return "if({}){}".format(self.cond,self.body)
-		return "if({})".format(self.cond,self.body)
+		if self.then:
+			return "if({}){}".format(self.cond,self.then)
+		return "if({})".format(self.cond)
 	
 	def build(self,context):
-		cond=self.cond.build(context)
-		then=self.then.build(context)
-		context.block=context.block.add(code.ifnot(cond,then))
-		
+		statements([self],context)
 		return None
 
 class BlockNode:
@@ -157,12 +170,8 @@ class BlockNode:
 		return "{{{}}}".format(' '.join(repr(x) for x in self.ast))
 	
 	def build(self,context):
-		block=code.block()
-		for expr in self.ast:
-			x=expr.build(context)
-			if x is not None:
-				block.add(x)
-		return block
+		statements(self.ast,context)
+		return None
 
 class AssignNode:
 	def __init__(self,name,val):
@@ -173,7 +182,7 @@ class AssignNode:
 		return "({} = {})".format(self.name,self.val)
 	
 	def build(self,context):
-		context.vars[self.name.tok.text]=self.val.build(context)
+		context.vars[self.name.tok.text]=value(self.val,context)
 		
 		return None
 
@@ -185,25 +194,111 @@ class DeclNode(AssignNode):
 	def __repr__(self):
 		return "({} {} = {})".format(self.type,self.name,self.val)
 
+def value(node,context):
+	'''
+	Build the graph of a value node. Operators and calls are built after
+	their arguments, left to right, from an explicit stack so deep
+	expressions don't hit the recursion limit.
+	'''
+	stack=[(node,False)]
+	vals=[]
+	while stack:
+		top,ready=stack.pop()
+		if not isinstance(top,(OperatorNode,CallNode)):
+			vals.append(top.build(context))
+		elif ready:
+			n=len(top.args)
+			args=vals[len(vals)-n:]
+			del vals[len(vals)-n:]
+			vals.append(top.make(context,args))
+		else:
+			stack.append((top,True))
+			stack.extend((x,False) for x in reversed(top.args))
+	return vals[0]
+
+def statements(nodes,context):
+	'''
+	Build a list of statements into the blocks of context. The bodies of
+	ifs are built from the same work list instead of by recursion.
+	'''
+	stack=list(reversed(nodes))
+	while stack:
+		top=stack.pop()
+		if isinstance(top,IfNode):
+			#Skip to the block after the body if the condition is false,
+			# the body is built into the fallthrough block
+			cond=value(top.cond,context)
+			after=code.block()
+			context.block=context.block.add(code.ifnot(cond,after))
+			stack.append(after)
+			if isinstance(top.then,BlockNode):
+				stack.extend(reversed(top.then.ast))
+			else:
+				top.then.build(context)
+		elif isinstance(top,code.BlockNode):
+			#End of an if body
+			context.block.add(code.goto(top))
+			context.block=top
+		elif isinstance(top,BlockNode):
+			stack.extend(reversed(top.ast))
+		else:
+			x=top.build(context)
+			if x is not None:
+				context.block=context.block.add(x)
+
 class Context:
 	def __init__(self,parser):
 		self.vars={} #name:graph node
 		self.labels={} #name:graph node -> known labels
 		self.fix={} #name:[graph node] -> goto nodes to unknown labels
-		self.consts={} #val:const node
+		self.consts={} #constkey(val):const node
+		self.values=code.Values() #shares structurally identical ops
+		self.args=[] #input nodes in order of first use
+		self.inputs=parser is None or parser.inputs #see parse.Parser
 		self.block=code.block()
 		self.entry=self.block
+	
+	def arg(self,name):
+		node=code.arg(name,len(self.args))
+		self.args.append(node)
+		self.vars[name]=node
+		return node
+	
+	def finish(self):
+		'''
+		Check every goto found its label and return the entry block.
+		'''
+		for label in self.fix:
+			raise code.CodeError("Undefined label {}".format(label))
+		return self.entry
+
+def build(parts,parser):
+	'''
+	Build the statements of an iterable of lists of AST nodes into a Code,
+	each list as soon as it arrives, so it can be released before the next
+	one is made. An error building is only raised once parts is exhausted,
+	so errors making parts, like parse errors, still come first.
+	'''
+	context=Context(parser)
+	error=None
+	for nodes in parts:
+		if error is None:
+			try:
+				statements(nodes,context)
+			except Exception as e:
+				error=e
+	if error is not None:
+		raise error
+	return code.Code(context.finish(),context.args)
 
 class AST(list):
 	def flatten(self,parser,context):
-		for expr in self:
-			x=expr.build(context)
-			if x is not None:
-				context.block.add(x)
-		return context.entry
+		statements(self,context)
+		return context.finish()
 	
 	def build(self,parser):
-		return code.Code(self.flatten(parser,Context(parser)))
+		context=Context(parser)
+		return code.Code(self.flatten(parser,context),context.args)
 	
 	def copy(self):
 		return AST(list.copy(self))
@@ -218,7 +313,7 @@ class Opstack:
 	def __repr__(self):
 		return repr(self.stack)
 	
-	def push(self,op,ast):
+	def push(self,op,scope):
 		if op.args==2:
 			def wcond(a,b):
 				return (a.args==1 and a.priority>b.priority) or (
@@ -227,7 +322,7 @@ class Opstack:
 					)
 				)
 			while len(self.stack) and wcond(self.peek(),op):
-				self.pop(ast)
+				self.pop(scope)
 		
 		self.stack.append(op)
 	
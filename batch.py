@@ -0,0 +1,167 @@
+'''
+Compiles many independent Glu or gluasm sources at once over a pool of
+worker processes.
+
+Sources are grouped into chunks of about the same total length, so a few
+long sources don't leave the other workers idle and many short ones don't
+cost a round trip each. Workers parse, build, optimize and compile their
+chunk. Results which marshal, like the functions of the cpy3 target, come
+back as marshal data. The rest, like closures, come back as the optimized
+graph in the binary format of serialize and are compiled again in the
+parent.
+'''
+import pickle
+import os
+
+import shadow
+import parse
+import asmparse
+import compile as c
+import optimize as opt
+import serialize
+import cache
+
+#Chunks per worker, more balance the load better but cost more round trips
+CHUNKS=4
+
+builders={
+	"glu":parse.build,
+	"gluasm":asmparse.parse
+}
+
+def pool(workers):
+	'''
+	Return a pool of worker processes. Its module is loaded on first use,
+	not when this one is imported, since shadow.load swaps sys.path and
+	sys.modules for the whole process.
+	'''
+	#The pool imports traceback, which needs the standard library's tokenize
+	return shadow.load("concurrent.futures.process").ProcessPoolExecutor(
+		workers
+	)
+
+class BatchError(RuntimeError):
+	'''
+	Raised by compile_many for inputs which failed. errors maps the index of
+	every failed input to its exception, error is the first of them.
+	'''
+	def __init__(self,errors):
+		self.errors=errors
+		self.index=min(errors)
+		self.error=errors[self.index]
+		RuntimeError.__init__(self,"{} inputs failed, first is input {}: {}".format(
+			len(errors),self.index,self.error
+		))
+
+def pack_error(e):
+	'''
+	Return an exception in a form which survives pickling. Exceptions whose
+	__init__ takes other arguments than their args, like ParseError, can't
+	be unpickled as they are.
+	'''
+	x=(type(e),e.args,e.__dict__)
+	try:
+		pickle.dumps(x)
+		return x
+	except Exception:
+		return (RuntimeError,("{}: {}".format(type(e).__name__,e),),{})
+
+def unpack_error(x):
+	cls,args,state=x
+	e=cls.__new__(cls,*args)
+	e.args=args
+	e.__dict__.update(state)
+	return e
+
+def build(source,lang,target,optimize):
+	'''
+	Compile a source, returning (kind, data) where kind is "marshal" for
+	marshal data of the result or "graph" for a serialized code graph which
+	still has to be compiled for target.
+	'''
+	graph=builders[lang](source)
+	if optimize:
+		graph=opt.optimize(graph,optimize)
+	data=cache.freeze(c.compile(graph,target,False))
+	if data is None:
+		return "graph",serialize.dumps(graph)
+	return "marshal",data
+
+def rebuild(kind,data,target):
+	'''
+	Return the compile result sent as (kind, data) by build.
+	'''
+	if kind=="marshal":
+		return cache.thaw(data)
+	return c.compile(serialize.loads(data),target,False)
+
+def work(chunk,lang,target,optimize):
+	'''
+	Compile a chunk of (index, source) in a worker, returning
+	(index, kind, data) for each where kind is that of build or "error".
+	'''
+	results=[]
+	for index,source in chunk:
+		try:
+			results.append((index,)+build(source,lang,target,optimize))
+		except Exception as e:
+			results.append((index,"error",pack_error(e)))
+	return results
+
+def chunks(items,n,size=len):
+	'''
+	Split items into lists of (index, item) of about equal total size,
+	aiming for n of them.
+	'''
+	sizes=[size(x) for x in items]
+	target=max(1,sum(sizes)//max(1,n))
+	chunk=[]
+	length=0
+	for index in range(len(items)):
+		chunk.append((index,items[index]))
+		length+=sizes[index]
+		if length>=target:
+			yield chunk
+			chunk=[]
+			length=0
+	if chunk:
+		yield chunk
+
+def compile_many(sources,lang="glu",target="cpy3",optimize=True,workers=None,
+		return_errors=False):
+	'''
+	Compile every source in sources, returning the results in the same
+	order. workers is the number of processes, the number of CPUs by
+	default. If any input fails a BatchError is raised after all of them
+	are done, unless return_errors is true, in which case the exception is
+	put in the place of its result.
+	'''
+	if lang not in builders:
+		raise ValueError("Unknown source language {}".format(lang))
+	sources=list(sources)
+	if workers is None:
+		workers=os.cpu_count() or 1
+	workers=max(1,min(workers,len(sources)))
+	
+	results=[None]*len(sources)
+	errors={}
+	with pool(workers) as executor:
+		jobs=[
+			executor.submit(work,x,lang,target,optimize)
+			for x in chunks(sources,workers*CHUNKS)
+		]
+		for job in jobs:
+			for index,kind,data in job.result():
+				if kind=="error":
+					errors[index]=unpack_error(data)
+					continue
+				try:
+					results[index]=rebuild(kind,data,target)
+				except Exception as e:
+					errors[index]=e
+	
+	if errors and not return_errors:
+		raise BatchError(errors)
+	for index,e in errors.items():
+		results[index]=e
+	return results
@@ -0,0 +1,32 @@
+'''
+Benchmarks for the Glu toolchain. Each module is a script which should be run
+from the repository root, eg python -m bench.scanner
+'''
+import time
+
+def best(f,*args,repeat=3):
+	'''
+	Return the best wall time in seconds of f(*args) over a few runs.
+	'''
+	t=None
+	for x in range(repeat):
+		start=time.perf_counter()
+		f(*args)
+		elapsed=time.perf_counter()-start
+		if t is None or elapsed<t:
+			t=elapsed
+	return t
+
+def scaling(name,make,run,sizes,unit="chars"):
+	'''
+	Print how long run(make(n)) takes for each n in sizes along with the time
+	per unit of input. A linear algorithm keeps the last column flat.
+	'''
+	print(name)
+	for n in sizes:
+		x=make(n)
+		size=len(x)
+		t=best(run,x)
+		print("  {:>10} {}  {:>9.4f} s  {:>8.1f} ns/{}".format(
+			size,unit,t,t/size*1e9,unit.rstrip("s")
+		))
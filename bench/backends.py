@@ -0,0 +1,45 @@
+'''
+Run time of the same program through the interpreter and each compiled
+backend.
+'''
+import asmparse
+import interpret
+import closurecompile
+import code
+from bench import best
+from bench.interpreter import program
+
+def backends(graph):
+	'''
+	Return (name, function) for every backend which can run on this Python.
+	'''
+	prog=interpret.decode(graph,optimize=False)
+	yield "interpreter",lambda:interpret.run(prog)
+	yield "closure",closurecompile.compile(graph)
+	try:
+		import cpy3compile
+		yield "cpy3",cpy3compile.compile(graph)
+	except Exception as e:
+		print("cpy3 unavailable: {}".format(e))
+
+def main():
+	graph=asmparse.parse(program(2000))
+	count=len(code.lower(graph).code)
+	runs=50
+	
+	expect=None
+	for name,f in backends(graph):
+		if expect is None:
+			expect=f()
+		assert f()==expect,name
+		
+		def many():
+			for x in range(runs):
+				f()
+		t=best(many)
+		print("{:>12} {:>10.1f} us/run {:>12.0f} ops/s".format(
+			name,t/runs*1e6,count*runs/t
+		))
+
+if __name__=="__main__":
+	main()
\ No newline at end of file
@@ -0,0 +1,31 @@
+'''
+Time to compile a batch of generated programs with compile_many against the
+number of worker processes. With enough CPUs the time falls close to
+linearly as workers are added.
+'''
+import os
+import time
+import glu
+from bench import generate
+
+def main():
+	sources=[generate.glu(100+x%7*50,seed=x) for x in range(200)]
+	start=time.perf_counter()
+	for s in sources:
+		glu.compile(s,cache=None)
+	serial=time.perf_counter()-start
+	print("{:>8} {:>9.3f} s".format("serial",serial))
+	
+	cpus=os.cpu_count() or 1
+	workers=1
+	while True:
+		start=time.perf_counter()
+		glu.compile_many(sources,workers=workers)
+		t=time.perf_counter()-start
+		print("{:>8} {:>9.3f} s {:>7.2f}x".format(workers,t,serial/t))
+		if workers>=cpus:
+			break
+		workers=min(workers*2,cpus)
+
+if __name__=="__main__":
+	main()
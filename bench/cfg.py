@@ -0,0 +1,39 @@
+'''
+Blocks, lowered opcodes and registers of a label-heavy program, and the
+interpreter's run time on it, with and without the control flow cleanup.
+'''
+import parse
+import code
+import interpret
+import optimize
+from bench import best
+
+def program(n):
+	'''
+	glu with n sections, each a value, a couple of labels and a branch
+	jumping over a return to the next section.
+	'''
+	return ' '.join(
+		"number v{0} = x*{0}; label a{0}; label b{0}; "
+		"if(v{0}-y){{goto c{0}}} return v{0}+y; label c{0};".format(x)
+		for x in range(n)
+	)+" return x*y"
+
+def main():
+	source=program(300)
+	runs=2000
+	for name,passes in (("fold",optimize.fold),("fold+clean",optimize.optimize)):
+		graph=passes(parse.build(source))
+		asm=code.lower(graph)
+		prog=interpret.decode(asm)
+		def many():
+			for x in range(runs):
+				interpret.run(prog,7,-1)
+		t=best(many)
+		print("{:>10} {:>6} blocks {:>6} ops {:>6} regs {:>8.2f} us/run".format(
+			name,len(optimize.reachable(graph.entry)),len(asm.code),
+			asm.nregs,t/runs*1e6
+		))
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,53 @@
+'''
+How many op nodes value numbering saves when building the graphs of a few
+sample programs.
+'''
+import parse
+import ast
+import asmparse
+from bench import vectorize, interpreter, emitter
+
+SOURCES={
+	"vectorize":vectorize.SOURCE,
+	"quadratic":'''
+		if(b*b - 4*a*c) {
+			return (-b + (b*b - 4*a*c)/(2*a))/(2*a);
+		}
+		return -b/(2*a);
+	''',
+	"distance":'''
+		return (x1-x2)*(x1-x2) + (y1-y2)*(y1-y2) + (z1-z2)*(z1-z2);
+	''',
+	"horner":'''
+		return ((((3*x + 2)*x - 5)*x + 1)*x - 7)*(x*x + 1) + x*x*x;
+	''',
+	"lerp":'''
+		return a*(1-t) + b*t + (a*(1-t) + b*t)*(a*(1-t) + b*t);
+	'''
+}
+
+def glu(source):
+	context=ast.Context(None)
+	parse.parse(source).flatten(None,context)
+	return context.values
+
+def gluasm(source):
+	parser=asmparse.Parser()
+	parser.parse(source)
+	return parser.values
+
+def main():
+	programs=[(name,glu,x) for name,x in SOURCES.items()]+[
+		("chain",gluasm,interpreter.program(1000)),
+		("branches",gluasm,emitter.branches(1000))
+	]
+	print("{:>12} {:>8} {:>8} {:>8}".format("program","ops","shared","saved"))
+	for name,build,source in programs:
+		values=build(source)
+		total=len(values.table)+values.reused
+		print("{:>12} {:>8} {:>8} {:>7.0f}%".format(
+			name,total,values.reused,values.reused/total*100
+		))
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,73 @@
+'''
+Stages on inputs nested a million levels deep, which overflow the stack
+wherever a stage recurses once per level. Prints the time of each stage
+and the time per level.
+'''
+import time
+import tokenize
+import parse
+import compile
+
+DEPTH=1000000
+
+def parens(n):
+	return "return "+"("*n+"x"+")"*n+";"
+
+def right(n):
+	return "return "+"x+("*n+"y"+")"*n+";"
+
+def negs(n):
+	return "return "+"-"*n+"x;"
+
+def comment(n):
+	return "#("*n+" deep "+")#"*n+" return x;"
+
+def ifs(n):
+	return "if(x){"*n+"return 1;"+"}"*n+" return x;"
+
+def calls(n):
+	return "return "+"f("*n+"x"+")"*n+";"
+
+def stage(name,f,*args):
+	start=time.perf_counter()
+	x=f(*args)
+	t=time.perf_counter()-start
+	print("  {:<10} {:>8.3f} s {:>8.2f} us/level".format(name,t,t/DEPTH*1e6))
+	return x
+
+def comments(s):
+	tk=tokenize.Tokenizer(s)
+	return tk.parse_comment()
+
+def main():
+	for name,make in (("parens",parens),("right",right),("negs",negs)):
+		print(name)
+		s=make(DEPTH)
+		stage("tokenize",lambda:list(iter(tokenize.Tokenizer(s).next,None)))
+		tree=stage("parse",parse.parse,s)
+		graph=stage("build",tree.build,None)
+		f=stage("cpy3",compile.compile,graph,"cpy3")
+		print("  result {}".format(f(3,4) if name=="right" else f(3)))
+	
+	print("comment")
+	s=comment(DEPTH)
+	tok=stage("token",comments,s)
+	assert len(tok.text)==len(s)-len(" return x;")
+	stage("parse",parse.parse,s)
+	
+	print("ifs")
+	s=ifs(DEPTH)
+	tree=stage("parse",parse.parse,s)
+	graph=stage("build",tree.build,None)
+	stage("stream",parse.build,s)
+	f=stage("cpy3",compile.compile,graph,"cpy3")
+	print("  result {} {}".format(f(3),f(0)))
+	
+	#Calls have no target to run on, only parse them
+	print("calls")
+	s=calls(DEPTH)
+	tree=stage("parse",parse.parse,s)
+	stage("build",tree.build,None)
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,51 @@
+'''
+Compile time of the cpy3 target against the size of the code graph. A linear
+emitter keeps the time per node flat. The shared graph, where every value
+is used twice, also shows code size and locals stay linear.
+'''
+import asmparse
+import cpy3compile
+from bench import best
+from bench.interpreter import program
+
+def branches(n):
+	'''
+	gluasm for n conditional forward jumps to blocks placed after all of
+	them, then a loop jumping back over the whole program.
+	'''
+	lines=["#top:"]
+	for x in range(n):
+		lines.append("%c{} = sub %x {}".format(x,x))
+		lines.append("ifnot %c{} #l{}".format(x,x))
+	lines.append("ifnot %x #top")
+	lines.append("return 0")
+	for x in range(n):
+		lines.append("#l{}:".format(x))
+		lines.append("return {}".format(x))
+	return '\n'.join(lines)
+
+def shared(n):
+	'''
+	gluasm for n values each used by the next two, so all of them are named.
+	'''
+	lines=["%r0 = add %x 1","%r1 = mul %x 2"]
+	for x in range(2,n):
+		lines.append("%r{} = add %r{} %r{}".format(x,x-1,x-2))
+	lines.append("return %r{}".format(n-1))
+	return '\n'.join(lines)
+
+def main():
+	for name,make in (("chain",program),("branches",branches),("shared",shared)):
+		print(name)
+		for n in (1000,4000,16000,64000):
+			graph=asmparse.parse(make(n))
+			t=best(cpy3compile.compile,graph)
+			co=cpy3compile.compile(graph).__code__
+			print("  {:>8} nodes {:>9.4f} s {:>8.2f} us/node {:>8} units "
+				"{:>3} locals".format(
+					n,t,t/n*1e6,len(co.co_code)>>1,co.co_nlocals
+				)
+			)
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,207 @@
+'''
+Seeded generator of synthetic Glu and gluasm programs for benchmarks. The
+same seed and settings always give the same program.
+
+Programs read the inputs x and y, declare values built from earlier ones,
+branch forward over some of them and return an expression at the end.
+Branches only go forward so every program finishes, and division is only
+by nonzero constants so running one with float inputs never raises. The
+Glu and gluasm programs of the same seed and settings take the same
+inputs in the same order and compute the same results.
+
+ * size: number of statements
+ * depth: maximum nesting of each expression
+ * labels: fraction of statements which branch to or declare a label
+ * comments: fraction of statements followed by a comment (Glu only)
+ * nesting: maximum nesting of #( )# comments
+'''
+import random
+
+INPUTS=["x","y"]
+OPS=["+","-","*","/"]
+ASMOPS={"+":"add","-":"sub","*":"mul","/":"div"}
+
+class Generator:
+	def __init__(self,seed=0,size=1000,depth=3,labels=0.1,comments=0.1,
+			nesting=2):
+		self.random=random.Random(seed)
+		#Comments draw from their own stream so they don't change the code
+		self.noise=random.Random("comments{}".format(seed))
+		self.size=size
+		self.depth=depth
+		self.labels=labels
+		self.comments=comments
+		self.nesting=nesting
+	
+	def constant(self):
+		r=self.random
+		if r.random()<0.5:
+			return str(r.randint(1,9))
+		return "{}.{}".format(r.randint(0,9),r.randint(1,9))
+	
+	def tree(self,names,depth):
+		'''
+		Return a random expression as nested tuples, (op, left, right),
+		("neg", x) or a leaf string.
+		'''
+		r=self.random
+		if depth<=0 or r.random()<0.3:
+			if r.random()<0.75:
+				return r.choice(names)
+			return self.constant()
+		
+		if r.random()<0.1:
+			return ("neg",self.tree(names,depth-1))
+		op=r.choice(OPS)
+		if op=="/":
+			return (op,self.tree(names,depth-1),self.constant())
+		return (op,self.tree(names,depth-1),self.tree(names,depth-1))
+	
+	def plan(self):
+		'''
+		Yield the statements of a program as tuples, ("value", name, tree),
+		("branch", tree, label), ("label", label) and finally
+		("return", tree).
+		'''
+		r=self.random
+		names=list(INPUTS)
+		pending=[]
+		count=0
+		
+		#Inputs are numbered by first use, so use them in order up front
+		for name in INPUTS:
+			yield ("value","in_"+name,name)
+		for x in range(self.size):
+			if r.random()<self.labels:
+				if pending and r.random()<0.5:
+					yield ("label",pending.pop(r.randrange(len(pending))))
+				else:
+					label="l{}".format(count)
+					count+=1
+					pending.append(label)
+					yield ("branch",self.tree(names,self.depth),label)
+			else:
+				name="v{}".format(x)
+				yield ("value",name,self.tree(names,self.depth))
+				names.append(name)
+		
+		for label in pending:
+			yield ("label",label)
+		yield ("return",self.tree(names,self.depth))
+	
+	def comment(self):
+		r=self.noise
+		if r.random()<0.5:
+			return "# note {}\n".format(r.randint(0,999))
+		
+		parts=[]
+		depth=r.randint(1,self.nesting)
+		for x in range(depth):
+			parts.append("#( c{} ".format(x))
+		parts.append(")# "*depth)
+		return ''.join(parts)+"\n"
+	
+	def expr(self,tree):
+		'''
+		Return a tree as Glu source.
+		'''
+		#Explicit stack so deep expressions don't hit the recursion limit
+		out=[]
+		stack=[tree]
+		while stack:
+			top=stack.pop()
+			if isinstance(top,str):
+				out.append(top)
+			elif top[0]=="neg":
+				out.append("-(")
+				stack.extend((")",top[1]))
+			else:
+				op,a,b=top
+				out.append("(")
+				stack.extend((")",b," {} ".format(op),a))
+		return ''.join(out)
+	
+	def glu(self):
+		lines=[]
+		for s in self.plan():
+			if s[0]=="value":
+				lines.append("number {} = {};".format(s[1],self.expr(s[2])))
+			elif s[0]=="branch":
+				lines.append("if({}) {{ goto {}; }}".format(
+					self.expr(s[1]),s[2]
+				))
+			elif s[0]=="label":
+				lines.append("label {};".format(s[1]))
+			else:
+				lines.append("return {};".format(self.expr(s[1])))
+			
+			if self.noise.random()<self.comments:
+				lines.append(self.comment())
+		return '\n'.join(lines)
+	
+	def asm(self,tree,lines,temps):
+		'''
+		Add the gluasm computing a tree to lines, returning its value.
+		'''
+		if isinstance(tree,str):
+			if tree[0].isdigit():
+				return tree
+			return "%"+tree
+		
+		#Each op is emitted after its arguments, which are evaluated first
+		stack=[(tree,False)]
+		values=[]
+		while stack:
+			top,ready=stack.pop()
+			if isinstance(top,str):
+				values.append(top if top[0].isdigit() else "%"+top)
+			elif not ready:
+				stack.append((top,True))
+				stack.extend((x,False) for x in reversed(top[1:]))
+			else:
+				args=values[len(values)-len(top)+1:]
+				del values[len(values)-len(top)+1:]
+				reg="%t{}".format(temps[0])
+				temps[0]+=1
+				op="neg" if top[0]=="neg" else ASMOPS[top[0]]
+				lines.append("{} = {} {}".format(reg,op,' '.join(args)))
+				values.append(reg)
+		return values[0]
+	
+	def gluasm(self):
+		lines=[]
+		temps=[0]
+		for s in self.plan():
+			if s[0]=="value":
+				lines.append("%{} = alias {}".format(
+					s[1],self.asm(s[2],lines,temps)
+				))
+			elif s[0]=="branch":
+				#ifnot branches when its condition is false, unlike if, so
+				# skip over the jump instead
+				skip="s{}".format(temps[0])
+				temps[0]+=1
+				lines.append("ifnot {} #{}".format(
+					self.asm(s[1],lines,temps),skip
+				))
+				lines.append("goto #{}".format(s[2]))
+				lines.append("#{}:".format(skip))
+			elif s[0]=="label":
+				lines.append("#{}:".format(s[1]))
+			else:
+				lines.append("return {}".format(self.asm(s[1],lines,temps)))
+		return '\n'.join(lines)
+
+def glu(size=1000,seed=0,**options):
+	'''
+	Return a random Glu program, see the module for the options.
+	'''
+	return Generator(seed,size,**options).glu()
+
+def gluasm(size=1000,seed=0,**options):
+	'''
+	Return a random gluasm program, see the module for the options.
+	'''
+	options.pop("comments",None)
+	options.pop("nesting",None)
+	return Generator(seed,size,**options).gluasm()
@@ -0,0 +1,34 @@
+'''
+Latency of re-parsing after a one character edit with parse.reparse against
+parsing the whole source again.
+'''
+import time
+import parse
+from bench import best
+
+def source(n):
+	return ''.join(
+		"number x{0} = ({0}+2.5)*{0} / 3 - {0}; label l{0}\n".format(x)
+		for x in range(n)
+	)
+
+def main():
+	print("{:>10} {:>12} {:>12}".format("statements","full parse","reparse"))
+	for n in (1000,10000,100000):
+		s=source(n)
+		full=best(parse.track,s)
+		
+		#Alternate typing and deleting a digit in the middle of the source
+		result=parse.track(s)
+		offset=s.index("+2.5",len(s)//2)+1
+		edits=200
+		start=time.perf_counter()
+		for x in range(edits//2):
+			parse.reparse(result,offset,0,"1")
+			parse.reparse(result,offset,1,"")
+		edit=(time.perf_counter()-start)/edits
+		
+		print("{:>10} {:>10.2f}ms {:>10.3f}ms".format(n,full*1e3,edit*1e3))
+
+if __name__=="__main__":
+	main()
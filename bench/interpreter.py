@@ -0,0 +1,40 @@
+'''
+Instructions per second of the decoded register-file interpreter against
+the original Context loop on the same straight-line program.
+'''
+import asmparse
+import interpret
+import code
+from bench import best
+
+OPS=("add","sub","mul","add")
+
+def program(n):
+	lines=["%r0 = add 1 2"]
+	for x in range(1,n):
+		lines.append("%r{} = {} %r{} {}".format(x,OPS[x%len(OPS)],x-1,x%7+1))
+	lines.append("return %r{}".format(n-1))
+	return '\n'.join(lines)
+
+def main():
+	asm=code.lower(asmparse.parse(program(2000)))
+	prog=interpret.decode(asm)
+	count=len(asm.code)
+	runs=50
+	
+	assert interpret.run(prog)==interpret.interpret_context(asm)
+	
+	def context():
+		for x in range(runs):
+			interpret.interpret_context(asm)
+	
+	def decoded():
+		for x in range(runs):
+			interpret.run(prog)
+	
+	for name,f in (("Context loop",context),("decoded",decoded)):
+		t=best(f)
+		print("{:>14} {:>12.0f} instructions/s".format(name,count*runs/t))
+
+if __name__=="__main__":
+	main()
\ No newline at end of file
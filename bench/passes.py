@@ -0,0 +1,26 @@
+'''
+Time and changes of every pass at each optimization level on a generated
+program, and the cost of the analyses the pass manager caches.
+'''
+import parse
+import optimize
+from bench import best, generate
+
+def main():
+	source=generate.glu(2000,labels=0.2)
+	for level in range(len(optimize.levels)):
+		manager=optimize.PassManager(optimize.levels[level])
+		manager.run(parse.build(source))
+		print("level {}".format(level))
+		for x in manager.stats:
+			print("{:>10} {:>10.4f} s {:>8} changed {}".format(
+				x["pass"],x["seconds"],x["changed"],
+				" ".join(x["computed"])
+			))
+	
+	graph=optimize.optimize(parse.build(source))
+	for name,f in optimize.analyses.items():
+		print("{:>12} {:>10.4f} s".format(name,best(lambda:f(graph))))
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,228 @@
+'''
+Time and peak memory of each stage of the toolchain on generated programs:
+tokenizing, parsing and building the graph of Glu, parsing gluasm, then
+optimizing, compiling for every target and running the results.
+
+Results are printed and can be written to a JSON file with -o, which
+--compare reads back to show the change against an earlier run, eg
+	
+	python -m bench.pipeline -o before.json
+	(change something)
+	python -m bench.pipeline --compare before.json
+'''
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import tokenize
+import parse
+import asmparse
+import code
+import interpret
+import optimize
+import compile
+import numpycompile
+from bench import generate
+
+#Inputs every generated program is run with
+ARGS=(1.5,-0.75)
+
+def measure(run,setup=None,repeat=3):
+	'''
+	Return the best time of run(setup()) over a few runs, not counting
+	setup, and the peak memory traced during one more run.
+	'''
+	t=None
+	for x in range(repeat):
+		data=setup() if setup else None
+		start=time.perf_counter()
+		run(data)
+		elapsed=time.perf_counter()-start
+		if t is None or elapsed<t:
+			t=elapsed
+	
+	data=setup() if setup else None
+	tracemalloc.start()
+	try:
+		run(data)
+		peak=tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return t,peak
+
+class Pipeline:
+	def __init__(self,repeat=3,runs=20,rows=1<<16):
+		self.repeat=repeat
+		self.runs=runs
+		self.rows=rows
+		self.results=[]
+	
+	def stage(self,lang,name,units,unit,run,setup=None):
+		t,peak=measure(run,setup,self.repeat)
+		result={
+			"lang":lang,
+			"stage":name,
+			"seconds":t,
+			"units":units,
+			"unit":unit,
+			"throughput":units/t if t else None,
+			"peak_bytes":peak
+		}
+		self.results.append(result)
+		print("{:>7} {:<20} {:>10.4f} s {:>14.0f} {:<7} {:>10.1f} KB".format(
+			lang,name,t,result["throughput"] or 0,unit+"/s",peak/1e3
+		))
+		return result
+	
+	def tokenize(self,source):
+		tk=tokenize.Tokenizer(source)
+		while tk.next() is not None:
+			pass
+	
+	def glu(self,source):
+		chars=len(source)
+		self.stage("glu","tokenize",chars,"chars",lambda _:self.tokenize(source))
+		self.stage("glu","parse",chars,"chars",lambda _:parse.parse(source))
+		
+		def parsed():
+			p=parse.Parser()
+			return p,p.parse(source)
+		self.stage("glu","build",chars,"chars",
+			lambda x:x[1].build(x[0]),parsed
+		)
+		self.backends("glu",lambda:parse.build(source))
+	
+	def gluasm(self,source):
+		chars=len(source)
+		self.stage("gluasm","parse+build",chars,"chars",
+			lambda _:asmparse.parse(source)
+		)
+		self.backends("gluasm",lambda:asmparse.parse(source))
+	
+	def backends(self,lang,build):
+		'''
+		Time the stages after a graph is built. build returns a new graph.
+		'''
+		def optimized():
+			return optimize.optimize(build())
+		ops=len(code.lower(optimized()).code)
+		
+		self.stage(lang,"optimize",ops,"ops",optimize.optimize,build)
+		self.stage(lang,"lower",ops,"ops",code.lower,optimized)
+		
+		targets=[
+			("interpreter",lambda x:interpret.decode(x,optimize=False)),
+			("closure",lambda x:compile.compile(x,"closure",False)),
+			("cpy3",lambda x:compile.compile(x,"cpy3",False)),
+			("snow",lambda x:compile.compile(x,"snow",False))
+		]
+		if numpycompile.load() is not None:
+			targets.append(
+				("numpy",lambda x:compile.compile(x,"numpy",False))
+			)
+		
+		for name,make in targets:
+			self.stage(lang,"compile:"+name,ops,"ops",make,optimized)
+		
+		runs=self.runs
+		for name,make in targets:
+			f=make(optimized())
+			if name=="snow":
+				continue
+			elif name=="interpreter":
+				def run(_,prog=f):
+					for x in range(runs):
+						interpret.run(prog,*ARGS)
+			elif name=="numpy":
+				numpy=numpycompile.load()
+				columns=[numpy.full(self.rows,x) for x in ARGS]
+				def run(_,f=f):
+					f(*columns)
+				self.stage(lang,"execute:numpy",ops*self.rows,"ops",run)
+				continue
+			else:
+				def run(_,f=f):
+					for x in range(runs):
+						f(*ARGS)
+			self.stage(lang,"execute:"+name,ops*runs,"ops",run)
+
+def commit():
+	try:
+		return subprocess.run(
+			["git","rev-parse","HEAD"],capture_output=True,text=True,
+			check=True
+		).stdout.strip()
+	except (OSError,subprocess.CalledProcessError):
+		return None
+
+def compare(old,new):
+	'''
+	Print the time of every stage in new against the same stage in old.
+	'''
+	before={(x["lang"],x["stage"]):x for x in old["results"]}
+	print("\nagainst {}".format(old.get("commit")))
+	for x in new["results"]:
+		y=before.get((x["lang"],x["stage"]))
+		if y is None:
+			continue
+		print("{:>7} {:<20} {:>10.4f} s {:>10.4f} s {:>7.2f}x".format(
+			x["lang"],x["stage"],y["seconds"],x["seconds"],
+			y["seconds"]/x["seconds"]
+		))
+
+def main(argv=None):
+	ap=argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+	ap.add_argument("--seed",type=int,default=0)
+	ap.add_argument("--size",type=int,default=2000,help="statements")
+	ap.add_argument("--depth",type=int,default=3,help="expression depth")
+	ap.add_argument("--labels",type=float,default=0.1,
+		help="fraction of statements with labels or branches"
+	)
+	ap.add_argument("--comments",type=float,default=0.1,
+		help="fraction of statements followed by a comment"
+	)
+	ap.add_argument("--nesting",type=int,default=3,
+		help="maximum nesting of block comments"
+	)
+	ap.add_argument("--repeat",type=int,default=3)
+	ap.add_argument("--runs",type=int,default=20,
+		help="runs of each compiled program per timing"
+	)
+	ap.add_argument("-o","--output",help="write results to this JSON file")
+	ap.add_argument("--compare",help="JSON file of an earlier run")
+	args=ap.parse_args(argv)
+	
+	params={
+		"seed":args.seed,
+		"size":args.size,
+		"depth":args.depth,
+		"labels":args.labels,
+		"comments":args.comments,
+		"nesting":args.nesting
+	}
+	pipeline=Pipeline(args.repeat,args.runs)
+	pipeline.glu(generate.glu(**params))
+	pipeline.gluasm(generate.gluasm(**params))
+	
+	report={
+		"commit":commit(),
+		"python":sys.version,
+		"platform":platform.platform(),
+		"params":params,
+		"repeat":args.repeat,
+		"runs":args.runs,
+		"results":pipeline.results
+	}
+	if args.output:
+		with open(args.output,"w") as f:
+			json.dump(report,f,indent=1)
+	if args.compare:
+		with open(args.compare) as f:
+			compare(json.load(f),report)
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,30 @@
+'''
+Time to print code graphs to a text stream against their size. A linear
+printer keeps the time per node flat, on long chains nested inline as well
+as on graphs where every value is shared.
+'''
+import io
+import asmparse
+import code
+from bench import best
+from bench.interpreter import program
+from bench.emitter import branches, shared
+
+def main():
+	for name,make in (("chain",program),("shared",shared),("branches",branches)):
+		print(name)
+		for n in (1000,10000,100000):
+			graph=asmparse.parse(make(n))
+			def run():
+				code.dump(graph.entry,io.StringIO())
+			t=best(run)
+			print("  {:>8} nodes {:>9.4f} s {:>8.2f} us/node".format(
+				n,t,t/n*1e6
+			))
+	
+	graph=asmparse.parse(shared(100000))
+	out=code.show(graph.entry,maxnodes=20)
+	print("maxnodes=20: {} chars".format(len(out)))
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,38 @@
+'''
+Cost of profiling the interpreter: run against Profile.run with counters
+only and with timing, on a generated program. Also prints the ops the
+program spends its time in.
+'''
+import parse
+import interpret
+from bench import best, generate
+
+def main():
+	graph=parse.build(generate.glu(2000,labels=0.2))
+	prog=interpret.decode(graph)
+	args=(1.5,-0.75)
+	runs=200
+	
+	counted=interpret.Profile(prog)
+	timed=interpret.Profile(prog,timing=True)
+	for name,f in (
+		("run",lambda:interpret.run(prog,*args)),
+		("counters",lambda:counted.run(*args)),
+		("timing",lambda:timed.run(*args))
+	):
+		def many():
+			for x in range(runs):
+				f()
+		t=best(many)
+		print("{:>10} {:>10.1f} us/run".format(name,t/runs*1e6))
+	
+	report=timed.report()
+	print("{} instructions in {} runs".format(
+		report["instructions"],report["runs"]
+	))
+	ops=sorted(report["ops"].items(),key=lambda x:-x[1]["time"])
+	for op,x in ops:
+		print("{:>10} {:>10} {:>10.4f} s".format(op,x["count"],x["time"]))
+
+if __name__=="__main__":
+	main()
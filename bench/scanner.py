@@ -0,0 +1,38 @@
+'''
+Tokenizer scaling on ordinary and adversarial inputs.
+'''
+import tokenize
+from bench import scaling
+
+def statements(n):
+	return "number x{0} = ({0}+2.5)*x / 3 - y; #note\n".format(0)*n
+
+def operators(n):
+	return "-"*n
+
+def nested_comments(n):
+	return "#("*n+" x "+")#"*n
+
+def long_idents(n):
+	return "x"*n+" "+"y"*n
+
+def comment_lines(n):
+	return "# comment\n"*n
+
+def tokenize_all(s):
+	tk=tokenize.Tokenizer(s)
+	while tk.next() is not None:
+		pass
+
+def main():
+	scales=(10000,100000,1000000)
+	scaling("statements",lambda n:statements(n//40),tokenize_all,scales)
+	scaling("operator run",operators,tokenize_all,scales)
+	scaling("nested #( )# comments",lambda n:nested_comments(n//4),
+		tokenize_all,scales
+	)
+	scaling("long identifiers",lambda n:long_idents(n//2),tokenize_all,scales)
+	scaling("line comments",lambda n:comment_lines(n//10),tokenize_all,scales)
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,125 @@
+'''
+Round trip of code graphs through the binary format, checked against the
+graph in memory, that malformed input only raises CodeError, and load time
+from an mmapped file against parsing the same program from gluasm text.
+'''
+import random
+import struct
+import os
+import tempfile
+import asmparse
+import parse
+import code
+import interpret
+import serialize
+import optimize
+from bench import best, cse
+from bench.interpreter import program
+from bench.emitter import branches
+from bench.printer import shared
+
+def check(graph,*args):
+	'''
+	Assert a graph prints and runs the same after a round trip.
+	'''
+	#Only reachable users are written, drop the others so names match
+	optimize.Cleaner().prune(graph.entry)
+	data=serialize.dumps(graph)
+	copy=serialize.loads(data)
+	assert repr(copy)==repr(graph),(graph,copy)
+	assert [x.name for x in copy.args]==[x.name for x in graph.args]
+	assert serialize.dumps(copy)==data
+	
+	asm=code.lower(graph)
+	args=args or tuple(x+2 for x in range(len(asm.args)))
+	try:
+		want=interpret.interpret(asm,*args,optimize=False)
+	except ArithmeticError as e:
+		want=type(e)
+	try:
+		got=interpret.interpret(code.lower(copy),*args,optimize=False)
+	except ArithmeticError as e:
+		got=type(e)
+	assert got==want,(got,want)
+
+def constants():
+	'''
+	A graph adding up constants neither text syntax can write and inputs
+	with unusual names.
+	'''
+	names=("x","$y","π","lone\udcff")
+	args=[code.arg(name,x) for x,name in enumerate(names)]
+	x=args[0]
+	for val in (1.5e300,-2.5e-300,float("inf"),-0.0,0.0,2**63-1,-2**63,2**70,
+			-3**50,1,1.0):
+		x=code.do("add",[x,code.number(val)])
+	for arg in args[1:]:
+		x=code.do("sub",[x,arg])
+	entry=code.block()
+	entry.add(code.ret(x))
+	return code.Code(entry,args)
+
+def malformed(graph,trials=2000):
+	'''
+	Assert corrupted and truncated copies of a graph's data either load or
+	raise CodeError.
+	'''
+	data=serialize.dumps(graph)
+	def load(buf):
+		try:
+			serialize.loads(buf)
+		except code.CodeError:pass
+	
+	for n in range(len(data)):
+		load(data[:n])
+	
+	#Input names pointing past the data section, and bad UTF-8
+	nconsts=serialize.HEADER.unpack_from(data)[3]
+	start=serialize.HEADER.size+serialize.CONST.size*nconsts
+	for offset,size in ((1<<20,1),(0,1<<20),(0xffffffff,0xffffffff)):
+		bad=bytearray(data)
+		struct.pack_into("<II",bad,start,offset,size)
+		load(bytes(bad))
+	bad=bytearray(data)
+	bad[-1:]=b"\xff"
+	load(bytes(bad))
+	
+	rand=random.Random(0)
+	for x in range(trials):
+		bad=bytearray(data)
+		for y in range(rand.randint(1,4)):
+			bad[rand.randrange(len(bad))]=rand.randrange(256)
+		load(bytes(bad))
+
+def main():
+	for source in cse.SOURCES.values():
+		check(parse.build(source))
+	check(constants())
+	check(parse.build("label top; if(x){goto top} return x"),0)
+	for make in (program,shared,branches):
+		check(asmparse.parse(make(500)))
+	print("round trip ok")
+	
+	malformed(constants())
+	malformed(parse.build("label top; if(x){goto top} return x*y"))
+	print("malformed input ok")
+	
+	for name,make in (("chain",program),("shared",shared),("branches",branches)):
+		print(name)
+		for n in (1000,10000,30000):
+			source=make(n)
+			graph=asmparse.parse(source)
+			with tempfile.NamedTemporaryFile(delete=False) as f:
+				serialize.dump(graph,f)
+			try:
+				size=os.path.getsize(f.name)
+				tparse=best(asmparse.parse,source)
+				tload=best(serialize.load,f.name,True)
+			finally:
+				os.unlink(f.name)
+			print("  {:>8} nodes {:>9} bytes  parse {:>8.4f} s  load {:>8.4f} s".format(
+				n,size,tparse,tload
+			))
+
+if __name__=="__main__":
+	main()
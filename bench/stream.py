@@ -0,0 +1,31 @@
+'''
+Peak memory of the streaming tokenizer as the input grows. The source is
+generated lazily in chunks so the only memory in use is the tokenizer's.
+'''
+import tracemalloc
+import time
+import tokenize
+
+CHUNK="number x = (1+2.5)*x / 3 - y; #( a #( nested )# comment )#\n"*100
+
+def source(n):
+	for x in range(n):
+		yield CHUNK
+
+def main():
+	print("{:>10} {:>10} {:>10}".format("input","peak","time"))
+	for n in (10,50,250):
+		tracemalloc.start()
+		start=time.perf_counter()
+		tk=tokenize.StreamTokenizer(source(n))
+		while tk.next() is not None:
+			pass
+		elapsed=time.perf_counter()-start
+		peak=tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		print("{:>8.2f}MB {:>8.1f}KB {:>8.2f} s".format(
+			n*len(CHUNK)/1e6,peak/1e3,elapsed
+		))
+
+if __name__=="__main__":
+	main()
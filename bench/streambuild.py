@@ -0,0 +1,43 @@
+'''
+Peak memory of building a code graph from a source at once, with the whole
+AST in memory, against building it a statement at a time as it is parsed.
+The graph column is what the finished graph itself holds, which the
+streaming build should stay close to.
+'''
+import tracemalloc
+import time
+import io
+import parse
+from bench import generate
+
+def full(s):
+	p=parse.Parser()
+	return p.parse(s).build(p)
+
+def measure(f,s):
+	tracemalloc.start()
+	start=time.perf_counter()
+	graph=f(s)
+	elapsed=time.perf_counter()-start
+	size,peak=tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return size,peak,elapsed
+
+def main():
+	print("{:>10} {:>10} {:>10} {:>10} {:>10}".format(
+		"input","build","peak","graph","time"
+	))
+	for n in (1000,4000,16000):
+		s=generate.glu(n,seed=n,comments=0)
+		for name,f,src in (
+			("full",full,s),
+			("stream",parse.build,s),
+			("file",parse.build,io.StringIO(s))
+		):
+			size,peak,elapsed=measure(f,src)
+			print("{:>8.2f}MB {:>10} {:>8.2f}MB {:>8.2f}MB {:>8.2f} s".format(
+				len(s)/1e6,name,peak/1e6,size/1e6,elapsed
+			))
+
+if __name__=="__main__":
+	main()
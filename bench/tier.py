@@ -0,0 +1,47 @@
+'''
+Tiered execution against compiling up front, on generated programs run once
+and run many times. Prints the tier stats of the program run many times.
+'''
+import time
+import parse
+import compile
+import tier
+from bench import generate
+
+ARGS=(1.5,-0.75)
+
+def main():
+	sources=[generate.glu(200,seed=x) for x in range(50)]
+	
+	#Parsing costs the same either way, so it isn't timed
+	for name,make in (
+		("compile",lambda x:compile.compile(x)),
+		("tiered",lambda x:tier.Tiered(x))
+	):
+		graphs=[parse.build(x) for x in sources]
+		start=time.perf_counter()
+		for graph in graphs:
+			make(graph)(*ARGS)
+		print("run {} programs once {:>10} {:.4f} s".format(
+			len(graphs),name,time.perf_counter()-start
+		))
+	
+	runs=20000
+	for name,make in (
+		("compile",lambda x:compile.compile(x)),
+		("tiered",lambda x:tier.Tiered(x)),
+		("interpret",lambda x:tier.Tiered(x,calls=runs+1))
+	):
+		graph=parse.build(sources[0])
+		start=time.perf_counter()
+		f=make(graph)
+		for x in range(runs):
+			f(*ARGS)
+		print("run {} times {:>10} {:.4f} s".format(
+			runs,name,time.perf_counter()-start
+		))
+		if isinstance(f,tier.Tiered):
+			print(f.stats())
+
+if __name__=="__main__":
+	main()
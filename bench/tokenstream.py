@@ -0,0 +1,51 @@
+'''
+Memory per token and tokenizing/parsing throughput of tokenize.TokenStream
+against lists of token objects.
+'''
+import tracemalloc
+import tokenize
+import parse
+from bench import best
+
+SOURCE="number x{} = (1+2.5)*x / 3 - y; #( comment )#\n"
+
+def token_list(s):
+	tk=tokenize.Tokenizer(s)
+	out=[]
+	while True:
+		tok=tk.next()
+		if tok is None:
+			return out
+		out.append(tok)
+
+def traced(f,*args):
+	tracemalloc.start()
+	x=f(*args)
+	size=tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return x,size
+
+def main():
+	s=''.join(SOURCE.format(x) for x in range(5000))
+	
+	toks,objsize=traced(token_list,s)
+	stream,streamsize=traced(tokenize.TokenStream,s)
+	n=len(toks)
+	assert n==len(stream)
+	
+	print("{} tokens".format(n))
+	print("{:>14} {:>12} {:>12} {:>12}".format(
+		"","bytes/token","tokens/s","parse s"
+	))
+	for name,size,build,src in (
+		("token objects",objsize,token_list,s),
+		("TokenStream",streamsize,tokenize.TokenStream,stream)
+	):
+		t=best(build,s)
+		p=best(parse.parse,src)
+		print("{:>14} {:>12.1f} {:>12.0f} {:>12.3f}".format(
+			name,size/n,n/t,p
+		))
+
+if __name__=="__main__":
+	main()
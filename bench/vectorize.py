@@ -0,0 +1,44 @@
+'''
+Rows per second of a branching program run once per row through the
+interpreter against once over whole arrays by the numpy target, with a few
+chunk sizes.
+'''
+import parse
+import interpret
+import numpycompile
+from bench import best
+
+SOURCE='''
+number d = x*x - y;
+if(d) {
+	return (x + y)/d;
+}
+return -x*3 + y/2;
+'''
+
+def main():
+	numpy=numpycompile.load()
+	graph=parse.build(SOURCE)
+	rows=1<<20
+	x=numpy.arange(rows)%17-8
+	y=numpy.arange(rows)%13+1
+	
+	prog=interpret.decode(graph)
+	few=10000
+	xs,ys=x[:few].tolist(),y[:few].tolist()
+	def rowwise():
+		return [interpret.run(prog,a,b) for a,b in zip(xs,ys)]
+	expect=rowwise()
+	t=best(rowwise)
+	print("{:>18} {:>14.0f} rows/s".format("interpreter",few/t))
+	
+	for chunk in [None,1<<20,1<<15,1<<12]:
+		f=numpycompile.compile(graph,chunk)
+		assert f(x[:few],y[:few]).tolist()==expect
+		t=best(f,x,y)
+		print("{:>18} {:>14.0f} rows/s".format(
+			"numpy chunk={}".format(chunk),rows/t
+		))
+
+if __name__=="__main__":
+	main()
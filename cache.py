@@ -0,0 +1,182 @@
+'''
+Content-addressed cache for compiled Glu programs.
+
+Entries are keyed by a hash of the source text, the source language, the
+compile target and options, compile.VERSION and the running Python's
+bytecode tag. An in-memory LRU bounded by entry count and size sits in
+front of an optional directory of marshalled results.
+'''
+from collections import OrderedDict
+import threading
+import hashlib
+import marshal
+import types
+import sys
+import os
+
+import compile as c
+
+def freeze(x):
+	'''
+	Return the marshal data for a compile result, or None if it has none.
+	Functions are stored as their code objects, so closures can't be.
+	'''
+	if isinstance(x,types.FunctionType):
+		if x.__closure__:
+			return None
+		x=x.__code__
+	try:
+		return marshal.dumps(x)
+	except ValueError:
+		return None
+
+def thaw(data):
+	x=marshal.loads(data)
+	if isinstance(x,types.CodeType):
+		return types.FunctionType(x,{},x.co_name)
+	return x
+
+class CompileCache:
+	'''
+	Thread-safe two level compile cache. maxentries and maxbytes bound the
+	in-memory layer, where the size of an entry is the size of its marshal
+	data. If path is given, results are also stored as files there.
+	'''
+	def __init__(self,maxentries=1024,maxbytes=64<<20,path=None):
+		self.maxentries=maxentries
+		self.maxbytes=maxbytes
+		self.path=path
+		self.lock=threading.Lock()
+		self.entries=OrderedDict() #key:(result,size)
+		self.size=0
+		
+		self.hits=0
+		self.diskhits=0
+		self.misses=0
+		self.evictions=0
+	
+	def key(self,source,lang,target,options=None):
+		h=hashlib.sha256("{}\0{}\0{}\0{}\0{}\0".format(
+			lang,target,sorted((options or {}).items()),c.VERSION,
+			sys.implementation.cache_tag
+		).encode())
+		h.update(source.encode("utf-8","surrogatepass"))
+		return h.hexdigest()
+	
+	def get(self,source,lang,target,build,options=None):
+		'''
+		Return the cached result of compiling source, calling build() to
+		compile it on a miss. options is a dict of any other settings which
+		change the result. Sources which aren't a str, like file objects,
+		can't be hashed and are always compiled.
+		'''
+		if not isinstance(source,str):
+			return build()
+		
+		key=self.key(source,lang,target,options)
+		x=self.find(key)
+		if x is None:
+			x=build()
+			self.put(key,x)
+		return x
+	
+	def find(self,key):
+		'''
+		Return the result cached under key, or None on a miss.
+		'''
+		with self.lock:
+			try:
+				x,size=self.entries[key]
+				self.entries.move_to_end(key)
+				self.hits+=1
+				return x
+			except KeyError:pass
+		
+		data=self.load(key)
+		if data is not None:
+			x=thaw(data)
+			with self.lock:
+				self.diskhits+=1
+			self.store(key,x,len(data))
+			return x
+		
+		with self.lock:
+			self.misses+=1
+		return None
+	
+	def put(self,key,x):
+		'''
+		Cache the result x under key.
+		'''
+		data=freeze(x)
+		if data is None:
+			self.store(key,x,sys.getsizeof(x))
+		else:
+			self.store(key,x,len(data))
+			self.save(key,data)
+	
+	def store(self,key,x,size):
+		if size>self.maxbytes:
+			return
+		
+		with self.lock:
+			if key in self.entries:
+				return
+			self.entries[key]=(x,size)
+			self.size+=size
+			while len(self.entries)>self.maxentries or self.size>self.maxbytes:
+				_,(_,size)=self.entries.popitem(last=False)
+				self.size-=size
+				self.evictions+=1
+	
+	def file(self,key):
+		return os.path.join(self.path,key[:2],key[2:])
+	
+	def load(self,key):
+		if self.path is None:
+			return None
+		try:
+			with open(self.file(key),"rb") as f:
+				return f.read()
+		except OSError:
+			return None
+	
+	def save(self,key,data):
+		if self.path is None:
+			return
+		
+		#Write to a temporary file first so readers never see partial data
+		name=self.file(key)
+		tmp="{}.{}.{}.tmp".format(name,os.getpid(),threading.get_ident())
+		try:
+			os.makedirs(os.path.dirname(name),exist_ok=True)
+			with open(tmp,"wb") as f:
+				f.write(data)
+			os.replace(tmp,name)
+		except OSError:
+			try:
+				os.unlink(tmp)
+			except OSError:pass
+	
+	def clear(self):
+		'''
+		Empty the in-memory layer. Files on disk are left alone.
+		'''
+		with self.lock:
+			self.entries.clear()
+			self.size=0
+	
+	def stats(self):
+		with self.lock:
+			return {
+				"entries":len(self.entries),
+				"bytes":self.size,
+				"hits":self.hits,
+				"diskhits":self.diskhits,
+				"misses":self.misses,
+				"evictions":self.evictions
+			}
+
+#Shared by glu.compile and gluasm.compile, set GLU_CACHE_DIR to enable the
+# on-disk layer
+default=CompileCache(path=os.environ.get("GLU_CACHE_DIR") or None)
@@ -0,0 +1,114 @@
+'''
+Client of the compile and execute service in service.py, keeping a pool of
+open connections which concurrent requests share.
+	
+	async with client.Client(path) as c:
+		f=await c.compile("return x*2")
+		x=await c.exec("return x*2",21)
+'''
+import base64
+import json
+
+import shadow
+import batch
+import service
+
+asyncio=shadow.load("asyncio")
+
+class RemoteError(RuntimeError):
+	'''
+	Error raised by the service for a request. kind is the name of its
+	exception type.
+	'''
+	def __init__(self,kind,msg):
+		RuntimeError.__init__(self,"{}: {}".format(kind,msg))
+		self.kind=kind
+
+class Client:
+	'''
+	Connects to a service on the Unix socket path if given, else on host and
+	port. At most size connections are open at once, each running one
+	request at a time.
+	'''
+	def __init__(self,path=None,host="127.0.0.1",port=service.PORT,size=4):
+		self.path=path
+		self.host=host
+		self.port=port
+		self.idle=[] #(reader, writer) of open connections not in use
+		self.slots=asyncio.Semaphore(size)
+		self.id=0
+	
+	async def __aenter__(self):
+		return self
+	
+	async def __aexit__(self,*exc):
+		await self.close()
+	
+	async def connect(self):
+		if self.path is not None:
+			return await asyncio.open_unix_connection(self.path)
+		return await asyncio.open_connection(self.host,self.port)
+	
+	async def request(self,op,**fields):
+		'''
+		Send a request and return its result, raising RemoteError if it
+		failed.
+		'''
+		self.id+=1
+		fields.update(id=self.id,op=op)
+		line=json.dumps(fields).encode()+b"\n"
+		async with self.slots:
+			conn=self.idle.pop() if self.idle else await self.connect()
+			reader,writer=conn
+			try:
+				writer.write(line)
+				await writer.drain()
+				reply=await reader.readline()
+				if not reply:
+					raise ConnectionError("Service closed the connection")
+			except BaseException:
+				writer.close()
+				raise
+			self.idle.append(conn)
+		
+		response=json.loads(reply)
+		if not response["ok"]:
+			raise RemoteError(response["error"],response["message"])
+		return response["result"]
+	
+	async def compile(self,source,lang="glu",target="cpy3",optimize=True):
+		'''
+		Compile source on the service, returning the same result as
+		glu.compile or gluasm.compile.
+		'''
+		x=await self.request("compile",source=source,lang=lang,target=target,
+			optimize=optimize
+		)
+		return batch.rebuild(x["kind"],base64.b64decode(x["data"]),target)
+	
+	async def exec(self,source,*args,lang="glu",target="cpy3",optimize=True):
+		'''
+		Compile source and run it with args on the service.
+		'''
+		return await self.request("exec",source=source,args=args,lang=lang,
+			target=target,optimize=optimize
+		)
+	
+	async def eval(self,source,*args,optimize=True):
+		'''
+		Interpret gluasm source with args on the service.
+		'''
+		return await self.request("eval",source=source,args=args,
+			optimize=optimize
+		)
+	
+	async def stats(self):
+		return await self.request("stats")
+	
+	async def close(self):
+		while self.idle:
+			reader,writer=self.idle.pop()
+			writer.close()
+			try:
+				await writer.wait_closed()
+			except ConnectionError:pass
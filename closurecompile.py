@@ -0,0 +1,176 @@
+'''
+Compiles Glu code to a tree of Python closures. Every opcode becomes a
+closure which computes one register of a shared register file, and every
+block a closure which runs its opcodes and returns the block to run next.
+This doesn't depend on the layout of CPython's bytecode, so it works on any
+Python version.
+'''
+import code
+
+def add(d,a,b):
+	def step(r):
+		r[d]=r[a]+r[b]
+	return step
+
+def sub(d,a,b):
+	def step(r):
+		r[d]=r[a]-r[b]
+	return step
+
+def mul(d,a,b):
+	def step(r):
+		r[d]=r[a]*r[b]
+	return step
+
+def div(d,a,b):
+	def step(r):
+		r[d]=r[a]/r[b]
+	return step
+
+def neg(d,a):
+	def step(r):
+		r[d]=-r[a]
+	return step
+
+def alias(d,a):
+	def step(r):
+		r[d]=r[a]
+	return step
+
+steps={
+	"add":add,
+	"sub":sub,
+	"mul":mul,
+	"div":div,
+	"neg":neg,
+	"alias":alias
+}
+
+control={"goto","ifnot","return"}
+
+class CompileError(RuntimeError):
+	def __init__(self,msg,pc):
+		RuntimeError.__init__(self,"{} (Code {})".format(msg,pc))
+		self.pc=pc
+
+class Compiler:
+	def __init__(self):
+		self.asm=None
+		self.blocks=[] #block closures, by index
+		self.index={} #pc:block index
+	
+	def step(self,op,pc):
+		try:
+			make=steps[op.op]
+		except KeyError:
+			raise CompileError("Unknown op {}".format(op.op),pc)
+		return make(op.reg,*op.args)
+	
+	def block(self,start,end):
+		'''
+		Build the closure for the opcodes from start to end, the last of
+		which may be a control opcode.
+		'''
+		asm=self.asm
+		blocks=self.blocks
+		ret=asm.nregs
+		
+		last=asm.code[end-1] if end>start else None
+		if last is not None and last.op in control:
+			end-=1
+		else:
+			last=None
+		
+		body=[self.step(asm.code[pc],pc) for pc in range(start,end)]
+		
+		if last is None:
+			#Fall through to the next block, or off the end of the program
+			if end<len(asm.code):
+				n=self.index[end]
+				def tail(r):
+					return blocks[n]
+			else:
+				def tail(r):
+					r[ret]=None
+					return None
+		elif last.op=="goto":
+			n=self.index[asm.consts[last.args[0]-1].pc]
+			def tail(r):
+				return blocks[n]
+		elif last.op=="ifnot":
+			cond=last.args[0]
+			t=self.index[asm.consts[last.args[1]-1].pc]
+			n=self.index[end+1]
+			def tail(r):
+				if r[cond]:
+					return blocks[n]
+				return blocks[t]
+		else:
+			val=last.args[0]
+			def tail(r):
+				r[ret]=r[val]
+				return None
+		
+		if not body:
+			return tail
+		elif len(body)==1:
+			first=body[0]
+			def block(r):
+				first(r)
+				return tail(r)
+		else:
+			def block(r):
+				for step in body:
+					step(r)
+				return tail(r)
+		return block
+	
+	def compile(self,asm):
+		if isinstance(asm,code.Code):
+			asm=code.lower(asm)
+		self.asm=asm
+		
+		#Blocks start at the entry, at every label and after every control
+		# opcode
+		starts={0}
+		for c in asm.consts:
+			if isinstance(c,code.Label):
+				starts.add(c.pc)
+		for pc in range(len(asm.code)):
+			if asm.code[pc].op in control:
+				starts.add(pc+1)
+		starts=sorted(x for x in starts if x<=len(asm.code))
+		
+		self.index={starts[x]:x for x in range(len(starts))}
+		ends=starts[1:]+[len(asm.code)]
+		self.blocks=[None]*len(starts)
+		for x in range(len(starts)):
+			self.blocks[x]=self.block(starts[x],ends[x])
+		
+		#One extra register receives the return value
+		regs=[None]*(asm.nregs+1)
+		for x in range(len(asm.consts)):
+			regs[x+1]=asm.consts[x]
+		ret=asm.nregs
+		entry=self.blocks[0]
+		params=asm.args
+		
+		def glufunc(*args):
+			if len(args)!=len(params):
+				raise TypeError(
+					"glufunc takes {} arguments but {} were given".format(
+						len(params),len(args)
+					)
+				)
+			r=regs.copy()
+			for reg,val in zip(params,args):
+				r[reg]=val
+			block=entry
+			while block is not None:
+				block=block(r)
+			return r[ret]
+		
+		return glufunc
+
+def compile(asm):
+	return Compiler().compile(asm)
\ No newline at end of file
@@ -1,4 +1,6 @@
 import struct
+import sys
+import io
 
 noret={
 	"goto",
@@ -23,11 +25,18 @@ binary=[
 ]
 
 variadic=[
-	"phi"
+	"phi",
+	"call"
 ]
 
 opname=["nop"]+unary+binary+variadic
 
+#Ops which always give the same value for the same arguments
+pure={"add","sub","mul","div","neg","alias"}
+
+#Ops whose arguments can be swapped
+commutative={"add","mul"}
+
 opmap={opname[x]:x for x in range(len(opname))}
 
 class CodeError(RuntimeError):
@@ -59,22 +68,30 @@ class Opcode:
 		)
 
 class Memo:
+	'''
+	Numbers the nodes of a graph by identity in the order they're seen.
+	'''
 	def __init__(self):
-		self.memo=[]
+		self.memo={} #id(node):number
+		self.nodes=[] #keeps the numbered nodes alive so ids stay unique
 	
 	def has(self,x):
-		return x in self.memo
+		return id(x) in self.memo
 	
 	def id(self,x):
 		try:
-			return self.memo.index(x)
-		except ValueError:
-			self.memo.append(x)
-			return len(self.memo)-1
+			return self.memo[id(x)]
+		except KeyError:
+			self.nodes.append(x)
+			n=self.memo[id(x)]=len(self.nodes)-1
+			return n
 
 class GraphNode:
 	def __init__(self):
 		self.use=[]
+	
+	def __repr__(self):
+		return show(self)
 
 class FixNode(GraphNode):
 	'''
@@ -82,11 +99,6 @@ class FixNode(GraphNode):
 	mostly used with control nodes.
 	'''
 	
-	def __repr__(self,memo=None):
-		if memo is not None:
-			return "!{}".format(memo.id(self))
-		return "!!"
-	
 	def replace(self,node):
 		for use in self.use:
 			use.replace(self,node)
@@ -102,31 +114,13 @@ class OpNode(GraphNode):
 		GraphNode.__init__(self)
 		
 		if type(op) is int:
-			self.op=code.opname[op]
+			self.op=opname[op]
 		else:
 			self.op=op
 		self.args=args
 		for arg in args:
 			arg.use.append(self)
 	
-	def __repr__(self,memo=None):
-		if memo:
-			if memo.has(self):
-				return "%{}".format(memo.id(self))
-			
-			if len(self.use)>2:
-				return "(%{} = {} {})".format(
-					memo.id(self),self.op,' '.join(
-						x.__repr__(self) for x in self.args
-					)
-				)
-		else:
-			memo=Memo()
-		
-		return "({} {})".format(
-			self.op,' '.join(x.__repr__(memo) for x in self.args)
-		)
-	
 	def visit(self,visitor,data=None):
 		return visitor.visit_op(self,data)
 
@@ -136,12 +130,22 @@ class NumberNode(GraphNode):
 		
 		self.val=val
 	
-	def __repr__(self,memo=None):
-		return repr(self.val)
-	
 	def visit(self,visitor,data=None):
 		return visitor.visit_number(self,data)
 
+class ArgNode(GraphNode):
+	'''
+	Input of a program, index is its position in the argument list.
+	'''
+	def __init__(self,name,index):
+		GraphNode.__init__(self)
+		
+		self.name=name
+		self.index=index
+	
+	def visit(self,visitor,data=None):
+		return visitor.visit_arg(self,data)
+
 class ControlNode(GraphNode):
 	def __init__(self,block):
 		GraphNode.__init__(self)
@@ -154,39 +158,34 @@ class ControlNode(GraphNode):
 			self.block=new
 
 class ReturnNode(ControlNode):
-	def __repr__(self,memo=None):
-		return "(return {})".format(self.block.__repr__(memo))
-	
 	def visit(self,visitor,data=None):
 		return visitor.visit_return(self,data)
 
 class GotoNode(ControlNode):
-	def __repr__(self,memo=None):
-		return "(goto {})".format(self.block.__repr__(memo))
-	
 	def visit(self,visitor,data=None):
 		return visitor.visit_goto(self,data)
 
 class IfNode(ControlNode):
+	'''
+	Jumps to block if cond is false, else continues with next, the block
+	which BlockNode.add starts after it.
+	'''
 	def __init__(self,cond,block):
 		ControlNode.__init__(self,block)
 		
 		self.cond=cond
+		self.next=None
 		cond.use.append(self)
 	
-	def __repr__(self,memo=None):
-		return "(if {} {})".format(
-			self.cond.__repr__(memo),
-			self.block.__repr__(memo)
-		)
-	
 	def visit(self,visitor,data=None):
 		return visitor.visit_if(self,data)
 	
 	def replace(self,old,new):
-		ControlNode.__init__(self,old,new)
+		ControlNode.replace(self,old,new)
 		if self.cond==old:
 			self.cond=new
+		if self.next==old:
+			self.next=new
 
 class BlockNode(GraphNode):
 	def __init__(self):
@@ -195,57 +194,227 @@ class BlockNode(GraphNode):
 		self.nodes=[]
 		self.next=None
 	
-	def __repr__(self,memo=None):
-		def tabulate(x):
-			if x:
-				return "\t"+x.replace("\n","\n\t")
-			return x
-		
-		def stringify(self,memo):
-			content=self.nodes
-			if self.next is not None:
-				content=content+[self.next]
-			
-			if len(content):
-				return "{{\n{}\n}}".format(
-					tabulate('\n'.join(x.__repr__(memo) for x in content))
-				)
-			return "{}"
-		
-		if memo:
-			if memo.has(self):
-				return "#{}".format(memo.id(self))
-			
-			if len(self.use)>1:
-				return "#{}: {}".format(memo.id(self),stringify(self,memo))
-			return stringify(self,memo)
-		
-		return stringify(self,Memo())
-	
 	def visit(self,visitor,data=None):
 		return visitor.visit_block(self,data)
 	
 	def add(self,node):
 		if isinstance(node,ControlNode):
 			self.next=node
-			return BlockNode()
+			block=BlockNode()
+			if isinstance(node,IfNode):
+				node.next=block
+				block.use.append(node)
+			return block
 		else:
 			self.nodes.append(node)
 			return self
 
+class Printer:
+	'''
+	Writes graphs to a text stream in the syntax of their repr:
+	
+	 * Values print inline. An op with more than one use is named
+	   (%n = op args) where it's first printed and %n after that.
+	 * A block prints as its nodes and control node in braces, one per
+	   line. A block with more than one use is named #n: {...} the first
+	   time and #n after that.
+	 * The block after an if continues in the braces of the if's block.
+	
+	maxdepth limits how deeply blocks nest, deeper ones print as {...}.
+	maxnodes limits how many nodes are printed before the output is cut
+	off with "...".
+	'''
+	def __init__(self,stream,maxdepth=None,maxnodes=None):
+		self.stream=stream
+		self.maxdepth=maxdepth
+		self.maxnodes=maxnodes
+		self.memo=Memo()
+		self.buf=[]
+	
+	def write(self,s):
+		self.buf.append(s)
+		if len(self.buf)>=4096:
+			self.flush()
+	
+	def flush(self):
+		self.stream.write(''.join(self.buf))
+		self.buf=[]
+	
+	def lines(self,block):
+		'''
+		Return the nodes printed as lines in the braces of block.
+		'''
+		lines=[]
+		while True:
+			lines.extend(block.nodes)
+			ctl=block.next
+			if ctl is None:
+				break
+			lines.append(ctl)
+			if not isinstance(ctl,IfNode) or ctl.next is None:
+				break
+			
+			#The fallthrough continues here unless something else jumps to it
+			block=ctl.next
+			if len(block.use)>1 or self.memo.has(block):
+				lines.append(block)
+				break
+		return lines
+	
+	def expand(self,node,depth):
+		'''
+		Return what node prints as, a list of strings, nodes, None for a new
+		line and ints changing the indentation.
+		'''
+		memo=self.memo
+		if isinstance(node,OpNode):
+			if memo.has(node):
+				return ["%{}".format(memo.id(node))]
+			
+			if len(node.use)>1:
+				out=["(%{} = {}".format(memo.id(node),node.op)]
+			else:
+				out=["({}".format(node.op)]
+			for arg in node.args:
+				out+=[" ",arg]
+			out.append(")")
+			return out
+		elif isinstance(node,NumberNode):
+			return [repr(node.val)]
+		elif isinstance(node,ArgNode):
+			return ["${}".format(node.name)]
+		elif isinstance(node,FixNode):
+			return ["!{}".format(memo.id(node))]
+		elif isinstance(node,ReturnNode):
+			return ["(return ",node.block,")"]
+		elif isinstance(node,GotoNode):
+			return ["(goto ",node.block,")"]
+		elif isinstance(node,IfNode):
+			return ["(if ",node.cond," ",node.block,")"]
+		elif isinstance(node,BlockNode):
+			if memo.has(node):
+				return ["#{}".format(memo.id(node))]
+			
+			out=[]
+			if len(node.use)>1:
+				out.append("#{}: ".format(memo.id(node)))
+			
+			lines=self.lines(node)
+			if not lines:
+				out.append("{}")
+			elif self.maxdepth is not None and depth>=self.maxdepth:
+				out.append("{...}")
+			else:
+				out+=["{",1]
+				for line in lines:
+					out+=[None,line]
+				out+=[-1,None,"}"]
+			return out
+		
+		return [repr(node)]
+	
+	def print(self,node):
+		if isinstance(node,Code):
+			node=node.entry
+		count=0
+		depth=0
+		stack=[node]
+		while stack:
+			x=stack.pop()
+			if type(x) is str:
+				self.write(x)
+			elif type(x) is int:
+				depth+=x
+			elif x is None:
+				self.write("\n"+"\t"*depth)
+			else:
+				count+=1
+				if self.maxnodes is not None and count>self.maxnodes:
+					self.write("...")
+					break
+				stack.extend(reversed(self.expand(x,depth)))
+		self.flush()
+
+def dump(node,stream=None,maxdepth=None,maxnodes=None):
+	'''
+	Write a graph to stream, stdout by default. See Printer for the limits.
+	'''
+	if stream is None:
+		stream=sys.stdout
+	Printer(stream,maxdepth,maxnodes).print(node)
+
+def show(node,maxdepth=None,maxnodes=None):
+	'''
+	Return a graph printed as a string.
+	'''
+	stream=io.StringIO()
+	dump(node,stream,maxdepth,maxnodes)
+	return stream.getvalue()
+
+def constkey(val):
+	'''
+	Key telling constants apart, unlike == which mixes up 1 and 1.0 or 0.0
+	and -0.0.
+	'''
+	return (type(val),repr(val))
+
 def number(val):
 	if not isinstance(val,(int,float)):
 		raise TypeError("codegen.number(val) takes a number type.")
 	return NumberNode(val)
 
+def arg(name,index):
+	return ArgNode(name,index)
+
 def do(op,args):
 	if not isinstance(args,list):
 		args=[args]
 	
 	if op=="goto":
 		return GotoNode(args[0])
+	elif op=="return":
+		return ReturnNode(args[0])
+	elif op=="ifnot":
+		return IfNode(args[0],args[1])
 	return OpNode(op,args)
 
+class Values:
+	'''
+	Value numbering for graph builders. do returns the node made earlier for
+	a pure op applied to the same argument nodes, so every distinct value
+	has one node. Arguments of commutative ops are first put in the order
+	their nodes were seen. reused counts the nodes this saved.
+	'''
+	def __init__(self):
+		self.table={} #(op,id(arg)...):node
+		self.numbers={} #id(node):value number
+		self.reused=0
+	
+	def number(self,node):
+		try:
+			return self.numbers[id(node)]
+		except KeyError:
+			n=self.numbers[id(node)]=len(self.numbers)
+			return n
+	
+	def do(self,op,args):
+		if not isinstance(args,list):
+			args=[args]
+		if op not in pure:
+			return do(op,args)
+		
+		if op in commutative:
+			args=sorted(args,key=self.number)
+		key=(op,)+tuple(id(x) for x in args)
+		try:
+			node=self.table[key]
+			self.reused+=1
+			return node
+		except KeyError:
+			node=self.table[key]=do(op,args)
+			self.number(node)
+			return node
+
 def ret(val):
 	return ReturnNode(val)
 
@@ -259,8 +428,277 @@ def block():
 	return BlockNode()
 
 class Code:
-	def __init__(self,entry):
+	'''
+	A code graph. args are the ArgNodes of its inputs in order.
+	'''
+	def __init__(self,entry,args=None):
 		self.entry=entry
+		self.args=args or []
 	
 	def __repr__(self):
-		return repr(self.entry)
\ No newline at end of file
+		return show(self.entry)
+
+def copy(graph):
+	'''
+	Return a copy of a code graph with its reachable blocks, the values they
+	use and all of its args, for passes which change a graph in place.
+	'''
+	nodes={} #id(node):copy
+	args=[]
+	for x in graph.args:
+		node=nodes[id(x)]=ArgNode(x.name,x.index)
+		args.append(node)
+	
+	def value(node):
+		#Explicit stack so deep expressions don't hit the recursion limit
+		stack=[node]
+		while stack:
+			top=stack[-1]
+			if id(top) in nodes:
+				stack.pop()
+				continue
+			
+			if isinstance(top,OpNode):
+				missing=[x for x in top.args if id(x) not in nodes]
+				if missing:
+					stack.extend(missing)
+					continue
+				new=OpNode(top.op,[nodes[id(x)] for x in top.args])
+			elif isinstance(top,NumberNode):
+				new=NumberNode(top.val)
+			elif isinstance(top,ArgNode):
+				new=ArgNode(top.name,top.index)
+			else:
+				raise CodeError("{} is not a value".format(type(top).__name__))
+			nodes[id(top)]=new
+			stack.pop()
+		return nodes[id(node)]
+	
+	queue=[]
+	def block(node):
+		try:
+			return nodes[id(node)]
+		except KeyError:pass
+		
+		if isinstance(node,FixNode):
+			#Jumps to undefined labels stay so until the graph is lowered
+			new=nodes[id(node)]=FixNode()
+		else:
+			new=nodes[id(node)]=BlockNode()
+			queue.append(node)
+		return new
+	
+	entry=block(graph.entry)
+	while queue:
+		old=queue.pop()
+		new=nodes[id(old)]
+		new.nodes=[value(x) for x in old.nodes]
+		ctl=old.next
+		if ctl is None:
+			continue
+		elif isinstance(ctl,ReturnNode):
+			new.next=ReturnNode(value(ctl.block))
+		elif isinstance(ctl,GotoNode):
+			new.next=GotoNode(block(ctl.block))
+		elif isinstance(ctl,IfNode):
+			new.next=IfNode(value(ctl.cond),block(ctl.block))
+			if ctl.next is not None:
+				new.next.next=block(ctl.next)
+				new.next.next.use.append(new.next)
+		else:
+			raise CodeError(
+				"Unknown control node {}".format(type(ctl).__name__)
+			)
+	return Code(entry,args)
+
+class Label:
+	'''
+	Constant holding the position of a block in linear code.
+	'''
+	def __init__(self,pc=None):
+		self.pc=pc
+	
+	def __repr__(self):
+		return "#{}".format(self.pc)
+
+class Assembly:
+	'''
+	Linear form of a code graph. Register 0 means no value, registers 1 to
+	len(consts) hold the constants (numbers and labels) and the rest hold
+	the inputs and the results of the opcodes in code. args holds the
+	register of each input.
+	'''
+	def __init__(self):
+		self.consts=[]
+		self.code=[]
+		self.args=[]
+		self.nregs=1
+	
+	def __repr__(self):
+		return '\n'.join(repr(x) for x in self.code)
+
+class Lowering:
+	'''
+	Lays the blocks of a code graph out one after another and gives every
+	value a register. Blocks are placed right after the block which jumps
+	to them when possible, so most gotos become fallthroughs. A value is
+	reused in the block which computes it and in any blocks only reached
+	by falling through from there.
+	'''
+	def __init__(self):
+		self.consts=[]
+		self.constmap={} #constkey(val):const index
+		self.labels={} #id(block):const index of its label
+		self.memo={} #id(node):register within the current block
+		self.args={} #id(node):register of an input
+		self.code=[]
+		#Registers are numbered provisionally while lowering, constants as
+		# -1-index and opcode results from 1
+		self.nregs=0
+	
+	def const(self,val):
+		key=constkey(val)
+		try:
+			return -1-self.constmap[key]
+		except KeyError:
+			self.constmap[key]=len(self.consts)
+			self.consts.append(val)
+			return -len(self.consts)
+	
+	def label(self,block):
+		if isinstance(block,FixNode):
+			raise CodeError("Jump to an undefined label")
+		try:
+			return self.consts[self.labels[id(block)]]
+		except KeyError:
+			self.labels[id(block)]=len(self.consts)
+			self.consts.append(Label())
+			return self.consts[-1]
+	
+	def target(self,block,queue):
+		'''
+		Return the register of the label of a block which is jumped to,
+		queueing it if it hasn't been placed yet.
+		'''
+		if self.label(block).pc is None:
+			queue.append(block)
+		return -1-self.labels[id(block)]
+	
+	def known(self,node):
+		'''
+		Return the register of a value if it's already available, else None.
+		'''
+		if isinstance(node,NumberNode):
+			return self.const(node.val)
+		elif isinstance(node,ArgNode):
+			return self.args[id(node)]
+		elif not isinstance(node,OpNode):
+			raise CodeError("{} is not a value".format(type(node).__name__))
+		return self.memo.get(id(node))
+	
+	def value(self,node):
+		'''
+		Return the register of a value, emitting the opcodes which compute
+		it and any of its arguments not yet available in this block.
+		'''
+		reg=self.known(node)
+		if reg is not None:
+			return reg
+		
+		#Explicit stack so deep expressions don't hit the recursion limit
+		stack=[node]
+		while stack:
+			top=stack[-1]
+			if id(top) in self.memo:
+				stack.pop()
+				continue
+			
+			missing=[x for x in top.args if self.known(x) is None]
+			if missing:
+				stack.extend(reversed(missing))
+				continue
+			
+			stack.pop()
+			self.nregs+=1
+			self.memo[id(top)]=self.nregs
+			self.code.append(Opcode(
+				self.nregs,top.op,[self.known(x) for x in top.args]
+			))
+		
+		return self.memo[id(node)]
+	
+	def block(self,block,queue):
+		'''
+		Lower the contents of a block, returning the block which should be
+		placed right after it, if any.
+		'''
+		for node in block.nodes:
+			self.value(node)
+		
+		ctl=block.next
+		if ctl is None:
+			self.code.append(Opcode(0,"return",[0]))
+		elif isinstance(ctl,ReturnNode):
+			self.code.append(Opcode(0,"return",[self.value(ctl.block)]))
+		elif isinstance(ctl,GotoNode):
+			return self.fallthrough(ctl.block,queue)
+		elif isinstance(ctl,IfNode):
+			cond=self.value(ctl.cond)
+			self.code.append(
+				Opcode(0,"ifnot",[cond,self.target(ctl.block,queue)])
+			)
+			return self.fallthrough(ctl.next,queue)
+		else:
+			raise CodeError(
+				"Unknown control node {}".format(type(ctl).__name__)
+			)
+		return None
+	
+	def fallthrough(self,block,queue):
+		if self.label(block).pc is None:
+			return block
+		self.code.append(Opcode(0,"goto",[self.target(block,queue)]))
+		return None
+	
+	def lower(self,code):
+		#Inputs take the first registers after the constants
+		for arg in code.args:
+			self.nregs+=1
+			self.args[id(arg)]=self.nregs
+		
+		queue=[code.entry]
+		while queue:
+			block=queue.pop()
+			self.memo={}
+			while block is not None and self.label(block).pc is None:
+				#Values of the block before can be reused if it's the only
+				# way to get here
+				if len(block.use)>1:
+					self.memo={}
+				self.label(block).pc=len(self.code)
+				block=self.block(block,queue)
+		
+		n=len(self.consts)
+		def reg(x):
+			if x<0:
+				return -x
+			elif x:
+				return x+n
+			return 0
+		
+		for op in self.code:
+			op.reg=reg(op.reg)
+			op.args=[reg(x) for x in op.args]
+		
+		asm=Assembly()
+		asm.consts=self.consts
+		asm.code=self.code
+		asm.args=[reg(self.args[id(x)]) for x in code.args]
+		asm.nregs=1+n+self.nregs
+		return asm
+
+def lower(code):
+	'''
+	Convert a code graph to linear Assembly.
+	'''
+	return Lowering().lower(code)
\ No newline at end of file
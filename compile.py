@@ -1,10 +1,36 @@
 import cpy3compile
 import snowcompile
+import closurecompile
+import numpycompile
+import optimize as opt
+import code
 
-def compile(asm,target="cpy3"):
+#Bump whenever the output of any target changes, this invalidates cached
+# compile results
+VERSION=3
+
+def compile(asm,target="cpy3",optimize=True,**options):
+	'''
+	Compile a program for target, options are passed on to its compiler.
+	Code graphs are optimized first unless optimize is False, it can also be
+	an optimization level, see optimize.levels. A copy is optimized, so the
+	graph passed in doesn't change.
+	'''
+	manager=None
+	if optimize and isinstance(asm,code.Code):
+		#cpy3 reuses the analyses still valid after the last pass
+		manager=opt.PassManager(opt.levels[opt.tolevel(optimize)])
+		asm=manager.run(code.copy(asm))
+	
 	if target=="cpy3":
-		return cpy3compile.compile(asm)
+		return cpy3compile.compile(asm,manager,**options)
+	elif target=="closure":
+		return closurecompile.compile(asm,**options)
+	elif target=="numpy":
+		return numpycompile.compile(asm,**options)
 	elif target=="snow":
-		return snowcompile.compile(asm)
+		if isinstance(asm,code.Code):
+			asm=code.lower(asm)
+		return snowcompile.compile(asm,**options)
 	
 	raise NotImplementedError()
\ No newline at end of file
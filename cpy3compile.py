@@ -1,137 +1,470 @@
+'''
+Compiles Glu code to CPython bytecode. The wordcode layout, the opcodes and
+their inline caches change between versions, so the details are looked up
+from dis for the running interpreter. Versions this doesn't know how to
+target compile to closures instead.
+'''
 import code
-import struct
+import optimize
+import closurecompile
+import sys
 import dis
-from collections import deque
+
+#Versions whose bytecode this emits
+SUPPORTED=(3,11)<=sys.version_info[:2]<=(3,13)
 
 def f():pass
 
-func=type(f)
-pyco=type(f.__code__)
+template=f.__code__
 
-def pyop(x):
-	return struct.pack('b',dis.opmap[x])
+def caches(name):
+	'''
+	Return the number of inline cache entries which follow an opcode.
+	'''
+	entries=dis._inline_cache_entries
+	if isinstance(entries,dict):
+		return entries.get(name,0)
+	return entries[dis.opmap[name]]
 
-def pyarg(x):
-	return struct.pack("H",x)
+def nb(name):
+	'''
+	Return the BINARY_OP argument of a binary operator.
+	'''
+	return [x[0] for x in dis._nb_ops].index(name)
 
-def unary(x):
-	x=pyop(x)
-	def op_build(c,op,pypc):
-		pypc,a=c.visit(op.args[0],pypc)
-		return pypc+1,a+[x]
+if SUPPORTED:
+	binary={
+		"add":nb("NB_ADD"),
+		"sub":nb("NB_SUBTRACT"),
+		"mul":nb("NB_MULTIPLY"),
+		"div":nb("NB_TRUE_DIVIDE")
+	}
 	
-	return op_build
-
-def binary(x):
-	x=pyop(x)
-	def op_build(c,op,pypc):
-		pypc,a=c.visit(op.args[0],pypc)
-		pypc,b=c.visit(op.args[1],pypc)
-		return pypc+1,a+b+[x]
-	
-	return op_build
-
-pyconv={
-	"nop":(lambda c,op,pypc:[]),
-	"neg":unary("UNARY_NEGATIVE"),
-	"add":binary("BINARY_ADD"),
-	"sub":binary("BINARY_SUBTRACT"),
-	"mul":binary("BINARY_MULTIPLY"),
-	"div":binary("BINARY_TRUE_DIVIDE")
-}
+	#3.11 has forward and backward conditional jumps, later versions only
+	# forward ones
+	if "POP_JUMP_FORWARD_IF_FALSE" in dis.opmap:
+		JUMP_IF_FALSE="POP_JUMP_FORWARD_IF_FALSE"
+		JUMP_IF_TRUE="POP_JUMP_FORWARD_IF_TRUE"
+	else:
+		JUMP_IF_FALSE="POP_JUMP_IF_FALSE"
+		JUMP_IF_TRUE="POP_JUMP_IF_TRUE"
+	
+	#From 3.13 conditional jumps only take bools
+	TO_BOOL="TO_BOOL" in dis.opmap
+	
+	#Opcode and number of inline cache entries of every instruction used
+	opcodes={}
+	ncaches={}
+	for name in [
+		"RESUME","LOAD_CONST","LOAD_FAST","STORE_FAST","BINARY_OP",
+		"UNARY_NEGATIVE",
+		"RETURN_VALUE","POP_TOP","JUMP_BACKWARD",JUMP_IF_FALSE,JUMP_IF_TRUE,
+		"EXTENDED_ARG"
+	]+["TO_BOOL"]*TO_BOOL:
+		opcodes[name]=dis.opmap[name]
+		ncaches[name]=caches(name)
+	
+	EXTENDED_ARG=opcodes["EXTENDED_ARG"]
 
 class CompileError(RuntimeError):
 	def __init__(self,msg,pc):
 		RuntimeError.__init__(self,"{} (Code {})".format(msg,pc))
 		self.pc=pc
 
+class JumpRange(Exception):
+	'''
+	Raised when a forward jump is too far for the room left for its
+	argument. wide is the number of prefixes the farthest one needs.
+	'''
+	def __init__(self,wide):
+		Exception.__init__(self,wide)
+		self.wide=wide
+
+class Shared:
+	'''
+	A value computed in one block. refs counts the references to it there
+	and in the blocks it dominates, which read it from a local instead of
+	computing it again when there is more than one. Locals of values only
+	used in their own block are reused once left reaches 0.
+	'''
+	def __init__(self,block):
+		self.block=block
+		self.refs=0
+		self.own=0 #references in its own block
+		self.outside=False #referenced from a dominated block
+		self.left=0 #references in its own block not yet emitted
+		self.slot=None
+		self.done=False
+
+def roots(block):
+	'''
+	Return the values a block computes, in the order they are emitted.
+	'''
+	out=list(block.nodes)
+	ctl=block.next
+	if isinstance(ctl,code.ReturnNode):
+		out.append(ctl.block)
+	elif isinstance(ctl,code.IfNode):
+		out.append(ctl.cond)
+	return out
+
+def plan(asm,manager=None):
+	'''
+	Return {(id(block), id(node)): Shared} for the values with more than
+	one user, walking the dominator tree so a block can use the values of
+	the blocks dominating it. The analyses come from manager, which can be
+	the PassManager that optimized asm so those still cached are reused.
+	'''
+	if manager is None:
+		manager=optimize.PassManager()
+	counts=manager.analysis("uses",asm)
+	shared={}
+	if not any(x>1 for x in counts.values()):
+		return shared
+	
+	idom=manager.analysis("dominators",asm)
+	children={}
+	for block in manager.analysis("reachable",asm):
+		if block is not asm.entry:
+			children.setdefault(id(idom[id(block)]),[]).append(block)
+	
+	avail={} #id(node):Shared computed by a block on the current path
+	owned={} #id(block):id(node) of the values it computes
+	stack=[(asm.entry,False)]
+	while stack:
+		block,done=stack.pop()
+		if done:
+			#Leaving the subtree, its values are no longer available
+			for x in owned.pop(id(block)):
+				del avail[x]
+			continue
+		
+		mine=owned[id(block)]=[]
+		walk=[]
+		for root in roots(block):
+			walk.append(root)
+			while walk:
+				top=walk.pop()
+				if not isinstance(top,code.OpNode):
+					continue
+				elif counts[id(top)]<2:
+					#Only used here, computed inline
+					walk.extend(top.args)
+					continue
+				key=(id(block),id(top))
+				x=avail.get(id(top))
+				if x is None:
+					x=avail[id(top)]=Shared(block)
+					mine.append(id(top))
+					walk.extend(top.args)
+				x.refs+=1
+				if x.block is block:
+					x.own+=1
+				else:
+					x.outside=True
+				shared[key]=x
+		
+		stack.append((block,True))
+		stack.extend((x,False) for x in children.get(id(block),()))
+	return shared
+
 class Compiler:
-	def __init__(self):
-		self.vars=[]
-		self.asm=None
+	'''
+	Lays the blocks of a code graph out like code.Lowering and emits each
+	value as the expression computing it, straight into one bytearray.
+	
+	Backward jumps get exactly the EXTENDED_ARG prefixes they need. The
+	distance of a forward jump isn't known yet, so it gets wide prefixes
+	and is recorded in a fixup table, which is patched in one pass at the
+	end. If some forward jump turns out not to fit, compile starts over
+	with as many prefixes as the farthest one needed.
+	
+	Values with more than one reference are stored in a local the first
+	time they are computed and loaded from it after that, also in the
+	blocks dominated by the one computing them, which always runs first.
+	'''
+	def __init__(self,wide=0,shared=None):
+		self.co=bytearray()
+		self.wide=wide
+		self.fixups=[] #(offset of the jump, end of the jump, target)
+		self.consts=[]
+		self.constmap={} #constkey(val):index in consts
+		self.labels={} #id(target):code unit it starts at
+		self.args={} #id(node):index of the local holding an input
+		self.shared=shared #see plan
+		self.current=None #block being emitted
+		self.free=[] #locals which can be reused
 		self.nlocals=0
+		self.depth=0
 		self.stacksize=0
-		self.labels={} #id(block node):pypc
-		self.consts=[]
 	
-	def jump(self,label,c,pypc):
-		label=self.asm.consts[label.reg-1].pc
-		try:
-			c[c.index(None)]=pyarg(self.labels[label])
-			return c
-		except KeyError:pass
-		
-		fix=pypc+c.index(None)
+	def here(self):
+		return len(self.co)>>1
+	
+	def emit(self,name,arg=0,effect=0):
+		co=self.co
+		if arg>0xff:
+			for shift in (24,16,8):
+				if arg>>shift:
+					co+=bytes((EXTENDED_ARG,(arg>>shift)&0xff))
+		co+=bytes((opcodes[name],arg&0xff))
+		co+=bytes(ncaches[name]<<1)
 		
+		self.depth+=effect
+		if self.depth>self.stacksize:
+			self.stacksize=self.depth
+	
+	def jump(self,name,target,effect=0):
+		'''
+		Emit a jump to a block, or any other object which gets a label.
+		'''
+		co=self.co
 		try:
-			self.fix[label].append(fix)
+			label=self.labels[id(target)]
 		except KeyError:
-			self.fix[label]=[fix]
+			#Forward, reserve the prefixes and patch it later
+			start=len(co)
+			co+=bytes((EXTENDED_ARG,0))*self.wide
+			co+=bytes((opcodes[name],0))
+			co+=bytes(ncaches[name]<<1)
+			self.fixups.append((start,self.here(),target))
+			self.depth+=effect
+			return
 		
-		#None will be replaced later, but should fail nicely if it isn't
-		return pypc+len(b''.join(b"!!" if x is None else x for x in c)),c
+		#Backward, the distance depends on the number of prefixes
+		size=1+ncaches[name]
+		for ext in range(4):
+			arg=self.here()+ext+size-label
+			if arg<1<<(8*(ext+1)):
+				break
+		for shift in range(ext,0,-1):
+			co+=bytes((EXTENDED_ARG,(arg>>(8*shift))&0xff))
+		co+=bytes((opcodes[name],arg&0xff))
+		co+=bytes(ncaches[name]<<1)
+		self.depth+=effect
 	
-	def visit_number(self,num,pypc):
-		try:
-			x=self.consts.index(num.val)
-		except ValueError:
-			self.consts.append(num.val)
-			x=len(self.consts)-1
-		return pypc+3,[pyop("LOAD_CONST"),pyarg(x)]
-	
-	def visit_op(self,opn,pypc):
-		pypc,out=pyconv[opn.op](self,opn,pypc)
+	def backpatch(self):
+		co=self.co
+		labels=self.labels
+		wide=self.wide
+		
+		far=max((labels[id(t)]-end for _,end,t in self.fixups),default=0)
+		need=0
+		while far>>(8*(need+1)):
+			need+=1
+		if need>wide:
+			raise JumpRange(need)
 		
-		return pypc,out
+		for start,end,target in self.fixups:
+			arg=labels[id(target)]-end
+			for x in range(wide+1):
+				co[start+2*x+1]=(arg>>(8*(wide-x)))&0xff
 	
-	def visit_block(self,block,pypc):
+	def const(self,val):
+		key=code.constkey(val)
 		try:
-			return pypc+3,[pyop("JUMP_ABSOLUTE"),pyarg(self.labels[id(block)])]
-		except KeyError:pass
-		
-		#Record the PC for later jumps, which must occur if len(block.use) > 1
-		if len(block.use)>1:
-			self.labels[id(block)]=pypc
-		
-		c=[]
-		for gn in block.nodes:
-			pypc,tc=self.visit(gn,pypc)
-			c.extend(tc)
-		
-		pypc,tc=self.visit(block.next,pypc)
-		
-		return pypc,c+tc
+			return self.constmap[key]
+		except KeyError:
+			self.constmap[key]=len(self.consts)
+			self.consts.append(val)
+			return len(self.consts)-1
+	
+	def visit_number(self,num,data):
+		self.emit("LOAD_CONST",self.const(num.val),effect=1)
+	
+	def visit_arg(self,arg,data):
+		self.emit("LOAD_FAST",self.args[id(arg)],effect=1)
+	
+	def visit_op(self,opn,data):
+		'''
+		Emit the operator of opn, its arguments are already on the stack.
+		'''
+		if opn.op in binary:
+			self.emit("BINARY_OP",binary[opn.op],effect=-1)
+		elif opn.op=="neg":
+			self.emit("UNARY_NEGATIVE")
+		elif opn.op!="alias":
+			raise CompileError(
+				"Unknown op {}".format(opn.op),self.here()
+			)
 	
-	def visit_return(self,ret,pypc):
-		pypc,val=self.visit(ret.block,pypc)
-		return pypc+1,val+[pyop("RETURN_VALUE")]
+	def local(self):
+		if self.free:
+			return self.free.pop()
+		self.nlocals+=1
+		return self.nlocals-1
 	
-	def visit_goto(self,goto,pypc):
-		return self.visit(goto.block,pypc)
+	def release(self,x):
+		x.left-=1
+		if not x.left and not x.outside:
+			self.free.append(x.slot)
 	
-	def visit_if(self,ifnot,pypc):
-		block_pypc,cond=self.visit(ifnot.cond,pypc)
-		pypc,block=self.visit(ifnot.block,block_pypc)
+	def value(self,node,drop=False):
+		'''
+		Emit the instructions pushing a value, or computing it for its
+		effects only if drop.
+		'''
+		#Explicit stack so deep expressions don't hit the recursion limit
+		stack=[(node,False)]
+		while stack:
+			top,ready=stack.pop()
+			if not isinstance(top,code.OpNode):
+				#A constant or input on its own has no effects
+				if not (drop and top is node):
+					top.visit(self)
+				continue
+			
+			x=self.shared.get((id(self.current),id(top)))
+			if not ready:
+				if x is not None and (x.done or x.block is not self.current):
+					#Already in a local
+					if not (drop and top is node):
+						self.emit("LOAD_FAST",x.slot,effect=1)
+					if x.block is self.current:
+						self.release(x)
+					continue
+				stack.append((top,True))
+				stack.extend((y,False) for y in reversed(top.args))
+				continue
+			
+			top.visit(self)
+			if x is not None and x.refs>1:
+				x.done=True
+				if x.slot is None:
+					x.slot=self.local()
+				self.emit("STORE_FAST",x.slot,effect=-1)
+				if not (drop and top is node):
+					self.emit("LOAD_FAST",x.slot,effect=1)
+				self.release(x)
+			elif drop and top is node:
+				self.emit("POP_TOP",effect=-1)
+	
+	def visit_return(self,ret,queue):
+		self.value(ret.block)
+		self.emit("RETURN_VALUE",effect=-1)
+		return None
+	
+	def visit_goto(self,goto,queue):
+		return self.fallthrough(goto.block,queue)
+	
+	def visit_if(self,ifnot,queue):
+		self.value(ifnot.cond)
+		if TO_BOOL:
+			self.emit("TO_BOOL")
 		
-		return pypc,cond+[pyop("POP_JUMP_IF_FALSE"),pyarg(block_pypc)]+block
+		if self.placed(ifnot.block):
+			#Conditional jumps only go forward, so skip over a backward jump
+			# if the condition is true
+			skip=object()
+			self.jump(JUMP_IF_TRUE,skip,effect=-1)
+			self.jump("JUMP_BACKWARD",ifnot.block)
+			self.labels[id(skip)]=self.here()
+		else:
+			self.jump(JUMP_IF_FALSE,ifnot.block,effect=-1)
+			queue.append(ifnot.block)
+		return self.fallthrough(ifnot.next,queue)
+	
+	def placed(self,block):
+		if isinstance(block,code.FixNode):
+			raise CompileError("Jump to an undefined label",self.here())
+		return id(block) in self.labels
+	
+	def fallthrough(self,block,queue):
+		if not self.placed(block):
+			return block
+		self.jump("JUMP_BACKWARD",block)
+		return None
 	
-	def visit(self,gn,pypc):
-		if gn is None:
-			return []
+	def block(self,block,queue):
+		'''
+		Emit the contents of a block, returning the block which should be
+		placed right after it, if any.
+		'''
+		self.labels[id(block)]=self.here()
+		self.current=block
+		for node in block.nodes:
+			self.value(node,drop=True)
 		
-		return gn.visit(self,pypc)
+		if block.next is None:
+			self.emit("LOAD_CONST",self.const(None),effect=1)
+			self.emit("RETURN_VALUE",effect=-1)
+			return None
+		return block.next.visit(self,queue)
+	
+	def linetable(self,n):
+		'''
+		Return a co_linetable putting all n code units on line 1, without
+		columns.
+		'''
+		#Each entry covers up to 8 code units and moves 0 lines
+		out=bytes((0x80|(13<<3)|7,0))*(n>>3)
+		if n&7:
+			out+=bytes((0x80|(13<<3)|((n&7)-1),0))
+		return out
 	
 	def compile(self,asm):
-		self.asm=asm
+		if not isinstance(asm,code.Code):
+			raise CompileError("The cpy3 target compiles code graphs",0)
+		
+		for x in range(len(asm.args)):
+			self.args[id(asm.args[x])]=x
+		self.nlocals=len(asm.args)
+		if self.shared is None:
+			self.shared=plan(asm)
+		for x in self.shared.values():
+			x.left=x.own
+			x.done=False
+			x.slot=None
+		#Values used by other blocks keep their local for good
+		for x in self.shared.values():
+			if x.refs>1 and x.outside and x.slot is None:
+				x.slot=self.local()
 		
-		_,c=self.visit(asm.entry,0)
+		self.emit("RESUME",0)
+		queue=[asm.entry]
+		while queue:
+			block=queue.pop()
+			while block is not None and not self.placed(block):
+				block=self.block(block,queue)
 		
-		return func(pyco(
-			#argcount,kwonlyargcount,nlocals,stacksize,flags,codestring
-			0,0,self.nlocals,self.stacksize,0,b''.join(c),
-			#consts,names,varnames,filename,name,firstlineno,lnotab
-			tuple(self.consts),(),(),"<glu>","glufunc",1,b''
+		self.backpatch()
+		co=bytes(self.co)
+		names=tuple(x.name for x in asm.args)
+		#Names of the other locals can't clash with Glu names
+		varnames=names+tuple(
+			"%{}".format(x) for x in range(len(names),self.nlocals)
+		)
+		return type(f)(template.replace(
+			co_code=co,
+			co_consts=tuple(self.consts),
+			co_names=(),
+			co_varnames=varnames,
+			co_argcount=len(names),
+			co_nlocals=len(varnames),
+			co_stacksize=self.stacksize,
+			co_firstlineno=1,
+			co_filename="<glu>",
+			co_name="glufunc",
+			co_qualname="glufunc",
+			co_linetable=self.linetable(len(co)//2),
+			co_exceptiontable=b''
 		),{},"glufunc")
 
-def compile(asm):
-	return Compiler().compile(asm)
\ No newline at end of file
+def compile(asm,manager=None):
+	'''
+	Compile a code graph to a function, see plan for manager.
+	'''
+	if not SUPPORTED:
+		return closurecompile.compile(asm)
+	
+	if not isinstance(asm,code.Code):
+		raise CompileError("The cpy3 target compiles code graphs",0)
+	
+	#Start with short forward jumps, which fit unless the code is big
+	wide=0
+	shared=plan(asm,manager)
+	while True:
+		try:
+			return Compiler(wide,shared).compile(asm)
+		except JumpRange as e:
+			wide=e.wide
\ No newline at end of file
@@ -1,29 +1,53 @@
 import parse as p
 import compile as c
+import cache as cc
+import batch as b
+import tier as t
 
-import imp
+import importlib
 
 def parse(s):
 	return p.parse(s)
 
+def track(s):
+	return p.track(s)
+
+def reparse(result,offset,deleted,inserted):
+	return p.reparse(result,offset,deleted,inserted)
+
 def flatten(s):
 	return p.flatten(s)
 
-def build(s):
-	return p.build(s)
+def build(s,inputs=True):
+	return p.build(s,inputs)
+
+def compile(s,target="cpy3",cache=cc.default,optimize=True,inputs=True):
+	if cache is None:
+		return c.compile(build(s,inputs),target,optimize)
+	return cache.get(s,"glu",target,
+		lambda:c.compile(build(s,inputs),target,optimize),
+		{"optimize":c.opt.tolevel(optimize),"inputs":bool(inputs)}
+	)
 
-def compile(s,target="cpy3"):
-	return c.compile(build(s),target)
+def compile_many(sources,target="cpy3",optimize=True,workers=None,
+		return_errors=False):
+	return b.compile_many(sources,"glu",target,optimize,workers,return_errors)
 
-def exec(s):
-	return compile(s)()
+def exec(s,*args,optimize=True):
+	return t.default.run(s,*args,lang="glu",optimize=optimize)
 
 def reload():
-	imp.reload(p.tokenize.pb)
-	imp.reload(p.tokenize)
-	imp.reload(p.code)
-	imp.reload(p.ast)
-	imp.reload(p)
-	imp.reload(c.cpy3compile)
-	imp.reload(c.snowcompile)
-	imp.reload(c)
\ No newline at end of file
+	importlib.reload(p.tokenize.pb)
+	importlib.reload(p.tokenize)
+	importlib.reload(p.code)
+	importlib.reload(p.ast)
+	importlib.reload(p)
+	importlib.reload(c.opt)
+	importlib.reload(c.cpy3compile)
+	importlib.reload(c.snowcompile)
+	importlib.reload(c.closurecompile)
+	importlib.reload(c.numpycompile)
+	importlib.reload(c)
+	importlib.reload(cc)
+	importlib.reload(b)
+	importlib.reload(t)
\ No newline at end of file
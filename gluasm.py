@@ -1,22 +1,38 @@
 import asmparse as p
 import interpret as i
 import compile as c
+import cache as cc
+import batch as b
+import tier as t
 
-import imp
+import importlib
 
-def parse(x):
-	return p.parse(x)
+def parse(x,inputs=True):
+	return p.parse(x,inputs)
 
-def eval(x):
-	return i.interpret(parse(x))
+def eval(x,optimize=True):
+	return i.interpret(parse(x),optimize=optimize)
 
-def compile(x):
-	return c.compile(parse(x))
+def compile(x,target="cpy3",cache=cc.default,optimize=True,inputs=True):
+	if cache is None:
+		return c.compile(parse(x,inputs),target,optimize)
+	return cache.get(x,"gluasm",target,
+		lambda:c.compile(parse(x,inputs),target,optimize),
+		{"optimize":c.opt.tolevel(optimize),"inputs":bool(inputs)}
+	)
 
-def exec(x):
-	return compile(x)()
+def compile_many(sources,target="cpy3",optimize=True,workers=None,
+		return_errors=False):
+	return b.compile_many(sources,"gluasm",target,optimize,workers,return_errors)
+
+def exec(x,*args,optimize=True):
+	return t.default.run(x,*args,lang="gluasm",optimize=optimize)
 
 def reload():
-	imp.reload(p)
-	imp.reload(i)
-	imp.reload(c)
\ No newline at end of file
+	importlib.reload(p)
+	importlib.reload(i.opt)
+	importlib.reload(i)
+	importlib.reload(c)
+	importlib.reload(cc)
+	importlib.reload(b)
+	importlib.reload(t)
\ No newline at end of file
@@ -1,26 +1,52 @@
+import operator
+import time
+import optimize as opt
 import code
 
 ops={
 	"nop":(lambda a,c:None),
 	"goto":(lambda a,c:c.goto(a[0])),
-	"ifnot":(lambda a,c:c.goto(a[0]) if not a else None),
+	"ifnot":(lambda a,c:c.goto(a[1]) if not a[0] else None),
 	"add":(lambda a,c:a[0]+a[1]),
 	"sub":(lambda a,c:a[0]-a[1]),
 	"mul":(lambda a,c:a[0]*a[1]),
 	"div":(lambda a,c:a[0]/a[1]),
+	"neg":(lambda a,c:-a[0]),
+	"alias":(lambda a,c:a[0]),
 	"return":(lambda a,c:c.ret(a[0]))
 }
 
+#Instruction kinds of decoded programs
+BINARY=0
+UNARY=1
+IFNOT=2
+GOTO=3
+RETURN=4
+
+unary={
+	"neg":operator.neg,
+	"alias":(lambda x:x)
+}
+
+binary={
+	"add":operator.add,
+	"sub":operator.sub,
+	"mul":operator.mul,
+	"div":operator.truediv
+}
+
 class InterpretError(RuntimeError):
 	def __init__(self,msg,pc):
 		RuntimeError.__init__(self,"{} (Code {})".format(msg,pc))
 		self.pc=pc
 
 class Context:
-	def __init__(self,asm):
+	def __init__(self,asm,args=()):
 		self.vars={}
 		for x in range(len(asm.consts)):
 			self.vars[x+1]=asm.consts[x]
+		for reg,val in zip(asm.args,args):
+			self.vars[reg]=val
 		self.pc=0
 		self.retval=None
 	
@@ -49,8 +75,266 @@ class Context:
 	def ret(self,x):
 		self.retval=x
 
-def interpret(asm):
-	ctx=Context(asm)
+class Program:
+	'''
+	Assembly decoded for the interpreter loop. Every instruction is a tuple
+	(kind, handler, destination, a, b) where a and b are register slots, or
+	for jumps the pc to go to. regs is the initial register file, with the
+	constants already loaded, and args the registers of the inputs. names
+	holds the op of every instruction for profiles.
+	'''
+	def __init__(self,asm):
+		self.args=asm.args
+		self.names=[x.op for x in asm.code]+["return"]
+		self.regs=[None]*asm.nregs
+		for x in range(len(asm.consts)):
+			c=asm.consts[x]
+			self.regs[x+1]=c.pc if isinstance(c,code.Label) else c
+		
+		self.code=[]
+		for pc in range(len(asm.code)):
+			self.code.append(self.decode(asm,asm.code[pc],pc))
+		
+		#Falling off the end returns nothing
+		self.code.append((RETURN,None,0,0,0))
+	
+	def decode(self,asm,op,pc):
+		args=op.args
+		if op.op in binary:
+			return (BINARY,binary[op.op],op.reg,args[0],args[1])
+		elif op.op in unary:
+			return (UNARY,unary[op.op],op.reg,args[0],0)
+		elif op.op=="ifnot":
+			return (IFNOT,None,0,args[0],self.regs[args[1]])
+		elif op.op=="goto":
+			return (GOTO,None,0,self.regs[args[0]],0)
+		elif op.op=="return":
+			return (RETURN,None,0,args[0],0)
+		elif op.op=="nop":
+			return (GOTO,None,0,pc+1,0)
+		
+		raise InterpretError("Unknown op {}".format(op.op),pc)
+
+def decode(asm,optimize=True):
+	'''
+	Decode a code graph or its Assembly into a Program. Code graphs are
+	optimized first unless optimize is False, or at the optimization level
+	it gives. A copy is optimized, so the graph passed in doesn't change.
+	'''
+	if isinstance(asm,code.Code):
+		if optimize:
+			asm=opt.optimize(code.copy(asm),optimize)
+		asm=code.lower(asm)
+	return Program(asm)
+
+def load(prog,args):
+	'''
+	Return a fresh register file for prog with its inputs set to args.
+	'''
+	if len(args)!=len(prog.args):
+		raise TypeError("Program takes {} arguments but {} were given".format(
+			len(prog.args),len(args)
+		))
+	regs=prog.regs.copy()
+	for reg,val in zip(prog.args,args):
+		regs[reg]=val
+	return regs
+
+def run(prog,*args):
+	'''
+	Run a decoded Program with the given inputs and return its result.
+	'''
+	code=prog.code
+	regs=load(prog,args)
+	pc=0
+	while True:
+		kind,f,dst,a,b=code[pc]
+		pc+=1
+		if kind==0: #BINARY
+			regs[dst]=f(regs[a],regs[b])
+		elif kind==2: #IFNOT
+			if not regs[a]:
+				pc=b
+		elif kind==3: #GOTO
+			pc=a
+		elif kind==1: #UNARY
+			regs[dst]=f(regs[a])
+		else:
+			return regs[a]
+
+class Hot(Exception):
+	'''
+	Raised by run_counted when a program takes more backward jumps than it
+	was allowed.
+	'''
+
+def run_counted(prog,args,limit):
+	'''
+	Run a decoded Program like run while counting the backward jumps it
+	takes, returning (result, jumps). Raises Hot as soon as there are more
+	than limit.
+	'''
+	code=prog.code
+	regs=load(prog,args)
+	pc=0
+	jumps=0
+	while True:
+		kind,f,dst,a,b=code[pc]
+		pc+=1
+		if kind==0: #BINARY
+			regs[dst]=f(regs[a],regs[b])
+		elif kind==2: #IFNOT
+			if not regs[a]:
+				if b<pc:
+					jumps+=1
+					if jumps>limit:
+						raise Hot(jumps)
+				pc=b
+		elif kind==3: #GOTO
+			if a<pc:
+				jumps+=1
+				if jumps>limit:
+					raise Hot(jumps)
+			pc=a
+		elif kind==1: #UNARY
+			regs[dst]=f(regs[a])
+		else:
+			return regs[a],jumps
+
+class Profile:
+	'''
+	Runs a decoded Program the way run does while counting how often every
+	instruction runs and how often every branch is taken, and with timing
+	the time spent in every instruction. Counts add up over any number of
+	runs. run itself has no instrumentation, so it's no slower for this.
+	'''
+	def __init__(self,prog,timing=False):
+		self.prog=prog
+		self.timing=timing
+		n=len(prog.code)
+		self.runs=0
+		self.counts=[0]*n
+		self.taken=[0]*n
+		self.times=[0.0]*n if timing else None
+	
+	def run(self,*args):
+		'''
+		Run the program with the given inputs and return its result.
+		'''
+		code=self.prog.code
+		counts=self.counts
+		taken=self.taken
+		times=self.times
+		clock=time.perf_counter
+		regs=load(self.prog,args)
+		self.runs+=1
+		pc=0
+		start=None
+		while True:
+			kind,f,dst,a,b=code[pc]
+			counts[pc]+=1
+			if times is not None:
+				start=clock()
+			at=pc
+			pc+=1
+			if kind==0: #BINARY
+				regs[dst]=f(regs[a],regs[b])
+			elif kind==2: #IFNOT
+				if not regs[a]:
+					taken[at]+=1
+					pc=b
+			elif kind==3: #GOTO
+				taken[at]+=1
+				pc=a
+			elif kind==1: #UNARY
+				regs[dst]=f(regs[a])
+			else:
+				if times is not None:
+					times[at]+=clock()-start
+				return regs[a]
+			if times is not None:
+				times[at]+=clock()-start
+	
+	def report(self):
+		'''
+		Return the profile as a dict:
+		
+		 * runs: how many times the program ran
+		 * instructions: how many instructions ran in total
+		 * ops: {op: {"count", "time"}} totals for every op which ran
+		 * pcs: {"pc", "op", "count", "taken", "time"} for every instruction
+		   which ran, most run first
+		 * branches: {"pc", "op", "target", "count", "taken", "backward"}
+		   for every jump which ran, where backward jumps close loops
+		
+		Times are in seconds, or None without timing.
+		'''
+		prog=self.prog
+		times=self.times
+		ops={}
+		pcs=[]
+		branches=[]
+		for pc in range(len(prog.code)):
+			count=self.counts[pc]
+			if not count:
+				continue
+			name=prog.names[pc]
+			t=times[pc] if times is not None else None
+			
+			total=ops.setdefault(name,{"count":0,"time":None})
+			total["count"]+=count
+			if t is not None:
+				total["time"]=(total["time"] or 0.0)+t
+			
+			pcs.append({
+				"pc":pc,
+				"op":name,
+				"count":count,
+				"taken":self.taken[pc],
+				"time":t
+			})
+			
+			kind,f,dst,a,b=prog.code[pc]
+			if kind in (IFNOT,GOTO):
+				target=b if kind==IFNOT else a
+				branches.append({
+					"pc":pc,
+					"op":name,
+					"target":target,
+					"count":count,
+					"taken":self.taken[pc],
+					"backward":target<=pc
+				})
+		
+		pcs.sort(key=lambda x:-x["count"])
+		return {
+			"runs":self.runs,
+			"instructions":sum(self.counts),
+			"ops":ops,
+			"pcs":pcs,
+			"branches":branches
+		}
+
+def interpret(asm,*args,optimize=True):
+	return run(decode(asm,optimize),*args)
+
+def profile(asm,*args,optimize=True,timing=False):
+	'''
+	Decode and run asm under a Profile, returning the result and the Profile.
+	'''
+	prof=Profile(decode(asm,optimize),timing)
+	return prof.run(*args),prof
+
+def interpret_context(asm,*args):
+	'''
+	Step through Assembly one Opcode at a time using a Context. This is the
+	original interpreter loop, kept as a reference for the decoded one. As
+	registers can't be reassigned it can't run loops.
+	'''
+	if isinstance(asm,code.Code):
+		asm=code.lower(asm)
+	
+	ctx=Context(asm,args)
 	while ctx.pc<len(asm.code) and ctx.retval is None:
 		op=asm.code[ctx.pc]
 		ctx.set(op.reg,ops[op.op]([ctx.get(x) for x in op.args],ctx))
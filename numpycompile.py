@@ -0,0 +1,279 @@
+'''
+Compiles Glu code to a function which runs the program over whole NumPy
+arrays at once. Each input is an array, or a number broadcast against the
+others, and every element is one run of the program.
+
+Values are computed for every element. Branches become masks choosing the
+elements each block applies to, and every element's result comes from the
+return its mask reaches. As in NumPy, dividing by zero gives inf or nan
+instead of raising and fixed size integers wrap around. Elements which fall
+off the end of the program give nan. Loops can't be masked this way, so
+programs with them are rejected.
+'''
+import code
+import shadow
+
+numpy=None #set by load
+
+def load():
+	'''
+	Return the numpy module, or None if it isn't installed. It is imported
+	on first use rather than with this module, since shadow.load swaps
+	sys.path and sys.modules for the whole process.
+	'''
+	global numpy
+	if numpy is None:
+		try:
+			numpy=shadow.load("numpy")
+		except ImportError:pass
+	return numpy
+
+#Rows computed at once by default, bounding the temporary arrays to a few
+# hundred kilobytes per value
+CHUNKSIZE=1<<15
+
+#Kinds of value instructions
+CONST=0
+ARG=1
+UNARY=2
+BINARY=3
+
+#Kinds of block exits
+RETURN=0
+GOTO=1
+IFNOT=2
+
+unary={
+	"neg":"negative",
+	"alias":"positive"
+}
+
+binary={
+	"add":"add",
+	"sub":"subtract",
+	"mul":"multiply",
+	"div":"true_divide"
+}
+
+class CompileError(RuntimeError):
+	'''
+	Error raised for programs which can't be vectorized.
+	'''
+	pass
+
+class Compiler:
+	def __init__(self):
+		self.values=[] #(kind, ufunc or constant, a, b) in evaluation order
+		self.slots={} #id(node):index in values
+		self.blocks=[] #(kind, a, b, c) exit of each block in order
+		self.index={} #id(block):index in blocks
+	
+	def slot(self,node):
+		'''
+		Return the slot of a value if it has one, else None.
+		'''
+		try:
+			return self.slots[id(node)]
+		except KeyError:pass
+		
+		if isinstance(node,code.NumberNode):
+			self.values.append((CONST,node.val,0,0))
+		elif isinstance(node,code.ArgNode):
+			self.values.append((ARG,None,node.index,0))
+		elif isinstance(node,code.OpNode):
+			return None
+		else:
+			raise CompileError(
+				"{} is not a value".format(type(node).__name__)
+			)
+		
+		self.slots[id(node)]=len(self.values)-1
+		return len(self.values)-1
+	
+	def value(self,node):
+		'''
+		Return the slot of a value, adding the instructions which compute
+		it and any of its arguments not yet computed.
+		'''
+		slot=self.slot(node)
+		if slot is not None:
+			return slot
+		
+		stack=[node]
+		while stack:
+			top=stack[-1]
+			if id(top) in self.slots:
+				stack.pop()
+				continue
+			
+			missing=[x for x in top.args if self.slot(x) is None]
+			if missing:
+				stack.extend(reversed(missing))
+				continue
+			
+			stack.pop()
+			args=[self.slots[id(x)] for x in top.args]
+			if top.op in binary:
+				self.values.append(
+					(BINARY,getattr(numpy,binary[top.op]),args[0],args[1])
+				)
+			elif top.op in unary:
+				self.values.append(
+					(UNARY,getattr(numpy,unary[top.op]),args[0],0)
+				)
+			else:
+				raise CompileError("Can't vectorize op {}".format(top.op))
+			self.slots[id(top)]=len(self.values)-1
+		
+		return self.slots[id(node)]
+	
+	def successors(self,block):
+		ctl=block.next
+		if isinstance(ctl,code.GotoNode):
+			return [ctl.block]
+		elif isinstance(ctl,code.IfNode):
+			return [ctl.block,ctl.next]
+		return []
+	
+	def order(self,entry):
+		'''
+		Return the blocks reachable from entry so that every block comes
+		after all of the blocks which jump to it.
+		'''
+		post=[]
+		state={id(entry):False} #id(block):finished
+		stack=[(entry,iter(self.successors(entry)))]
+		while stack:
+			block,succ=stack[-1]
+			for next in succ:
+				if isinstance(next,code.FixNode):
+					raise CompileError("Jump to an undefined label")
+				try:
+					if not state[id(next)]:
+						raise CompileError("Loops can't be vectorized")
+				except KeyError:
+					state[id(next)]=False
+					stack.append((next,iter(self.successors(next))))
+					break
+			else:
+				stack.pop()
+				state[id(block)]=True
+				post.append(block)
+		
+		post.reverse()
+		return post
+	
+	def compile(self,asm,chunk=CHUNKSIZE):
+		if load() is None:
+			raise ImportError("The numpy target needs NumPy installed")
+		if not isinstance(asm,code.Code):
+			raise CompileError("The numpy target compiles code graphs")
+		
+		order=self.order(asm.entry)
+		self.index={id(order[x]):x for x in range(len(order))}
+		for block in order:
+			ctl=block.next
+			if ctl is None:
+				self.blocks.append((RETURN,None,0,0))
+			elif isinstance(ctl,code.ReturnNode):
+				self.blocks.append((RETURN,self.value(ctl.block),0,0))
+			elif isinstance(ctl,code.GotoNode):
+				self.blocks.append((GOTO,self.index[id(ctl.block)],0,0))
+			elif isinstance(ctl,code.IfNode):
+				self.blocks.append((IFNOT,
+					self.value(ctl.cond),
+					self.index[id(ctl.block)],
+					self.index[id(ctl.next)]
+				))
+			else:
+				raise CompileError(
+					"Unknown control node {}".format(type(ctl).__name__)
+				)
+		
+		values=self.values
+		blocks=self.blocks
+		nargs=len(asm.args)
+		#Only elements with no result need nan, so all integer programs give
+		# integer arrays
+		default=0
+		if any(x[0]==RETURN and x[1] is None for x in blocks):
+			default=numpy.nan
+		
+		def merge(old,mask):
+			if old is None:
+				return mask
+			return numpy.logical_or(old,mask)
+		
+		def run(args,shape):
+			vals=[]
+			for kind,f,a,b in values:
+				if kind==BINARY:
+					vals.append(f(vals[a],vals[b]))
+				elif kind==UNARY:
+					vals.append(f(vals[a]))
+				elif kind==ARG:
+					vals.append(args[a])
+				else:
+					vals.append(f)
+			
+			#Mask of the elements which reach each block, None if none can
+			masks=[None]*len(blocks)
+			masks[0]=True
+			conds=[]
+			choices=[]
+			for x in range(len(blocks)):
+				mask=masks[x]
+				if mask is None:
+					continue
+				
+				kind,a,b,c=blocks[x]
+				if kind==IFNOT:
+					cond=numpy.not_equal(vals[a],0)
+					masks[b]=merge(masks[b],
+						numpy.logical_and(mask,numpy.logical_not(cond))
+					)
+					masks[c]=merge(masks[c],numpy.logical_and(mask,cond))
+				elif kind==GOTO:
+					masks[a]=merge(masks[a],mask)
+				else:
+					conds.append(numpy.broadcast_to(mask,shape))
+					choices.append(numpy.broadcast_to(
+						numpy.nan if a is None else vals[a],shape
+					))
+			
+			return numpy.select(conds,choices,default)
+		
+		def glufunc(*args):
+			if len(args)!=nargs:
+				raise TypeError(
+					"glufunc takes {} arguments but {} were given".format(
+						nargs,len(args)
+					)
+				)
+			args=numpy.broadcast_arrays(*(numpy.asarray(x) for x in args))
+			shape=args[0].shape if args else ()
+			
+			with numpy.errstate(all="ignore"):
+				if chunk is None or len(shape)==0 or shape[0]<=chunk:
+					return run(args,shape)
+				
+				#Compute chunk rows at a time so the temporaries stay small
+				out=None
+				for start in range(0,shape[0],chunk):
+					part=[x[start:start+chunk] for x in args]
+					res=run(part,part[0].shape)
+					if out is None:
+						out=numpy.empty(shape,res.dtype)
+					elif res.dtype!=out.dtype:
+						out=out.astype(numpy.result_type(out,res))
+					out[start:start+chunk]=res
+				return out
+		
+		return glufunc
+
+def compile(asm,chunk=CHUNKSIZE):
+	'''
+	Compile a code graph to a function of its inputs. chunk is how many rows
+	to compute at once, or None to compute all of them together.
+	'''
+	return Compiler().compile(asm,chunk)
@@ -0,0 +1,546 @@
+'''
+Optimizations of code graphs. They change the graph in place and keep the
+use lists of the nodes they touch up to date.
+'''
+import operator
+import time
+import code
+
+folds={
+	"add":operator.add,
+	"sub":operator.sub,
+	"mul":operator.mul,
+	"div":operator.truediv,
+	"neg":operator.neg,
+	"alias":(lambda x:x)
+}
+
+#Ops whose result is an int when all of their arguments are
+intops={"add","sub","mul","neg","alias"}
+
+def relink(user,old,new):
+	'''
+	Move user from the use list of old to the one of new.
+	'''
+	try:
+		old.use.remove(user)
+	except ValueError:pass
+	new.use.append(user)
+
+class Folder:
+	'''
+	Folds constant subexpressions into NumberNodes, applies identities and
+	resolves IfNodes whose condition is constant. Identities which don't hold
+	for floats, like x+0 (-0.0+0 is 0.0) and x*0 (nan*0 is nan), are only
+	applied when x is proven to be an int. Ops which would raise, like
+	division by zero, are left to raise at run time.
+	'''
+	def __init__(self):
+		self.memo={} #id(node):node it simplifies to
+		self.ints=set() #id(node) of values proven to be ints
+		self.consts={} #constkey(val):number node
+		self.changed=0 #nodes replaced or removed
+	
+	def number(self,val):
+		key=code.constkey(val)
+		try:
+			return self.consts[key]
+		except KeyError:
+			node=self.consts[key]=code.number(val)
+			if type(val) is int:
+				self.ints.add(id(node))
+			return node
+	
+	def isint(self,node):
+		return id(node) in self.ints
+	
+	def isconst(self,node,val):
+		'''
+		Return whether node is the int constant val.
+		'''
+		if not isinstance(node,code.NumberNode):
+			return False
+		return type(node.val) is int and node.val==val
+	
+	def simplify(self,node):
+		'''
+		Return the node which replaces an OpNode whose arguments have already
+		been simplified.
+		'''
+		op=node.op
+		args=node.args
+		if op not in folds:
+			return node
+		
+		if all(isinstance(x,code.NumberNode) for x in args):
+			try:
+				return self.number(folds[op](*(x.val for x in args)))
+			except ArithmeticError:
+				return node
+		
+		if op=="alias":
+			return args[0]
+		elif op=="neg":
+			x=args[0]
+			if isinstance(x,code.OpNode) and x.op=="neg":
+				return x.args[0]
+		elif op=="add":
+			for x,y in (args,args[::-1]):
+				if self.isconst(y,0) and self.isint(x):
+					return x
+		elif op=="sub":
+			if self.isconst(args[1],0):
+				return args[0]
+		elif op=="mul":
+			for x,y in (args,args[::-1]):
+				if self.isconst(y,1):
+					return x
+				if self.isconst(y,0) and self.isint(x):
+					return y
+		
+		if op in intops and all(self.isint(x) for x in args):
+			self.ints.add(id(node))
+		return node
+	
+	def value(self,node):
+		'''
+		Return the simplified version of a value.
+		'''
+		try:
+			return self.memo[id(node)]
+		except KeyError:pass
+		
+		#Explicit stack so deep expressions don't hit the recursion limit
+		stack=[node]
+		while stack:
+			top=stack[-1]
+			if id(top) in self.memo:
+				stack.pop()
+				continue
+			
+			if isinstance(top,code.NumberNode):
+				stack.pop()
+				self.memo[id(top)]=self.number(top.val)
+				continue
+			elif not isinstance(top,code.OpNode):
+				stack.pop()
+				self.memo[id(top)]=top
+				continue
+			
+			missing=[x for x in top.args if id(x) not in self.memo]
+			if missing:
+				stack.extend(reversed(missing))
+				continue
+			
+			stack.pop()
+			for x in range(len(top.args)):
+				old=top.args[x]
+				new=self.memo[id(old)]
+				if new is not old:
+					top.args[x]=new
+					relink(top,old,new)
+			new=self.memo[id(top)]=self.simplify(top)
+			if new is not top:
+				self.changed+=1
+		
+		return self.memo[id(node)]
+	
+	def block(self,block):
+		'''
+		Simplify a block and return the blocks it can go to.
+		'''
+		#Statements are only kept for the errors they could raise
+		nodes=[]
+		for node in block.nodes:
+			x=self.value(node)
+			if isinstance(x,code.OpNode):
+				nodes.append(x)
+		if len(nodes)!=len(block.nodes):
+			self.changed+=1
+		block.nodes=nodes
+		
+		ctl=block.next
+		if isinstance(ctl,code.ReturnNode):
+			val=self.value(ctl.block)
+			if val is not ctl.block:
+				relink(ctl,ctl.block,val)
+				ctl.block=val
+		elif isinstance(ctl,code.GotoNode):
+			return [ctl.block]
+		elif isinstance(ctl,code.IfNode):
+			cond=self.value(ctl.cond)
+			if not isinstance(cond,code.NumberNode):
+				if cond is not ctl.cond:
+					relink(ctl,ctl.cond,cond)
+					ctl.cond=cond
+				return [ctl.block,ctl.next]
+			
+			#Only one side can be taken, jump straight to it
+			live,dead=ctl.block,ctl.next
+			if cond.val:
+				live,dead=dead,live
+			for x in (ctl.cond,live,dead):
+				try:
+					x.use.remove(ctl)
+				except ValueError:pass
+			block.next=code.goto(live)
+			self.changed+=1
+			return [live]
+		return []
+	
+	def fold(self,graph):
+		seen={id(graph.entry)}
+		queue=[graph.entry]
+		while queue:
+			for next in self.block(queue.pop()):
+				if id(next) not in seen:
+					seen.add(id(next))
+					queue.append(next)
+		return graph
+
+def fold(graph):
+	'''
+	Fold the constants of a code graph, returning the graph.
+	'''
+	return Folder().fold(graph)
+
+def successors(block):
+	'''
+	Return the blocks a block can jump to.
+	'''
+	ctl=block.next
+	if isinstance(ctl,code.GotoNode):
+		return [ctl.block]
+	elif isinstance(ctl,code.IfNode):
+		return [ctl.block,ctl.next]
+	return []
+
+def reachable(entry):
+	'''
+	Return the blocks which can be reached from entry.
+	'''
+	blocks=[entry]
+	seen={id(entry)}
+	for block in blocks:
+		for x in successors(block):
+			if id(x) not in seen:
+				seen.add(id(x))
+				blocks.append(x)
+	return blocks
+
+class Cleaner:
+	'''
+	Simplifies the control flow of a graph. Jumps to empty blocks which only
+	go somewhere else are threaded to where they end up, a block only
+	reached by a goto from one other block is merged into it, and blocks
+	which can't be reached are dropped from the use lists of the rest.
+	'''
+	def __init__(self):
+		self.changed=0 #jumps threaded, blocks merged and uses dropped
+	
+	def prune(self,entry,blocks=None):
+		'''
+		Remove the control nodes of unreachable blocks from the use lists of
+		the reachable ones, returning the reachable blocks. blocks can give
+		them if they are already known.
+		'''
+		if blocks is None:
+			blocks=reachable(entry)
+		live={id(x.next) for x in blocks if x.next is not None}
+		for block in blocks:
+			use=[x for x in block.use if id(x) in live]
+			self.changed+=len(block.use)-len(use)
+			block.use=use
+		return blocks
+	
+	def retarget(self,ctl,attr):
+		'''
+		Thread the jump of ctl in attr, block or next.
+		'''
+		old=getattr(ctl,attr)
+		new=self.final(old)
+		if new is not old:
+			relink(ctl,old,new)
+			setattr(ctl,attr,new)
+			self.changed+=1
+	
+	def final(self,block):
+		'''
+		Return the block a jump to block ends up running.
+		'''
+		seen=set()
+		while not block.nodes and isinstance(block.next,code.GotoNode):
+			#An empty infinite loop has nowhere else to go
+			if id(block) in seen:
+				break
+			seen.add(id(block))
+			block=block.next.block
+		return block
+	
+	def thread(self,blocks):
+		for block in blocks:
+			ctl=block.next
+			if isinstance(ctl,code.GotoNode):
+				self.retarget(ctl,"block")
+			elif isinstance(ctl,code.IfNode):
+				self.retarget(ctl,"block")
+				self.retarget(ctl,"next")
+	
+	def merge(self,blocks,entry,preds):
+		'''
+		Merge blocks only reached by a goto from one other block into it.
+		Only the counts of preds are used, which merging doesn't change since
+		the block merged into takes the place of the merged one.
+		'''
+		for block in blocks:
+			ctl=block.next
+			while isinstance(ctl,code.GotoNode):
+				next=ctl.block
+				if next is block or next is entry or len(preds[id(next)])!=1:
+					break
+				
+				block.nodes.extend(next.nodes)
+				block.next=ctl=next.next
+				next.nodes=[]
+				next.next=None
+				next.use=[]
+				self.changed+=1
+	
+	def clean(self,graph,manager=None):
+		'''
+		Clean a graph, getting its analyses from a PassManager.
+		'''
+		if manager is None:
+			manager=PassManager()
+		entry=graph.entry
+		self.thread(self.prune(entry,manager.analysis("reachable",graph)))
+		if self.changed:
+			#Threading moved jumps, so what reaches each block changed
+			manager.invalidate()
+		blocks=self.prune(entry,manager.analysis("reachable",graph))
+		self.merge(blocks,entry,manager.analysis("predecessors",graph))
+		self.prune(entry)
+		return graph
+
+def clean(graph):
+	'''
+	Simplify the control flow of a code graph, returning the graph.
+	'''
+	return Cleaner().clean(graph)
+
+def predecessors(graph,manager=None):
+	'''
+	Return {id(block): [blocks which jump to it]} for the reachable blocks.
+	'''
+	if manager is None:
+		blocks=reachable(graph.entry)
+	else:
+		blocks=manager.analysis("reachable",graph)
+	preds={id(x):[] for x in blocks}
+	for block in blocks:
+		for next in successors(block):
+			preds[id(next)].append(block)
+	return preds
+
+def dominators(graph,manager=None):
+	'''
+	Return {id(block): immediate dominator} for the reachable blocks, the
+	entry being its own. Uses the iterative algorithm of Cooper, Harvey and
+	Kennedy over a reverse postorder.
+	'''
+	if manager is None:
+		manager=PassManager()
+	preds=manager.analysis("predecessors",graph)
+	entry=graph.entry
+	post=[]
+	seen={id(entry)}
+	stack=[(entry,iter(successors(entry)))]
+	while stack:
+		block,succ=stack[-1]
+		for next in succ:
+			if id(next) not in seen:
+				seen.add(id(next))
+				stack.append((next,iter(successors(next))))
+				break
+		else:
+			stack.pop()
+			post.append(block)
+	
+	order={id(post[x]):x for x in range(len(post))}
+	idom={id(entry):entry}
+	def intersect(a,b):
+		while a is not b:
+			while order[id(a)]<order[id(b)]:
+				a=idom[id(a)]
+			while order[id(b)]<order[id(a)]:
+				b=idom[id(b)]
+		return a
+	
+	changed=True
+	while changed:
+		changed=False
+		for block in reversed(post):
+			if block is entry:
+				continue
+			new=None
+			for pred in preds[id(block)]:
+				if id(pred) in idom:
+					new=pred if new is None else intersect(pred,new)
+			if idom.get(id(block)) is not new:
+				idom[id(block)]=new
+				changed=True
+	return idom
+
+def uses(graph,manager=None):
+	'''
+	Return {id(node): number of users} of the OpNodes in the reachable part
+	of the graph, unlike GraphNode.use which can still hold users which
+	were removed or can't be reached. A block uses the values of its
+	statements.
+	'''
+	counts={}
+	def use(node):
+		if isinstance(node,code.OpNode):
+			n=counts.get(id(node),0)
+			counts[id(node)]=n+1
+			if not n:
+				stack.append(node)
+	
+	stack=[]
+	if manager is None:
+		blocks=reachable(graph.entry)
+	else:
+		blocks=manager.analysis("reachable",graph)
+	for block in blocks:
+		for node in block.nodes:
+			use(node)
+		ctl=block.next
+		if isinstance(ctl,code.ReturnNode):
+			use(ctl.block)
+		elif isinstance(ctl,code.IfNode):
+			use(ctl.cond)
+		while stack:
+			for arg in stack.pop().args:
+				use(arg)
+	return counts
+
+#Analyses PassManager can cache, name:function of a code graph and the
+# manager, which it can ask for the analyses it builds on
+analyses={
+	"reachable":(lambda graph,manager=None:reachable(graph.entry)),
+	"predecessors":predecessors,
+	"dominators":dominators,
+	"uses":uses
+}
+
+class Pass:
+	'''
+	A pass of a PassManager. run(graph, manager) changes the graph in place
+	and returns how many nodes it changed, preserves names the analyses
+	which stay valid even when it changes something.
+	'''
+	def __init__(self,name,run,preserves=()):
+		self.name=name
+		self.run=run
+		self.preserves=set(preserves)
+
+def run_fold(graph,manager):
+	folder=Folder()
+	folder.fold(graph)
+	return folder.changed
+
+def run_clean(graph,manager):
+	cleaner=Cleaner()
+	cleaner.clean(graph,manager)
+	return cleaner.changed
+
+#Passes by name
+passes={
+	"fold":Pass("fold",run_fold),
+	"clean":Pass("clean",run_clean)
+}
+
+#Pass pipelines of each optimization level
+levels=[
+	[],
+	["fold"],
+	["fold","clean"]
+]
+
+#Level used for optimize=True
+DEFAULT=2
+
+def tolevel(optimize):
+	'''
+	Return the optimization level meant by an optimize argument, True for
+	the default level and False or None for none.
+	'''
+	if optimize is True:
+		return DEFAULT
+	elif not optimize:
+		return 0
+	if optimize not in range(len(levels)):
+		raise ValueError("Unknown optimization level {}".format(optimize))
+	return optimize
+
+class PassManager:
+	'''
+	Runs passes over a code graph in order. Analyses are computed on first
+	use and kept until a pass which changes something doesn't preserve
+	them. stats records the time each pass took, the nodes it changed and
+	the analyses it had to compute.
+	'''
+	def __init__(self,names=()):
+		self.passes=[]
+		self.cache={} #analysis name:result for the current graph
+		self.computed=[] #analyses computed by the running pass
+		self.stats=[]
+		for name in names:
+			self.add(passes[name])
+	
+	def add(self,p):
+		self.passes.append(p)
+		return self
+	
+	def analysis(self,name,graph):
+		'''
+		Return an analysis of graph, computing it if it isn't cached.
+		'''
+		try:
+			return self.cache[name]
+		except KeyError:
+			self.computed.append(name)
+			x=self.cache[name]=analyses[name](graph,self)
+			return x
+	
+	def invalidate(self,preserves=()):
+		for name in list(self.cache):
+			if name not in preserves:
+				del self.cache[name]
+	
+	def run(self,graph):
+		self.cache={}
+		for p in self.passes:
+			self.computed=[]
+			start=time.perf_counter()
+			changed=p.run(graph,self)
+			self.stats.append({
+				"pass":p.name,
+				"seconds":time.perf_counter()-start,
+				"changed":changed,
+				"computed":self.computed
+			})
+			if changed:
+				self.invalidate(p.preserves)
+		#Analyses asked for after the passes aren't charged to the last
+		self.computed=[]
+		return graph
+
+def optimize(graph,level=DEFAULT):
+	'''
+	Run the passes of an optimization level over a code graph, returning
+	the graph. The passes change the graph in place, use code.copy first to
+	keep the original. level can also be True or False as for the optimize
+	option of compile.
+	'''
+	return PassManager(levels[tolevel(level)]).run(graph)
@@ -1,4 +1,5 @@
 from collections import deque
+import bisect
 from parsebase import *
 import code
 import tokenize
@@ -8,6 +9,17 @@ import ast
 left=False
 right=True
 
+#Kinds of the frames parse_statement keeps for what it's inside of
+PAREN=0
+ARGS=1
+BLOCK=2
+RETURN=3
+DECL=4
+STATEMENT=5
+
+def is_ident(tok):
+	return tok is not None and tok.kind==tokenize.IDENT
+
 class Opdef:
 	'''
 	Used for storing information used in interpreting operators.
@@ -140,7 +152,7 @@ class Scope:
 		return "Scope({}, {})".format(self.ast,self.opstack)
 	
 	def push(self,op):
-		self.opstack.push(op,self.ast)
+		self.opstack.push(op,self)
 	
 	def pop(self):
 		return self.opstack.pop(self)
@@ -161,158 +173,347 @@ class Scope:
 		while len(self.opstack):
 			self.pop()
 
+class Released(Exception):
+	'''
+	Raised when a statement uses the value of an earlier one its
+	TrackedScope no longer holds.
+	'''
+
+class TrackedScope(Scope):
+	'''
+	Top-level scope which remembers the fewest values it held since low was
+	last reset, to tell whether a statement used values from earlier ones.
+	If released is true, the values of earlier statements were taken out of
+	it and using them raises Released.
+	'''
+	def __init__(self,released=False):
+		Scope.__init__(self)
+		self.low=0
+		self.released=released
+	
+	def getval(self):
+		if self.released and not self.ast:
+			raise Released(
+				"A statement uses the value of one before it which was released"
+			)
+		val=self.ast.pop()
+		if len(self.ast)<self.low:
+			self.low=len(self.ast)
+		return val
+
+class ParseResult:
+	'''
+	The AST of a source along with where each of its top-level statements
+	starts, as returned by Parser.track and updated by Parser.reparse.
+	
+	Offsets and lines of the statements after the last edit are stored
+	stale and corrected on access, so an edit only rewrites the entries
+	between it and the previous edit.
+	'''
+	def __init__(self,text):
+		self.text=text
+		self.ast=ast.AST()
+		self.starts=[] #offset of each statement's first token
+		self.lines=[]
+		self.cols=[]
+		self.firsts=[] #index of the first AST node of each statement
+		self.decls=[] #names declared by each statement
+		self.declared={} #name:declaring token
+		
+		#Statements from index shiftat on are stale by shift, lineshift and
+		# nodeshift
+		self.shiftat=0
+		self.shift=0
+		self.lineshift=0
+		self.nodeshift=0
+	
+	def __len__(self):
+		return len(self.starts)
+	
+	def start(self,i):
+		if i>=self.shiftat:
+			return self.starts[i]+self.shift
+		return self.starts[i]
+	
+	def line(self,i):
+		if i>=self.shiftat:
+			return self.lines[i]+self.lineshift
+		return self.lines[i]
+	
+	def first(self,i):
+		if i>=len(self.firsts):
+			return len(self.ast)
+		if i>=self.shiftat:
+			return self.firsts[i]+self.nodeshift
+		return self.firsts[i]
+	
+	def find(self,offset):
+		'''
+		Return the index of the last statement starting at or before offset,
+		or -1 if there is none.
+		'''
+		k=self.shiftat
+		if k<len(self.starts) and offset>=self.starts[k]+self.shift:
+			return bisect.bisect_right(self.starts,offset-self.shift,k)-1
+		return bisect.bisect_right(self.starts,offset,0,k)-1
+	
+	def settle(self,lo,hi,shift,lineshift,nodeshift):
+		for i in range(lo,hi):
+			self.starts[i]+=shift
+			self.lines[i]+=lineshift
+			self.firsts[i]+=nodeshift
+	
+	def splice(self,a,j,new,stopped,delta):
+		'''
+		Replace statements a to j with those of another ParseResult, where
+		stopped is the first token of statement j after an edit which moved
+		it by delta characters.
+		'''
+		lo=self.first(a)
+		hi=self.first(j)
+		
+		#Make statements before a current and those from j on stale by the
+		# same amount so they can share one shift again
+		k=self.shiftat
+		if k<a:
+			self.settle(k,a,self.shift,self.lineshift,self.nodeshift)
+		elif k>j:
+			self.settle(j,k,-self.shift,-self.lineshift,-self.nodeshift)
+		
+		self.ast[lo:hi]=new.ast
+		self.nodeshift+=len(new.ast)-(hi-lo)
+		
+		if stopped is not None:
+			#Columns only change for statements on the edited line
+			line=self.lines[j]
+			dc=stopped.col-self.cols[j]
+			i=j
+			while i<len(self.starts) and self.lines[i]==line:
+				self.cols[i]+=dc
+				i+=1
+			self.lineshift=stopped.line-line
+		self.shift+=delta
+		
+		self.starts[a:j]=new.starts
+		self.lines[a:j]=new.lines
+		self.cols[a:j]=new.cols
+		self.firsts[a:j]=[lo+x for x in new.firsts]
+		self.decls[a:j]=new.decls
+		self.shiftat=a+len(new.starts)
+
 class Parser:
 	'''
 	Python parser for proto-Glu code using recursive descent and shunting yard.
 	
-	This will both parse the code and convert it into Glu assembly.
+	This will both parse the code and convert it into Glu assembly. Names
+	which are never assigned are inputs of the program, unless inputs is
+	false, when building them is an error.
 	'''
-	def __init__(self,s=""):
-		self.vars=[]
+	def __init__(self,s="",inputs=True):
+		self.inputs=inputs
+		self.vars={} #name:declaring token
+		self.decls=[] #names declared by the current statement
 		self.tokenizer=None
 	
+	def declare(self,tok,what):
+		if tok.text in self.vars:
+			raise ParseError(
+				"Redeclaration of {} {}".format(what,tok.text),
+				tok.line,tok.col
+			)
+		self.vars[tok.text]=tok
+		self.decls.append(tok.text)
+	
 	def next(self):
 		return self.tokenizer.next()
 	
 	def hasNext(self):
 		return self.tokenizer.hasNext()
 	
-	def parse_value(self,tok,scope):
-		if tok is None:
-			return None
-		elif isinstance(tok,tokenize.NumberToken):
-			scope.addval(ast.ValueNode(tok,tok.val))
-		elif isinstance(tok,tokenize.IdentToken):
-			scope.addval(ast.IdentNode(tok))
-		elif tok=="(":
-			nscope=Scope()
-			if self.parse_expr(self.next(),nscope)!=")":
-				raise ParseError(
-					"Unmatched open parenthesis",tok.line,tok.col
-				)
-			
-			scope.update(nscope)
-		elif tok.text in unary:
-			scope.push(Unary(tok))
-		else:
-			return tok
-		
-		return self.next()
-	
-	def parse_block(self,tok,scope):
-		if tok!="{":
-			return tok
-		
-		tok=self.next()
-		while self.hasNext() and tok!="}":
-			tok=self.parse_statement(tok,scope)
+	def parse_statement(self,tok,scope):
+		'''
+		Parse the statement starting at tok into scope, returning the token
+		after it.
 		
-		return self.next()
-	
-	def parse_expr(self,tok,scope):
-		while tok:
-			lasttok=tok
-			tok=self.parse_value(tok,scope)
-			if not tok:
-				break
-			elif isinstance(tok,tokenize.OperatorToken):
-				if tok.text in binary:
-					scope.push(Binary(tok))
-				elif tok=="(":
-					fscope=Scope()
-					if self.parse_expr(self.next(),fscope)!=")":
+		Parentheses, call arguments, {} blocks and statements each push a
+		frame instead of recursing, so nesting depth isn't limited by the
+		stack. A frame is resumed with the token what's inside it ended at.
+		'''
+		frames=[] #(kind, scope around it, token or block)
+		start=True #whether a statement starts at tok, else an expression
+		value=True #whether a value is expected next
+		while True:
+			expr=True
+			if start:
+				start=False
+				value=True
+				if tok is None:
+					end=None
+					expr=False
+				elif tok.kind!=tokenize.IDENT:
+					frames.append((STATEMENT,scope,tok))
+				elif tok=="return":
+					frames.append((RETURN,scope,tok))
+					scope=Scope()
+					tok=self.next()
+				elif tok=="goto":
+					label=self.next()
+					if not is_ident(label):
 						raise ParseError(
-							"Unmatched open parenthesis",tok.line,tok.col
+							"Goto statement must take a label",
+							tok.line,tok.col
 						)
-					func=scope.getval()
-					scope.update(fscope)
-					
-					bscope=Scope()
-					tok=self.parse_block(self.next(),bscope)
-					if bscope.ast:
-						scope.addval(ast.BlockNode(bscope.ast))
-					
-					Func(func).apply(scope)
-					return tok
-				elif tok==";":
-					scope.dump()
-					return self.next()
-				else:
-					return tok
-			else:
-				return tok
-			tok=self.next()
-		
-		scope.dump()
-		
-		return tok
-	
-	def parse_statement(self,tok,scope):
-		if tok is None:
-			return None
-		elif isinstance(tok,tokenize.IdentToken):
-			if tok=="return":
-				t=tok
-				rscope=Scope()
-				tok=self.parse_expr(self.next(),rscope)
-				scope.addval(ast.ReturnNode(tok,rscope.ast[0]))
-				return tok
-			elif tok=="goto":
-				label=self.next()
-				if isinstance(label,tokenize.IdentToken):
 					scope.addval(ast.GotoNode(tok,label))
-					return self.next()
-				raise ParseError(
-					"Goto statement must take a label",
-					tok.line,tok.col
-				)
-			elif tok=="label":
-				label=self.next()
-				if isinstance(label,tokenize.IdentToken):
-					if label.text in self.vars:
+					end=self.next()
+					expr=False
+				elif tok=="label":
+					label=self.next()
+					if not is_ident(label):
 						raise ParseError(
-							"Redeclaration of label {}".format(label.text),
+							"Label declaration must be followed by an identifier",
 							label.line,label.col
 						)
-					self.vars.append(label.text)
+					self.declare(label,"label")
 					scope.addval(ast.LabelNode(tok,label))
-					return self.next()
-				raise ParseError(
-					"Label declaration must be followed by an identifier",
-					label.line,label.col
-				)
-			elif tok=="number":
-				name=self.next()
-				if isinstance(name,tokenize.IdentToken):
-					if name.text in self.vars:
+					end=self.next()
+					expr=False
+				elif tok=="number":
+					name=self.next()
+					if not is_ident(name):
 						raise ParseError(
-							"Redeclaration of variable {}".format(name.text),
+							"Variable declaration must be followed by an identifier",
 							name.line,name.col
 						)
-					self.vars.append(name.text)
-					tok=self.next()
+					self.declare(name,"variable")
+					end=tok=self.next()
 					if tok=="=":
 						scope.addval(ast.IdentNode(name))
 						scope.push(Assign(tok,"number"))
-						escope=Scope()
-						tok=self.parse_expr(self.next(),escope)
-						scope.update(escope)
+						frames.append((DECL,scope,tok))
+						scope=Scope()
+						tok=self.next()
+					else:
+						expr=False
+				else:
+					frames.append((STATEMENT,scope,tok))
+			
+			while expr:
+				if value:
+					#Prefix operators and open parentheses come before the
+					# value
+					while tok is not None:
+						if tok.kind==tokenize.NUMBER:
+							scope.addval(ast.ValueNode(tok,tok.val))
+							tok=self.next()
+						elif tok.kind==tokenize.IDENT:
+							scope.addval(ast.IdentNode(tok))
+							tok=self.next()
+						elif tok=="(":
+							frames.append((PAREN,scope,tok))
+							scope=Scope()
+							tok=self.next()
+							continue
+						elif tok.text in unary:
+							scope.push(Unary(tok))
+							tok=self.next()
+							continue
+						break
+				value=True
+				
+				#Find the token the expression ends with, if it ends here
+				if tok is None:
+					scope.dump()
+					end=None
+				elif tok.kind==tokenize.OPERATOR:
+					if tok.text in binary:
+						scope.push(Binary(tok))
+						tok=self.next()
+						continue
+					elif tok=="(":
+						frames.append((ARGS,scope,tok))
+						scope=Scope()
+						tok=self.next()
+						continue
+					elif tok==";":
 						scope.dump()
+						end=self.next()
+					else:
+						end=tok
+				else:
+					end=tok
+				expr=False
+			
+			#Resume the frames which end at end
+			while frames:
+				kind,outer,data=frames[-1]
+				if kind==PAREN or kind==ARGS:
+					if end!=")":
+						raise ParseError(
+							"Unmatched open parenthesis",data.line,data.col
+						)
+					frames.pop()
+					if kind==PAREN:
+						outer.update(scope)
+						scope=outer
+						tok=self.next()
+						value=False
+						break
 					
-					return tok
-				raise ParseError(
-					"Variable declaration must be followed by an identifier",
-					name.line,name.col
-				)
-		
-		return self.parse_expr(tok,scope)
+					func=outer.getval()
+					outer.update(scope)
+					scope=outer
+					end=self.next()
+					if end=="{":
+						frames.append((BLOCK,outer,(func,Scope())))
+						end=self.next()
+					else:
+						if func.tok=="if":
+							scope.addval(ast.BlockNode(ast.AST()))
+						Func(func).apply(scope)
+				elif kind==BLOCK:
+					func,block=data
+					if self.hasNext() and end!="}":
+						scope=block
+						tok=end
+						start=True
+						break
+					
+					frames.pop()
+					end=self.next()
+					if block.ast or func.tok=="if":
+						outer.addval(ast.BlockNode(block.ast))
+					Func(func).apply(outer)
+					scope=outer
+				elif kind==RETURN:
+					frames.pop()
+					outer.addval(ast.ReturnNode(end,scope.ast[0]))
+					scope=outer
+				elif kind==DECL:
+					frames.pop()
+					outer.update(scope)
+					outer.dump()
+					scope=outer
+				else:
+					#Anything the expression parser can't start with would
+					# never be consumed, eg a stray )
+					frames.pop()
+					if end is data:
+						raise ParseError(
+							"Unexpected '{}'".format(data.text),
+							data.line,data.col
+						)
+			else:
+				return end
 	
 	def parse(self,s):
 		'''
-		Parse the given proto-Glu and return the AST.
+		Parse the given proto-Glu and return the AST. The source can also be
+		a file object or an iterable of chunks, which is tokenized as it is
+		read rather than loaded into memory first, or a pre-scanned
+		tokenize.TokenStream.
 		'''
-		self.__init__(s)
-		self.tokenizer=tokenize.Tokenizer(s)
+		self.__init__(s,self.inputs)
+		self.tokenizer=self.tokenize(s)
 		
 		scope=Scope()
 		tok=self.next()
@@ -321,11 +522,180 @@ class Parser:
 		
 		return scope.ast
 	
+	def tokenize(self,s):
+		if isinstance(s,str):
+			return tokenize.Tokenizer(s)
+		elif isinstance(s,tokenize.TokenStream):
+			return s.cursor()
+		return tokenize.StreamTokenizer(s)
+	
+	def statements(self,s):
+		'''
+		Parse the given proto-Glu like parse, but yield the AST nodes of the
+		top-level statements as they are completed instead of returning them
+		all. The nodes of a statement are held back until the next one is
+		complete, since it may use their values, and a statement which uses
+		values from further back raises Released.
+		'''
+		self.__init__(s,self.inputs)
+		self.tokenizer=self.tokenize(s)
+		
+		scope=TrackedScope()
+		held=0 #nodes at the start of scope.ast the next statement may use
+		tok=self.next()
+		while self.tokenizer.hasNext() and tok:
+			tok=self.parse_statement(tok,scope)
+			if not scope.opstack:
+				if scope.low>=held and held:
+					nodes=ast.AST(scope.ast[:held])
+					del scope.ast[:held]
+					scope.released=True
+					yield nodes
+				held=scope.low=len(scope.ast)
+		
+		if scope.ast:
+			yield scope.ast
+	
+	def parse_statements(self,tok,result,stop=None,released=False):
+		'''
+		Parse top-level statements starting from tok, recording each one in
+		result. Stops at the end of the source or at the first statement
+		boundary for which stop(offset) is true, returning the token there.
+		released is true when there are statements before tok whose values
+		aren't in result, see TrackedScope.
+		'''
+		scope=TrackedScope(released)
+		tk=self.tokenizer
+		firsts=[] #index of the first AST node of each statement
+		stopped=None
+		while tk.hasNext() and tok:
+			if not scope.opstack:
+				if stop is not None and stop(tk.start):
+					stopped=tok
+					break
+				
+				result.starts.append(tk.start)
+				result.lines.append(tok.line)
+				result.cols.append(tok.col)
+				result.decls.append([])
+				self.decls=result.decls[-1]
+				firsts.append(len(scope.ast))
+				scope.low=len(scope.ast)
+			
+			tok=self.parse_statement(tok,scope)
+			
+			#A statement which consumed values of the ones before it can't be
+			# re-parsed on its own, so fold it into the previous statement
+			while len(firsts)>1 and scope.low<firsts[-1]:
+				result.starts.pop()
+				result.lines.pop()
+				result.cols.pop()
+				decls=result.decls.pop()
+				result.decls[-1].extend(decls)
+				self.decls=result.decls[-1]
+				firsts.pop()
+		
+		base=len(result.ast)
+		result.firsts.extend(base+x for x in firsts)
+		result.ast.extend(scope.ast)
+		return stopped
+	
+	def track(self,s):
+		'''
+		Parse the given proto-Glu like parse, but return a ParseResult which
+		remembers where each top-level statement starts so it can be updated
+		with reparse.
+		'''
+		self.__init__(s,self.inputs)
+		self.tokenizer=tokenize.Tokenizer(s)
+		result=ParseResult(s)
+		self.vars=result.declared
+		self.parse_statements(self.next(),result)
+		return result
+	
+	def reparse(self,result,offset,deleted,inserted):
+		'''
+		Update a ParseResult from track after deleting the given number of
+		characters at offset and inserting the given text in their place.
+		
+		Only the top-level statements the edit touches are re-scanned and
+		re-parsed (a statement with a {} block is re-parsed as a whole), and
+		every other statement keeps its AST nodes. The result is updated in
+		place and returned. Tokens inside reused statements keep the
+		positions they were scanned at.
+		'''
+		text=result.text
+		if offset<0 or deleted<0 or offset+deleted>len(text):
+			raise ValueError("Edit is outside of the source")
+		text=text[:offset]+inserted+text[offset+deleted:]
+		delta=len(inserted)-deleted
+		
+		#The statement before the edited one is re-parsed as well since the
+		# edit can change where it ends
+		count=len(result.starts)
+		a=result.find(offset)-1
+		self.__init__(text,self.inputs)
+		self.tokenizer=tk=tokenize.Tokenizer(text)
+		if a>0:
+			#Lines are only indexed from the first re-parsed statement on
+			tk.pos=result.start(a)
+			tk.lines=Lines(text,result.line(a),result.cols[a],tk.pos)
+		else:
+			a=0
+		
+		#Statements are reused from the first boundary after the edit which
+		# was also a boundary before it
+		end=offset+len(inserted)
+		resync=[count]
+		def stop(pos):
+			if pos<end:
+				return False
+			j=result.find(pos-delta)
+			if j>=0 and result.start(j)==pos-delta:
+				resync[0]=j
+				return True
+			return False
+		
+		new=ParseResult(text)
+		self.vars=new.declared
+		try:
+			stopped=self.parse_statements(self.next(),new,stop,a>0)
+		except Released:
+			#The edit made the first re-parsed statement use values from
+			# before it, which only a full parse can handle
+			return self.track(text)
+		j=resync[0] if stopped is not None else count
+		
+		#Check the new declarations against the ones which are kept
+		declared=result.declared
+		replaced=[name for decls in result.decls[a:j] for name in decls]
+		kept={name:declared.pop(name) for name in replaced}
+		for name,tok in new.declared.items():
+			if name in declared:
+				declared.update(kept)
+				raise ParseError(
+					"Redeclaration of {}".format(name),tok.line,tok.col
+				)
+		declared.update(new.declared)
+		
+		result.splice(a,j,new,stopped,delta)
+		result.text=text
+		return result
+	
 	def build(self,s):
 		'''
 		Parse the given proto-Glu and return it as a Glu assembly code object.
+		Every top-level statement is built into the graph as soon as it is
+		parsed and then released, so only the AST of one is kept at a time.
 		'''
-		return self.parse(s).build(self)
+		try:
+			return ast.build(self.statements(s),self)
+		except Released:
+			#A statement used the value of one already built, which only
+			# parsing the whole source first can handle
+			if not isinstance(s,(str,tokenize.TokenStream)):
+				raise
+			return self.parse(s).build(self)
 
 def parse(s):
 	return Parser().parse(s)
@@ -334,5 +704,11 @@ def flatten(s):
 	p=Parser()
 	return p.parse(s).flatten(p,ast.Context(p))
 
-def build(s):
-	return Parser().build(s)
\ No newline at end of file
+def build(s,inputs=True):
+	return Parser(inputs=inputs).build(s)
+
+def track(s):
+	return Parser().track(s)
+
+def reparse(result,offset,deleted,inserted):
+	return Parser().reparse(result,offset,deleted,inserted)
\ No newline at end of file
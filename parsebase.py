@@ -1,6 +1,15 @@
 '''
 File containing base classes and utilities for parsing.
 '''
+from array import array
+import bisect
+import codecs
+import re
+
+CHUNKSIZE=1<<16
+
+newline=re.compile(r"\r\n?|\n")
+whitespace=re.compile(r"\s*")
 
 class ParseError(RuntimeError):
 	'''
@@ -11,34 +20,122 @@ class ParseError(RuntimeError):
 		self.line=line
 		self.col=col
 
+def chunks(src,size=CHUNKSIZE):
+	'''
+	Iterate over the text of a source in chunks. The source can be a string,
+	a file object opened in text or binary mode (binary is decoded as UTF-8)
+	or any iterable of str or bytes chunks.
+	'''
+	if isinstance(src,str):
+		yield src
+		return
+	
+	read=getattr(src,"read",None)
+	if read is not None:
+		src=iter(lambda:read(size),"")
+	
+	decoder=None
+	for chunk in src:
+		if not chunk:
+			if read is not None:
+				break
+			continue
+		
+		if not isinstance(chunk,str):
+			if decoder is None:
+				decoder=codecs.getincrementaldecoder("utf-8")()
+			chunk=decoder.decode(chunk)
+			if not chunk:
+				continue
+		yield chunk
+	
+	if decoder is not None:
+		tail=decoder.decode(b"",True)
+		if tail:
+			yield tail
+
+class Lines:
+	'''
+	Index of where the lines of a text start, which turns offsets into line
+	and column numbers with a binary search. Lines are indexed from offset
+	start as far as the positions asked for, which are at start or after
+	it. line and col are those of the character at start, for a text which
+	continues an earlier one or is only read from the middle.
+	'''
+	def __init__(self,text,line=1,col=0,start=0):
+		self.text=text #None once all of it is indexed
+		self.line=line
+		self.col=col
+		self.start=start
+		self.starts=array('q') #offsets where the lines after the first start
+		self.scan=None #newlines of text not indexed yet
+	
+	def build(self):
+		'''
+		Index the rest of the text now, after which it isn't kept.
+		'''
+		if self.text is not None:
+			if self.scan is None:
+				self.scan=newline.finditer(self.text,self.start)
+			self.starts.extend(m.end() for m in self.scan)
+			self.text=self.scan=None
+		return self
+	
+	def extend(self,pos):
+		'''
+		Index the lines up to offset pos.
+		'''
+		if self.scan is None:
+			self.scan=newline.finditer(self.text,self.start)
+		starts=self.starts
+		for m in self.scan:
+			starts.append(m.end())
+			if m.end()>pos:
+				return
+		self.text=self.scan=None
+	
+	def position(self,pos):
+		'''
+		Return the (line, col) of an offset.
+		'''
+		starts=self.starts
+		if self.text is not None and (not starts or pos>starts[-1]):
+			self.extend(pos)
+		i=bisect.bisect_right(starts,pos)
+		if i:
+			return self.line+i,pos-starts[i-1]
+		return self.line,self.col+pos-self.start
+
 class ParserBase:
 	'''
-	Base class for low level parsing.
+	Base class for low level parsing. Only the offset pos is kept up to date
+	while parsing, line and col are worked out from it when they are read.
 	'''
 	def __init__(self,s):
-		self.line=1
-		self.col=0
 		self.pos=0
 		self.text=s
 		self.length=len(s)
+		self.lines=Lines(s)
+	
+	@property
+	def line(self):
+		return self.lines.position(self.pos)[0]
+	
+	@property
+	def col(self):
+		return self.lines.position(self.pos)[1]
+	
+	def position(self,pos=None):
+		'''
+		Return the (line, col) of an offset in the text, pos by default.
+		'''
+		return self.lines.position(self.pos if pos is None else pos)
 	
 	def space(self):
 		'''
-		Parse whitespace while keeping track of the line and column.
-		'''
-		while self.pos<self.length and self.text[self.pos].isspace():
-			c=self.text[self.pos]
-			if c=='\n':
-				self.line+=1
-				self.col=0
-			elif c=='\r':
-				if self.pos+1<self.length and self.text[self.pos+1]=='\n':
-					self.pos+=1
-				self.line+=1
-				self.col=0
-			else:
-				self.col+=1
-			self.pos+=1
+		Skip whitespace.
+		'''
+		self.pos=whitespace.match(self.text,self.pos).end()
 	
 	def maybe(self,c):
 		'''
@@ -48,6 +145,5 @@ class ParserBase:
 		'''
 		if self.pos<self.length and self.text[self.pos]==c:
 			self.pos+=1
-			self.col+=1
 			return True
 		return False
\ No newline at end of file
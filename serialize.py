@@ -0,0 +1,380 @@
+'''
+Versioned binary format for code graphs.
+
+A file is a header followed by tables of fixed-width little-endian records:
+
+ * consts: the distinct numbers of the graph. Ints which don't fit in 64
+   bits and arg names are kept in the data section at the end.
+ * args: the inputs of the program in order.
+ * ops: every OpNode, in an order where the arguments of an op come before
+   it. Ops with more than two arguments keep them in refs.
+ * blocks: every reachable block, the entry first, each with a slice of
+   stmts holding its nodes and its control node.
+
+Values are referenced by their index shifted left by two bits, the low bits
+telling which table the index is in.
+
+loads reads straight from any buffer, including an mmap, without copying
+it, load maps a file to do the same. Malformed input raises CodeError.
+'''
+import struct
+import mmap
+import gc
+
+import code
+
+MAGIC=b"GLUB"
+VERSION=1
+
+HEADER=struct.Struct("<4sHHIIIIIII")
+CONST=struct.Struct("<I4x8s")
+ARG=struct.Struct("<III")
+OP=struct.Struct("<HHII")
+REF=struct.Struct("<I")
+BLOCK=struct.Struct("<IIIIII")
+
+#Tables a value reference can point into
+REF_OP=0
+REF_CONST=1
+REF_ARG=2
+
+#Constant kinds
+CONST_INT=0
+CONST_FLOAT=1
+CONST_BIGINT=2 #payload is the offset and size of its bytes in data
+
+#Control node kinds
+CTL_NONE=0
+CTL_RETURN=1
+CTL_GOTO=2
+CTL_IF=3
+
+NONE=0xffffffff
+
+class Writer:
+	'''
+	Numbers the nodes of a code graph and packs them into tables.
+	'''
+	def __init__(self):
+		self.consts=bytearray()
+		self.constmap={} #constkey(val):const index
+		self.args=bytearray()
+		self.argmap={} #id(node):arg index
+		self.ops=bytearray()
+		self.opmap={} #id(node):op index
+		self.refs=bytearray()
+		self.blocks=bytearray()
+		self.blockmap={} #id(block):block index
+		self.order=[] #blocks by index
+		self.stmts=bytearray()
+		self.data=bytearray()
+	
+	def bytes(self,b):
+		'''
+		Add bytes to the data section, returning their offset.
+		'''
+		offset=len(self.data)
+		self.data+=b
+		return offset
+	
+	def const(self,val):
+		key=code.constkey(val)
+		try:
+			return self.constmap[key]
+		except KeyError:pass
+		
+		if type(val) is float:
+			record=CONST.pack(CONST_FLOAT,struct.pack("<d",val))
+		elif isinstance(val,int):
+			val=int(val)
+			try:
+				record=CONST.pack(CONST_INT,val.to_bytes(8,"little",signed=True))
+			except OverflowError:
+				b=val.to_bytes(val.bit_length()//8+1,"little",signed=True)
+				record=CONST.pack(
+					CONST_BIGINT,struct.pack("<II",self.bytes(b),len(b))
+				)
+		else:
+			raise code.CodeError(
+				"Can't serialize constant {!r}".format(val)
+			)
+		
+		n=self.constmap[key]=len(self.consts)//CONST.size
+		self.consts+=record
+		return n
+	
+	def known(self,node):
+		'''
+		Return the reference of a value if it already has one, else None.
+		'''
+		if isinstance(node,code.NumberNode):
+			return self.const(node.val)<<2|REF_CONST
+		elif isinstance(node,code.ArgNode):
+			try:
+				return self.argmap[id(node)]<<2|REF_ARG
+			except KeyError:
+				raise code.CodeError(
+					"Input {} is not in the program's args".format(node.name)
+				)
+		elif not isinstance(node,code.OpNode):
+			raise code.CodeError("{} is not a value".format(type(node).__name__))
+		
+		n=self.opmap.get(id(node))
+		if n is None:
+			return None
+		return n<<2|REF_OP
+	
+	def value(self,node):
+		'''
+		Return the reference of a value, adding it and any of its arguments
+		not yet added to the ops.
+		'''
+		ref=self.known(node)
+		if ref is not None:
+			return ref
+		
+		#Explicit stack so deep expressions don't hit the recursion limit
+		stack=[node]
+		while stack:
+			top=stack[-1]
+			if id(top) in self.opmap:
+				stack.pop()
+				continue
+			
+			missing=[x for x in top.args if self.known(x) is None]
+			if missing:
+				stack.extend(reversed(missing))
+				continue
+			
+			stack.pop()
+			args=[self.known(x) for x in top.args]
+			if len(args)>2:
+				a=len(self.refs)//REF.size
+				for x in args:
+					self.refs+=REF.pack(x)
+				b=NONE
+			else:
+				a,b=(args+[NONE,NONE])[:2]
+			self.opmap[id(top)]=len(self.ops)//OP.size
+			self.ops+=OP.pack(code.opmap[top.op],len(args),a,b)
+		
+		return self.opmap[id(node)]<<2|REF_OP
+	
+	def block(self,block):
+		if isinstance(block,code.FixNode):
+			raise code.CodeError("Jump to an undefined label")
+		try:
+			return self.blockmap[id(block)]
+		except KeyError:
+			n=self.blockmap[id(block)]=len(self.order)
+			self.order.append(block)
+			return n
+	
+	def write(self,graph):
+		for x in range(len(graph.args)):
+			arg=graph.args[x]
+			name=arg.name.encode("utf-8","surrogatepass")
+			self.argmap[id(arg)]=x
+			self.args+=ARG.pack(self.bytes(name),len(name),arg.index)
+		
+		self.block(graph.entry)
+		for block in self.order:
+			start=len(self.stmts)//REF.size
+			for node in block.nodes:
+				self.stmts+=REF.pack(self.value(node))
+			
+			ctl=block.next
+			val=target=next=NONE
+			if ctl is None:
+				kind=CTL_NONE
+			elif isinstance(ctl,code.ReturnNode):
+				kind=CTL_RETURN
+				val=self.value(ctl.block)
+			elif isinstance(ctl,code.GotoNode):
+				kind=CTL_GOTO
+				target=self.block(ctl.block)
+			elif isinstance(ctl,code.IfNode):
+				kind=CTL_IF
+				val=self.value(ctl.cond)
+				target=self.block(ctl.block)
+				if ctl.next is not None:
+					next=self.block(ctl.next)
+			else:
+				raise code.CodeError(
+					"Unknown control node {}".format(type(ctl).__name__)
+				)
+			self.blocks+=BLOCK.pack(
+				start,len(block.nodes),kind,val,target,next
+			)
+		
+		header=HEADER.pack(
+			MAGIC,VERSION,0,
+			len(self.consts)//CONST.size,len(self.args)//ARG.size,
+			len(self.ops)//OP.size,len(self.refs)//REF.size,
+			len(self.blocks)//BLOCK.size,len(self.stmts)//REF.size,
+			len(self.data)
+		)
+		return b''.join((
+			header,self.consts,self.args,self.ops,self.refs,self.blocks,
+			self.stmts,self.data
+		))
+
+def dumps(graph):
+	'''
+	Return a code graph serialized as bytes.
+	'''
+	return Writer().write(graph)
+
+def dump(graph,f):
+	'''
+	Write a code graph to a binary file object.
+	'''
+	f.write(dumps(graph))
+
+class Reader:
+	'''
+	Rebuilds a code graph from a buffer in the format written by Writer.
+	Numbers equal by constkey share one NumberNode.
+	'''
+	def __init__(self,buf):
+		self.buf=buf
+		self.pos=0
+	
+	def table(self,record,count):
+		'''
+		Unpack the next count records of a table.
+		'''
+		end=self.pos+record.size*count
+		if end>len(self.buf):
+			raise code.CodeError("Truncated Glu binary")
+		rows=list(record.iter_unpack(self.buf[self.pos:end]))
+		self.pos=end
+		return rows
+	
+	def read(self):
+		buf=self.buf
+		if len(buf)<HEADER.size:
+			raise code.CodeError("Truncated Glu binary")
+		(magic,version,flags,nconsts,nargs,nops,nrefs,nblocks,nstmts,
+			ndata)=HEADER.unpack_from(buf,0)
+		if magic!=MAGIC:
+			raise code.CodeError("Not a Glu binary")
+		if version!=VERSION:
+			raise code.CodeError(
+				"Unsupported Glu binary version {}".format(version)
+			)
+		self.pos=HEADER.size
+		
+		consts=self.table(CONST,nconsts)
+		args=self.table(ARG,nargs)
+		ops=self.table(OP,nops)
+		refs=[x for x, in self.table(REF,nrefs)]
+		blocks=self.table(BLOCK,nblocks)
+		stmts=[x for x, in self.table(REF,nstmts)]
+		if self.pos+ndata>len(buf):
+			raise code.CodeError("Truncated Glu binary")
+		data=self.pos
+		
+		def section(offset,size):
+			if offset+size>ndata:
+				raise code.CodeError("Bad data reference {}".format(offset))
+			return buf[data+offset:data+offset+size]
+		
+		values=[[],[],[]] #nodes by REF_* table
+		for kind,payload in consts:
+			if kind==CONST_INT:
+				val=int.from_bytes(payload,"little",signed=True)
+			elif kind==CONST_FLOAT:
+				val,=struct.unpack("<d",payload)
+			elif kind==CONST_BIGINT:
+				val=int.from_bytes(
+					section(*struct.unpack("<II",payload)),"little",signed=True
+				)
+			else:
+				raise code.CodeError("Unknown constant kind {}".format(kind))
+			values[REF_CONST].append(code.number(val))
+		
+		for offset,size,index in args:
+			try:
+				name=str(section(offset,size),"utf-8","surrogatepass")
+			except UnicodeDecodeError:
+				raise code.CodeError("Bad input name at {}".format(offset))
+			values[REF_ARG].append(code.arg(name,index))
+		
+		def value(ref):
+			try:
+				return values[ref&3][ref>>2]
+			except IndexError:
+				raise code.CodeError("Bad value reference {}".format(ref))
+		
+		for op,count,a,b in ops:
+			if op>=len(code.opname):
+				raise code.CodeError("Unknown op {}".format(op))
+			if count>2:
+				args=[value(x) for x in refs[a:a+count]]
+			else:
+				args=[value(x) for x in (a,b)[:count]]
+			values[REF_OP].append(code.OpNode(op,args))
+		
+		nodes=[code.block() for x in range(nblocks)]
+		def block(n):
+			try:
+				return nodes[n]
+			except IndexError:
+				raise code.CodeError("Bad block reference {}".format(n))
+		
+		for node,(start,count,kind,val,target,next) in zip(nodes,blocks):
+			node.nodes=[value(x) for x in stmts[start:start+count]]
+			if kind==CTL_RETURN:
+				node.next=code.ret(value(val))
+			elif kind==CTL_GOTO:
+				node.next=code.goto(block(target))
+			elif kind==CTL_IF:
+				ctl=node.next=code.ifnot(value(val),block(target))
+				if next!=NONE:
+					ctl.next=block(next)
+					ctl.next.use.append(ctl)
+			elif kind!=CTL_NONE:
+				raise code.CodeError("Unknown control node kind {}".format(kind))
+		
+		if not nodes:
+			raise code.CodeError("Glu binary has no entry block")
+		return code.Code(nodes[0],values[REF_ARG])
+
+def loads(buf,pausegc=False):
+	'''
+	Return the code graph serialized in a buffer, such as bytes or an mmap.
+	
+	Every node is a new container, so on large graphs the garbage collector
+	can cost more than the load itself. pausegc disables it while loading,
+	which affects the whole process, so only pass it when no other thread
+	depends on the collector running.
+	'''
+	if not pausegc:
+		with memoryview(buf) as view:
+			return Reader(view).read()
+	
+	enabled=gc.isenabled()
+	gc.disable()
+	try:
+		return loads(buf)
+	finally:
+		if enabled:
+			gc.enable()
+
+def load(f,pausegc=False):
+	'''
+	Return the code graph in a binary file, given as a path or file object,
+	by mapping it into memory. See loads for pausegc.
+	'''
+	if isinstance(f,str):
+		with open(f,"rb") as f:
+			return load(f,pausegc)
+	
+	try:
+		m=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+	except ValueError:
+		#Empty files can't be mapped
+		raise code.CodeError("Truncated Glu binary")
+	with m:
+		return loads(m,pausegc)
@@ -0,0 +1,313 @@
+'''
+Local compile and execute service, so processes which use Glu share one
+warm compiler and cache instead of each paying for their own.
+
+Requests and responses are JSON objects, one per line, over a Unix or TCP
+socket. A request has an id, which its response repeats, and an op:
+
+ * compile: compile source (lang "glu" or "gluasm", target, optimize as
+   true, false or a level),
+   the result is {"kind", "data"} with data in base64, see batch.rebuild
+ * exec: compile source like compile then run it with args, like glu.exec,
+   array results of the numpy target are returned as lists
+ * eval: interpret gluasm source with args, like gluasm.eval
+ * stats: counters, cache stats and latency percentiles in seconds
+
+A response is {"id", "ok": true, "result"} or {"id", "ok": false, "error",
+"message"} with the error's type name.
+
+source, lang and target must be strings and args a list of numbers.
+
+Requests arriving within delay seconds of each other are sent to the worker
+processes together, a chunk per worker. A request identical to one still
+in flight waits for that one's result instead of being run again, and
+compile results are kept in a CompileCache.
+
+The workers compile with batch.build rather than glu.compile, so the
+service's cache entries are its own and aren't shared with glu.compile or
+gluasm.compile in the same process. exec always runs the compiled program,
+it doesn't go through the interpreter first like the tiers of glu.exec.
+
+Run with python -m service --unix PATH or --host HOST --port PORT.
+'''
+import argparse
+import base64
+import collections
+import json
+import os
+import time
+
+import shadow
+import asmparse
+import interpret
+import batch
+import optimize as opt
+import cache
+
+asyncio=shadow.load("asyncio")
+
+PORT=7878
+
+#Latencies kept for the percentiles in stats
+LATENCIES=10000
+
+def work(jobs):
+	'''
+	Run a chunk of (index, job) in a worker, returning (index, ok, value)
+	for each, where value is a packed error if ok is false.
+	'''
+	results=[]
+	for index,job in jobs:
+		try:
+			op=job[0]
+			if op=="compile":
+				_,lang,target,optimize,source=job
+				val=batch.build(source,lang,target,optimize)
+			elif op=="exec":
+				_,kind,data,target,args=job
+				val=batch.rebuild(kind,data,target)(*args)
+				#Results are sent as JSON, so numpy arrays and scalars become
+				# lists and numbers
+				tolist=getattr(val,"tolist",None)
+				if tolist is not None:
+					val=tolist()
+			else:
+				_,source,optimize,args=job
+				val=interpret.interpret(
+					asmparse.parse(source),*args,optimize=optimize
+				)
+			results.append((index,True,val))
+		except Exception as e:
+			results.append((index,False,batch.pack_error(e)))
+	return results
+
+def numbers(args):
+	'''
+	Return the args of a request as a tuple, checking they are numbers.
+	'''
+	if not isinstance(args,list) or not all(
+			type(x) in (int,float) for x in args):
+		raise ValueError("args must be a list of numbers")
+	return tuple(args)
+
+def string(msg,name,default=None):
+	'''
+	Return a field of a request, checking it is a string.
+	'''
+	x=msg.get(name,default)
+	if not isinstance(x,str):
+		raise ValueError("{} must be a string".format(name))
+	return x
+
+def size(job):
+	'''
+	Rough cost of a job, for splitting batches into even chunks.
+	'''
+	return max(len(x) for x in job if isinstance(x,(str,bytes)))
+
+class Service:
+	'''
+	Runs jobs on a pool of worker processes, batching the jobs submitted
+	within delay seconds of each other and sharing the results of identical
+	ones in flight.
+	'''
+	def __init__(self,workers=None,delay=0.002,compiled=None):
+		self.workers=workers or os.cpu_count() or 1
+		self.pool=batch.pool(self.workers)
+		self.delay=delay
+		self.cache=compiled or cache.CompileCache()
+		self.inflight={} #job:future of its result
+		self.pending=[] #jobs waiting for the next batch
+		self.flushing=None #handle of the scheduled flush
+		self.latency=collections.deque(maxlen=LATENCIES)
+		self.requests=0
+		self.collapsed=0
+		self.batches=0
+		self.errors=0
+	
+	def submit(self,job):
+		'''
+		Return a future of the result of a job, a tuple whose first item is
+		its op.
+		'''
+		try:
+			fut=self.inflight[job]
+			self.collapsed+=1
+			return fut
+		except KeyError:pass
+		
+		loop=asyncio.get_running_loop()
+		fut=self.inflight[job]=loop.create_future()
+		self.pending.append(job)
+		if self.flushing is None:
+			self.flushing=loop.call_later(self.delay,self.flush)
+		return fut
+	
+	def flush(self):
+		jobs=self.pending
+		self.pending=[]
+		self.flushing=None
+		self.batches+=1
+		
+		for chunk in batch.chunks(jobs,self.workers,size):
+			asyncio.ensure_future(self.run(chunk))
+	
+	async def run(self,chunk):
+		loop=asyncio.get_running_loop()
+		try:
+			results=await loop.run_in_executor(self.pool,work,chunk)
+		except Exception as e:
+			#The pool itself failed, eg a worker died
+			results=[(index,False,batch.pack_error(e)) for index,_ in chunk]
+		
+		jobs=dict(chunk)
+		for index,ok,val in results:
+			job=jobs[index]
+			fut=self.inflight.pop(job)
+			if ok:
+				fut.set_result(val)
+			else:
+				fut.set_exception(batch.unpack_error(val))
+	
+	async def compile(self,lang,target,optimize,source):
+		'''
+		Return (kind, data) for a source, see batch.build.
+		'''
+		if lang not in batch.builders:
+			raise ValueError("Unknown source language {}".format(lang))
+		#Entries hold (kind, data), not what glu.compile caches
+		key=self.cache.key(source,lang,target,
+			{"optimize":optimize,"packed":True}
+		)
+		x=self.cache.find(key)
+		if x is None:
+			x=await self.submit(("compile",lang,target,optimize,source))
+			self.cache.put(key,x)
+		return x
+	
+	async def request(self,msg):
+		'''
+		Return the result of a request.
+		'''
+		op=msg.get("op")
+		target=string(msg,"target","cpy3")
+		optimize=opt.tolevel(msg.get("optimize",True))
+		args=numbers(msg.get("args",[]))
+		if op=="compile":
+			kind,data=await self.compile(
+				string(msg,"lang","glu"),target,optimize,string(msg,"source")
+			)
+			return {"kind":kind,"data":base64.b64encode(data).decode()}
+		elif op=="exec":
+			kind,data=await self.compile(
+				string(msg,"lang","glu"),target,optimize,string(msg,"source")
+			)
+			return await self.submit(("exec",kind,data,target,args))
+		elif op=="eval":
+			source=string(msg,"source")
+			return await self.submit(("eval",source,optimize,args))
+		elif op=="stats":
+			return self.stats()
+		raise ValueError("Unknown op {}".format(op))
+	
+	async def respond(self,line,writer):
+		start=time.perf_counter()
+		self.requests+=1
+		id=None
+		try:
+			msg=json.loads(line)
+			id=msg.get("id")
+			response=json.dumps(
+				{"id":id,"ok":True,"result":await self.request(msg)}
+			)
+		except Exception as e:
+			#Including results which can't be sent as JSON
+			self.errors+=1
+			response=json.dumps({
+				"id":id,
+				"ok":False,
+				"error":type(e).__name__,
+				"message":str(e)
+			})
+		self.latency.append(time.perf_counter()-start)
+		writer.write(response.encode()+b"\n")
+	
+	async def connection(self,reader,writer):
+		'''
+		Serve one client. Requests on a connection run concurrently, so
+		responses can come back in a different order.
+		'''
+		tasks=set()
+		try:
+			while True:
+				line=await reader.readline()
+				if not line:
+					break
+				task=asyncio.ensure_future(self.respond(line,writer))
+				tasks.add(task)
+				task.add_done_callback(tasks.discard)
+			if tasks:
+				await asyncio.wait(tasks)
+		except ConnectionError:pass
+		finally:
+			writer.close()
+	
+	def stats(self):
+		latency=sorted(self.latency)
+		def percentile(p):
+			if not latency:
+				return None
+			return latency[min(len(latency)-1,int(len(latency)*p))]
+		return {
+			"requests":self.requests,
+			"collapsed":self.collapsed,
+			"batches":self.batches,
+			"errors":self.errors,
+			"inflight":len(self.inflight),
+			"cache":self.cache.stats(),
+			"latency":{
+				"p50":percentile(0.5),
+				"p90":percentile(0.9),
+				"p99":percentile(0.99),
+				"max":latency[-1] if latency else None
+			}
+		}
+	
+	async def serve(self,path=None,host="127.0.0.1",port=PORT):
+		'''
+		Return an asyncio server listening on the Unix socket path if given,
+		else on host and port.
+		'''
+		if path is not None:
+			return await asyncio.start_unix_server(self.connection,path)
+		return await asyncio.start_server(self.connection,host,port)
+	
+	def close(self):
+		self.pool.shutdown()
+
+def main(argv=None):
+	ap=argparse.ArgumentParser(description="Glu compile and execute service")
+	ap.add_argument("--unix",help="listen on this Unix socket")
+	ap.add_argument("--host",default="127.0.0.1")
+	ap.add_argument("--port",type=int,default=PORT)
+	ap.add_argument("--workers",type=int,help="worker processes")
+	ap.add_argument("--delay",type=float,default=0.002,
+		help="seconds to wait for more requests before sending a batch"
+	)
+	args=ap.parse_args(argv)
+	
+	async def run():
+		service=Service(args.workers,args.delay,cache.default)
+		try:
+			server=await service.serve(args.unix,args.host,args.port)
+			async with server:
+				await server.serve_forever()
+		finally:
+			service.close()
+	
+	try:
+		asyncio.run(run())
+	except KeyboardInterrupt:pass
+
+if __name__=="__main__":
+	main()
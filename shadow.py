@@ -0,0 +1,38 @@
+'''
+Glu's ast, code and tokenize modules have the names of standard library
+modules, so while this directory is on sys.path other packages which import
+those get Glu's instead. load imports such a package with the standard
+library versions in place, then puts Glu's back. The package keeps its own
+references to the modules it imported.
+
+This is a known limitation rather than a fix: it swaps sys.path and
+sys.modules for the whole process, so it isn't safe while other threads
+import, and a package which imports ast, code or tokenize lazily after load
+still gets Glu's. Renaming the shadowing modules would remove the need.
+'''
+import importlib
+import os
+import sys
+
+here=os.path.dirname(os.path.abspath(__file__))
+
+shadowed=["ast","code","tokenize"]
+
+def load(name):
+	'''
+	Import and return the module name as if Glu weren't on sys.path.
+	'''
+	try:
+		return sys.modules[name]
+	except KeyError:pass
+	
+	saved={x:sys.modules.pop(x) for x in shadowed if x in sys.modules}
+	path=sys.path
+	sys.path=[x for x in path if os.path.abspath(x or os.curdir)!=here]
+	try:
+		return importlib.import_module(name)
+	finally:
+		sys.path=path
+		for x in shadowed:
+			sys.modules.pop(x,None)
+		sys.modules.update(saved)
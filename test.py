@@ -1,9 +1,9 @@
 import gluasm as ga
 import glu as g
-import imp
+import importlib
 
 def reload():
-	imp.reload(ga)
-	imp.reload(g)
+	importlib.reload(ga)
+	importlib.reload(g)
 	ga.reload()
 	g.reload()
\ No newline at end of file
@@ -0,0 +1,237 @@
+'''
+Tiered execution. Programs start in the interpreter, which costs nothing up
+front, and are compiled for the cpy3 target once they are hot: after CALLS
+calls or BACKEDGES backward jumps. The compile runs on a background thread
+while calls keep being interpreted, and calls switch to the compiled
+function as soon as it is ready.
+
+A single interpreted call which takes too many backward jumps is a hot
+loop, so it waits for the compile and runs again compiled. Programs have
+no side effects, so running them again is safe.
+'''
+from collections import OrderedDict
+import threading
+import time
+
+import parse
+import asmparse
+import interpret
+import compile as c
+import optimize as opt
+import cache as cc
+
+#Calls before a program is compiled
+CALLS=100
+
+#Backward jumps before a program is compiled
+BACKEDGES=10000
+
+builders={
+	"glu":parse.build,
+	"gluasm":asmparse.parse
+}
+
+class Tiered:
+	'''
+	A callable running a code graph, interpreted until it is hot and
+	compiled after that. stats() reports the tier it is in, the calls and
+	time spent in each tier and events, the (seconds, tier) of every tier
+	change since it was made. If background is false hot programs are
+	compiled in the call which found them hot.
+	'''
+	def __init__(self,graph,optimize=True,calls=CALLS,backedges=BACKEDGES,
+			background=True,compiled=None):
+		self.graph=graph
+		self.prog=None
+		if compiled is None:
+			#Also optimizes the graph for the compiler
+			self.prog=interpret.decode(graph,optimize)
+		self.maxcalls=calls
+		self.maxbackedges=backedges
+		self.background=background
+		self.done=None #called with the compiled function, see Tiers
+		self.lock=threading.Lock()
+		self.start=time.perf_counter()
+		
+		self.func=None
+		self.tier="interpret"
+		self.thread=None
+		self.error=None
+		self.calls=0
+		self.backedges=0
+		self.interpreted=0 #calls run in each tier
+		self.compiled=0
+		self.interpret_time=0.0 #seconds spent in each tier and compiling
+		self.compiled_time=0.0
+		self.compile_time=0.0
+		self.events=[(0.0,"interpret")]
+		if compiled is not None:
+			self.switch(compiled)
+	
+	def switch(self,func):
+		self.func=func
+		self.tier="compiled"
+		self.events.append((time.perf_counter()-self.start,"compiled"))
+	
+	def build(self):
+		'''
+		Compile the graph and switch to the result. Errors leave the
+		program in the interpreter.
+		'''
+		start=time.perf_counter()
+		try:
+			func=c.compile(self.graph,"cpy3",False)
+		except Exception as e:
+			self.error=e
+			self.tier="interpret"
+			self.events.append((time.perf_counter()-self.start,"failed"))
+			return
+		finally:
+			self.compile_time+=time.perf_counter()-start
+		self.switch(func)
+		if self.done is not None:
+			self.done(func)
+	
+	def promote(self,wait):
+		'''
+		Start compiling unless it already started, waiting for it to finish
+		if wait is true.
+		'''
+		with self.lock:
+			if self.thread is None and self.func is None and self.error is None:
+				self.tier="compiling"
+				self.events.append((time.perf_counter()-self.start,"compiling"))
+				self.thread=threading.Thread(target=self.build,daemon=True)
+				self.thread.start()
+			thread=self.thread
+		if wait and thread is not None:
+			thread.join()
+	
+	def __call__(self,*args):
+		func=self.func
+		if func is not None:
+			start=time.perf_counter()
+			result=func(*args)
+			self.compiled_time+=time.perf_counter()-start
+			self.compiled+=1
+			return result
+		
+		self.calls+=1
+		limit=max(0,self.maxbackedges-self.backedges)
+		if self.thread is not None:
+			#Already compiling, only wait for it in a hot loop
+			limit=self.maxbackedges
+		start=time.perf_counter()
+		try:
+			result,jumps=interpret.run_counted(self.prog,args,limit)
+		except interpret.Hot as e:
+			self.interpret_time+=time.perf_counter()-start
+			self.backedges+=e.args[0]
+			self.promote(True)
+			if self.func is None:
+				return interpret.run(self.prog,*args)
+			return self(*args)
+		self.interpret_time+=time.perf_counter()-start
+		self.interpreted+=1
+		self.backedges+=jumps
+		
+		if self.calls>=self.maxcalls or self.backedges>=self.maxbackedges:
+			self.promote(not self.background)
+		return result
+	
+	def stats(self):
+		return {
+			"tier":self.tier,
+			"calls":self.interpreted+self.compiled,
+			"backedges":self.backedges,
+			"interpret":{
+				"calls":self.interpreted,
+				"seconds":self.interpret_time
+			},
+			"compiled":{
+				"calls":self.compiled,
+				"seconds":self.compiled_time
+			},
+			"compile_seconds":self.compile_time,
+			"error":None if self.error is None else str(self.error),
+			"events":list(self.events)
+		}
+
+class Tiers:
+	'''
+	Tiered programs by source, so running the same source again counts
+	towards the same program. Holds at most maxentries programs, dropping
+	the least recently used. Compiled functions are shared with the compile
+	cache, so a source compiled before starts out compiled.
+	'''
+	def __init__(self,maxentries=1024,compiled=cc.default,**options):
+		self.maxentries=maxentries
+		self.cache=compiled
+		self.options=options #passed on to every Tiered
+		self.lock=threading.Lock()
+		self.entries=OrderedDict() #(lang, source, level):Tiered
+	
+	def get(self,source,lang="glu",optimize=True):
+		'''
+		Return the Tiered program of a source. Sources which aren't a str,
+		like file objects, can only be read once, so they get a new program
+		which isn't kept.
+		'''
+		level=opt.tolevel(optimize)
+		if lang not in builders:
+			raise ValueError("Unknown source language {}".format(lang))
+		if not isinstance(source,str):
+			return Tiered(builders[lang](source),level,**self.options)
+		
+		with self.lock:
+			try:
+				x=self.entries[(lang,source,level)]
+				self.entries.move_to_end((lang,source,level))
+				return x
+			except KeyError:pass
+		
+		func=None
+		if self.cache is not None:
+			#Same key as glu.compile and gluasm.compile
+			key=self.cache.key(source,lang,"cpy3",
+				{"optimize":level,"inputs":True}
+			)
+			func=self.cache.find(key)
+		x=Tiered(builders[lang](source),level,compiled=func,**self.options)
+		if self.cache is not None and func is None:
+			x.done=lambda func:self.cache.put(key,func)
+		
+		with self.lock:
+			x=self.entries.setdefault((lang,source,level),x)
+			while len(self.entries)>self.maxentries:
+				self.entries.popitem(last=False)
+		return x
+	
+	def run(self,source,*args,lang="glu",optimize=True):
+		return self.get(source,lang,optimize)(*args)
+	
+	def stats(self):
+		'''
+		Return the number of programs in each tier and the totals of their
+		stats.
+		'''
+		with self.lock:
+			programs=list(self.entries.values())
+		out={
+			"programs":len(programs),
+			"tiers":{},
+			"interpret":{"calls":0,"seconds":0.0},
+			"compiled":{"calls":0,"seconds":0.0},
+			"compile_seconds":0.0
+		}
+		for x in programs:
+			s=x.stats()
+			out["tiers"][s["tier"]]=out["tiers"].get(s["tier"],0)+1
+			for tier in ("interpret","compiled"):
+				out[tier]["calls"]+=s[tier]["calls"]
+				out[tier]["seconds"]+=s[tier]["seconds"]
+			out["compile_seconds"]+=s["compile_seconds"]
+		return out
+
+#Used by glu.exec and gluasm.exec
+default=Tiers()
@@ -1,5 +1,7 @@
 import parsebase as pb
+from array import array
 import string
+import re
 
 IDENT_STARTCHARS=string.ascii_letters+"$_";
 IDENT_CHARS=IDENT_STARTCHARS+string.digits
@@ -7,14 +9,29 @@ IDENT_CHARS=IDENT_STARTCHARS+string.digits
 binary={"+","-","*","/","="}
 miscops={"(",")",";","{","}"}
 
+#Token kinds, shared by token objects and TokenStream columns
+NUMBER=0
+IDENT=1
+OPERATOR=2
+COMMENT=3
+
 class Token:
 	'''
-	Base class for tokens.
+	Base class for tokens. A token keeps its offset and the parsebase.Lines
+	of its text, its line and column are only worked out when read.
 	'''
-	def __init__(self,text,line,col):
+	def __init__(self,text,pos,lines):
 		self.text=text
-		self.line=line
-		self.col=col
+		self.pos=pos
+		self.lines=lines
+	
+	@property
+	def line(self):
+		return self.lines.position(self.pos)[0]
+	
+	@property
+	def col(self):
+		return self.lines.position(self.pos)[1]
 	
 	def __repr__(self):
 		return self.text
@@ -35,8 +52,10 @@ class NumberToken(ValueToken):
 	'''
 	A token representing any number constant.
 	'''
-	def __init__(self,text,dot,line,col):
-		ValueToken.__init__(self,text,line,col)
+	kind=NUMBER
+	
+	def __init__(self,text,dot,pos,lines):
+		ValueToken.__init__(self,text,pos,lines)
 		if dot:
 			self.val=float(text)
 		else:
@@ -46,209 +65,426 @@ class IdentToken(ValueToken):
 	'''
 	A token representing an identifer.
 	'''
-	pass
+	kind=IDENT
 
 class OperatorToken(Token):
 	'''
 	A token representing any operator.
 	'''
-	pass
+	kind=OPERATOR
 
 class CommentToken(Token):
 	'''
 	A token representing a comment (single or multi-lined)
 	'''
-	def __init__(self,data,line,col):
+	kind=COMMENT
+	
+	def __init__(self,data,pos,lines):
 		def stringify(x):
 			if type(x) is str:
 				return x
-			return "#("+''.join(stringify(e) for e in x)+")#"
+			
+			#Walk the nested lists with a stack of iterators so deeply
+			# nested comments don't hit the recursion limit
+			parts=["#("]
+			stack=[iter(x)]
+			while stack:
+				for e in stack[-1]:
+					if type(e) is str:
+						parts.append(e)
+					else:
+						parts.append("#(")
+						stack.append(iter(e))
+						break
+				else:
+					stack.pop()
+					parts.append(")#")
+			return ''.join(parts)
 		
-		Token.__init__(self,stringify(data),line,col)
+		Token.__init__(self,stringify(data),pos,lines)
 		
 		self.data=data
 	
 	def __repr__(self):
 		return self.text
 
+#Master pattern for the scanner, one alternative per rule. The name of the
+# matching group selects the rule so every character is only read once.
+scanner=re.compile(r'''
+	(?P<space>\s+)
+	|(?P<number>[0-9]+(?:\.[0-9]*)?|\.[0-9]+)
+	|(?P<op>[-+*/=();{}])
+	|(?P<ident>[A-Za-z$_][A-Za-z0-9$_]*)
+	|(?P<mlcomment>\#\()
+	|(?P<comment>\#[^\r\n]*)
+''',re.X)
+
+#Delimiters which change the nesting depth of a multiline comment
+mlcomment_delim=re.compile(r"\#\(|\)\#")
+restofline=re.compile(r"[^\r\n]*")
+
 class Tokenizer(pb.ParserBase):
 	def __init__(self,s):
 		pb.ParserBase.__init__(self,s)
+		self.start=0 #offset of the last token
 	
-	def parse_literal(self,set):
-		x=self.pos
-		tok=None
-		
-		while self.pos<len(self.text):
-			t=self.text[x:self.pos+1]
-			if t in set:
-				tok=t
-				self.pos+=1
-			else:
-				break
-		
-		if tok:
-			self.col+=self.pos-x
-			return tok
-		
-		return None
-	
-	def parse_number(self):
+	def parse_mlcomment(self):
 		'''
-		Attempt to parse and return the next number token, else return None.
+		Parse the body of a multiline comment starting just after its opening
+		#( and return its contents as a list of strings and nested lists.
 		'''
-		dot=False
-		x=self.pos
-		col=self.col
+		text=self.text
 		
-		while self.pos<self.length:
-			c=self.text[self.pos]
-			if c.isdigit():pass
-			elif c=='.' and not dot:
-				dot=True
+		stack=[[]]
+		x=self.pos
+		for m in mlcomment_delim.finditer(text,self.pos):
+			stack[-1].append(text[x:m.start()])
+			x=m.end()
+			if m.group()=="#(":
+				stack.append([])
 			else:
-				break
-			self.pos+=1
-		
-		num=self.text[x:self.pos]
-		if num:
-			self.col+=self.pos-x
-			return NumberToken(num,dot,self.line,col)
+				data=stack.pop()
+				if not stack:
+					self.pos=x
+					return data
+				stack[-1].append(data)
 		
-		return None
+		raise pb.ParseError("Unterminated multiline comment",
+			*self.position(self.pos-2)
+		)
 	
-	def parse_op(self):
+	def parse_comment(self):
 		'''
-		Attempt to parse and return the next operator token, else return None.
+		Attempt to parse and return the next comment, else return None.
 		'''
-		col=self.col
-		
-		op=self.parse_literal(binary)
-		if op:
-			return OperatorToken(op,self.line,col)
+		m=scanner.match(self.text,self.pos)
+		if m is None:
+			return None
 		
-		op=self.parse_literal(miscops)
-		if op:
-			return OperatorToken(op,self.line,col)
+		pos=self.pos
+		kind=m.lastgroup
+		if kind=="mlcomment":
+			self.pos=m.end()
+			return CommentToken(self.parse_mlcomment(),pos,self.lines)
+		elif kind=="comment":
+			self.pos=m.end()
+			return CommentToken(m.group()[1:],pos,self.lines)
 		
 		return None
 	
-	def parse_ident(self):
+	def skip_mlcomment(self):
 		'''
-		Attempt to parse and return the next identifier, else return None.
+		Skip the body of a multiline comment without building its contents.
 		'''
-		col=self.col
-		
-		if self.pos>=self.length:
-			return None
-		
-		x=self.pos
-		
-		if self.text[self.pos] not in IDENT_STARTCHARS:
-			return None
-		
-		self.pos+=1
-		
-		while self.pos<self.length and self.text[self.pos] in IDENT_CHARS:
-			self.pos+=1
-		
-		ident=self.text[x:self.pos]
-		if ident:
-			self.col+=self.pos-x
-			return IdentToken(ident,self.line,col)
+		depth=1
+		for m in mlcomment_delim.finditer(self.text,self.pos):
+			if m.group()=="#(":
+				depth+=1
+			else:
+				depth-=1
+				if depth==0:
+					self.pos=m.end()
+					return
 		
-		return None
+		raise pb.ParseError("Unterminated multiline comment",
+			*self.position(self.pos-2)
+		)
 	
-	def parse_comment(self):
+	def next(self):
 		'''
-		Attempt to parse and return the next comment, else return None.
+		Attempt to parse and return the next token, else return None.
 		'''
+		text=self.text
+		match=scanner.match
 		
-		def parse_mlcomment_internals(self):
-			data=[]
-			x=self.pos
-			col=self.col-2
-			line=self.line
+		#Comment tokens shouldn't even reach the AST builder, loop until
+		# the next token isn't a comment.
+		while self.pos<self.length:
+			m=match(text,self.pos)
+			if m is None:
+				raise pb.ParseError(
+					"Unrecognized character '{}'".format(text[self.pos]),
+					self.line,self.col
+				)
 			
-			while self.pos<self.length:
-				c=self.text[self.pos]
-				if c=="#":
-					self.pos+=1
-					if self.pos<self.length:
-						if self.text[self.pos]=="(":
-							data.append(self.text[x:self.pos])
-							data.append(parse_mlcomment_internals(self))
-							x=self.pos
-					else:
-						break
-				elif c==")":
-					self.pos+=1
-					if self.pos<self.length:
-						if self.text[self.pos]=="#":
-							self.pos+=1
-							return CommentToken(data,line,col)
-					else:
-						break
-				self.pos+=1
+			kind=m.lastgroup
+			end=m.end()
+			if kind=="space" or kind=="comment":
+				self.pos=end
+				continue
+			elif kind=="mlcomment":
+				self.pos=end
+				self.skip_mlcomment()
+				continue
+			
+			tok=m.group()
+			pos=self.start=self.pos
+			self.pos=end
 			
-			raise pb.ParseError("Unterminated multiline comment",line,col)
+			if kind=="number":
+				return NumberToken(tok,"." in tok,pos,self.lines)
+			elif kind=="op":
+				return OperatorToken(tok,pos,self.lines)
+			elif kind=="ident":
+				return IdentToken(tok,pos,self.lines)
 		
-		if self.pos>=self.length:
-			return None
+		return None
+	
+	def hasNext(self):
+		return self.pos<self.length
+
+class StreamTokenizer(Tokenizer):
+	'''
+	Tokenizer which reads its source incrementally from a file object or an
+	iterable of chunks (see parsebase.chunks) instead of requiring the whole
+	text up front. Only the unconsumed tail of the input is buffered, so
+	memory stays bounded by the chunk size plus the longest single token.
+	Every buffer gets its own line index, built when it is filled, so
+	tokens from earlier buffers still know their positions.
+	'''
+	def __init__(self,src,chunksize=pb.CHUNKSIZE):
+		Tokenizer.__init__(self,"")
+		self.source=pb.chunks(src,chunksize)
+		self.eof=False
+		#Whether we stopped in the middle of a single line comment
+		self.incomment=False
+	
+	def fill(self):
+		'''
+		Drop the consumed part of the buffer and append the next chunk.
 		
-		if self.text[self.pos]!="#":
-			return None
+		Returns false once the source is exhausted.
+		'''
+		if self.eof:
+			return False
 		
-		self.pos+=1
+		for chunk in self.source:
+			line,col=self.position()
+			self.text=self.text[self.pos:]+chunk
+			self.pos=0
+			self.length=len(self.text)
+			self.lines=pb.Lines(self.text,line,col).build()
+			return True
 		
-		if self.text[self.pos]=="(":
-			self.pos+=1
-			
-			return parse_mlcomment_internals(self)
-		else:
-			col=self.col
-			x=self.pos
-			while self.pos<self.length:
-				if self.text[self.pos] in "\r\n":
-					break
-				self.pos+=1
+		self.eof=True
+		return False
+	
+	def skip_mlcomment(self):
+		#The buffer may be refilled before an error can be raised
+		line,col=self.position(self.pos-2)
+		depth=1
+		while True:
+			last=self.pos
+			for m in mlcomment_delim.finditer(self.text,self.pos):
+				last=m.end()
+				if m.group()=="#(":
+					depth+=1
+				else:
+					depth-=1
+					if depth==0:
+						self.pos=last
+						return
 			
-			self.col+=self.pos-x
-			return CommentToken(self.text[x:self.pos],self.line,col)
+			#Keep the last character in case it starts a delimiter which is
+			# completed by the next chunk, and don't split a \r\n
+			keep=self.length-1
+			if keep>0 and self.text[keep-1]=="\r":
+				keep-=1
+			self.pos=max(last,keep)
+			if not self.fill():
+				raise pb.ParseError("Unterminated multiline comment",line,col)
 	
 	def next(self):
 		'''
 		Attempt to parse and return the next token, else return None.
 		'''
-		if self.pos>=self.length:
-			return None
-		
-		self.space()
+		match=scanner.match
 		
-		#Comment tokens shouldn't even reach the AST builder, loop until
-		# the next token isn't a comment.
-		tok=True
-		while tok:
-			tok=self.parse_number()
-			if tok:
-				return tok
+		while True:
+			if self.incomment:
+				self.pos=restofline.match(self.text,self.pos).end()
+				if self.pos==self.length and self.fill():
+					continue
+				self.incomment=False
+			
+			if self.pos>=self.length and not self.fill():
+				return None
+			
+			text=self.text
+			m=match(text,self.pos)
 			
-			tok=self.parse_op()
-			if tok:
-				return tok
+			#Anything which touches the end of the buffer might continue in
+			# the next chunk, so refill and try again
+			if m is None:
+				if self.pos==self.length-1 and self.fill():
+					continue
+				raise pb.ParseError(
+					"Unrecognized character '{}'".format(text[self.pos]),
+					self.line,self.col
+				)
 			
-			tok=self.parse_ident()
-			if tok:
-				return tok
+			kind=m.lastgroup
+			end=m.end()
+			if end==self.length and not self.eof:
+				if kind=="space":
+					#A trailing \r may be half of a \r\n
+					if text[end-1]=="\r":
+						end-=1
+					self.pos=end
+					self.fill()
+				elif kind=="comment" and end-self.pos>1:
+					self.pos=end
+					self.incomment=True
+				else:
+					self.fill()
+				continue
 			
-			tok=self.parse_comment()
+			if kind=="space" or kind=="comment":
+				self.pos=end
+				continue
+			elif kind=="mlcomment":
+				self.pos=end
+				self.skip_mlcomment()
+				continue
+			
+			tok=m.group()
+			pos=self.pos
+			self.pos=end
+			
+			if kind=="number":
+				return NumberToken(tok,"." in tok,pos,self.lines)
+			elif kind=="op":
+				return OperatorToken(tok,pos,self.lines)
+			return IdentToken(tok,pos,self.lines)
+	
+	def hasNext(self):
+		return self.pos<self.length or self.fill()
+
+
+class TokenStream:
+	'''
+	Compact token stream for bulk work. Rather than one object per token,
+	the kinds and start/end offsets of every token are kept in parallel
+	arrays, token text is sliced from the source on demand and positions
+	are looked up in the line index of the source.
+	'''
+	def __init__(self,s):
+		self.source=s
+		self.kinds=kinds=array('B')
+		self.starts=starts=array('q')
+		self.ends=ends=array('q')
 		
-		if self.pos<len(self.text):
-			raise pb.ParseError(
-				"Unrecognized character '{}'".format(self.text[self.pos]),
-				self.line,self.col
-			)
-		return None
+		rulekind={"number":NUMBER,"ident":IDENT,"op":OPERATOR}
+		tk=Tokenizer(s)
+		match=scanner.match
+		while tk.pos<tk.length:
+			m=match(s,tk.pos)
+			if m is None:
+				raise pb.ParseError(
+					"Unrecognized character '{}'".format(s[tk.pos]),
+					tk.line,tk.col
+				)
+			
+			kind=m.lastgroup
+			end=m.end()
+			if kind=="space" or kind=="comment":
+				tk.pos=end
+				continue
+			elif kind=="mlcomment":
+				tk.pos=end
+				tk.skip_mlcomment()
+				continue
+			
+			kinds.append(rulekind[kind])
+			starts.append(tk.pos)
+			ends.append(end)
+			tk.pos=end
+		self.lines=tk.lines
+	
+	def __len__(self):
+		return len(self.kinds)
+	
+	def __getitem__(self,i):
+		return TokenRef(self,i)
+	
+	def text(self,i):
+		return self.source[self.starts[i]:self.ends[i]]
+	
+	def position(self,i):
+		'''
+		Return the (line, col) of token i.
+		'''
+		return self.lines.position(self.starts[i])
+	
+	def cursor(self):
+		return Cursor(self)
+
+class TokenRef:
+	'''
+	Lightweight view of one token in a TokenStream, with the same interface
+	as the token classes.
+	'''
+	__slots__=("stream","index")
+	
+	def __init__(self,stream,index):
+		self.stream=stream
+		self.index=index
+	
+	@property
+	def kind(self):
+		return self.stream.kinds[self.index]
+	
+	@property
+	def text(self):
+		return self.stream.text(self.index)
+	
+	@property
+	def line(self):
+		return self.stream.position(self.index)[0]
+	
+	@property
+	def col(self):
+		return self.stream.position(self.index)[1]
+	
+	@property
+	def val(self):
+		text=self.text
+		if "." in text:
+			return float(text)
+		return int(text)
+	
+	def __repr__(self):
+		return self.text
+	
+	def __eq__(self,x):
+		return self.text==x
+	
+	def __ne__(self,x):
+		return self.text!=x
+
+class Cursor:
+	'''
+	Walks a TokenStream with the same next/hasNext interface as Tokenizer,
+	returning TokenRefs.
+	'''
+	def __init__(self,stream):
+		self.stream=stream
+		self.index=0
+		self.pos=0
+	
+	def next(self):
+		'''
+		Return the next token, else None.
+		'''
+		stream=self.stream
+		i=self.index
+		if i>=len(stream.kinds):
+			self.pos=len(stream.source)
+			return None
+		
+		self.index=i+1
+		self.pos=stream.ends[i]
+		return TokenRef(stream,i)
 	
 	def hasNext(self):
-		return self.pos<self.length
\ No newline at end of file
+		return self.pos<len(self.stream.source)
\ No newline at end of file